@@ -21,6 +21,7 @@ const fadeIn = keyframes`
 
 const AppointmentList = () => {
   const [appointments, setAppointments] = useState([]);
+  const [failedBookings, setFailedBookings] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
   const messagesEndRef = useRef(null);
@@ -75,6 +76,7 @@ const AppointmentList = () => {
         }
 
         setAppointments(appointmentsData);
+        setFailedBookings(response.data.failedBookings || []);
         setLoading(false);
       } catch (err) {
         console.error('Error fetching appointments:', err);
@@ -149,6 +151,16 @@ const AppointmentList = () => {
       });
     }
 
+    if (failedBookings.length > 0) {
+      const failedList = failedBookings
+        .map(booking => `- ${booking.user_name} (${booking.user_email}): ${formatDate(booking.start)} at ${formatTime(booking.start)}, ${booking.reason}`)
+        .join('\n');
+      messages.push({
+        text: `These bookings were confirmed to patients but could not be added to your calendar:\n${failedList}`,
+        sender: 'bot'
+      });
+    }
+
     return messages;
   };
 
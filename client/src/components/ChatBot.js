@@ -28,6 +28,10 @@ const typing = keyframes`
   100% { width: 25px }
 `;
 
+const CHAT_SOCKET_URL = 'ws://localhost:5000/ws/appointment';
+const SOCKET_RETRY_MIN_MS = 1000;
+const SOCKET_RETRY_MAX_MS = 30000;
+
 const ChatBot = () => {
   const [messages, setMessages] = useState([]);
   const [input, setInput] = useState('');
@@ -35,6 +39,8 @@ const ChatBot = () => {
   const messagesEndRef = useRef(null);
   const [isLoggedIn, setIsLoggedIn] = useState(!!localStorage.getItem('token'));
   const [sessionId, setSessionId] = useState(localStorage.getItem('sessionId') || '');
+  const socketRef = useRef(null);
+  const awaitingReplyRef = useRef(null);
 
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
@@ -60,6 +66,68 @@ const ChatBot = () => {
     ]);
   };
 
+  // Keep one chat connection open while logged in; messages fall back to POST when it is not available
+  useEffect(() => {
+    if (!isLoggedIn || typeof WebSocket === 'undefined') {
+      return undefined;
+    }
+
+    let socket = null;
+    let retryTimer = null;
+    let retryDelay = SOCKET_RETRY_MIN_MS;
+    let stopped = false;
+
+    const connect = () => {
+      const current = new WebSocket(CHAT_SOCKET_URL);
+      socket = current;
+      current.onopen = () => {
+        current.send(JSON.stringify({ token: localStorage.getItem('token') }));
+      };
+      current.onmessage = (event) => {
+        const data = JSON.parse(event.data);
+        if (data.status === 'connected') {
+          socketRef.current = current;
+          retryDelay = SOCKET_RETRY_MIN_MS;
+          return;
+        }
+        awaitingReplyRef.current = null;
+        setIsTyping(false);
+        setMessages((prevMessages) => [
+          ...prevMessages,
+          { text: data.message || data.error || 'Sorry, I encountered an error. Please try again later.', sender: 'bot' },
+        ]);
+      };
+      current.onclose = () => {
+        if (socketRef.current === current) {
+          socketRef.current = null;
+        }
+        // A message sent on this socket will not be answered any more
+        if (awaitingReplyRef.current === current) {
+          awaitingReplyRef.current = null;
+          setIsTyping(false);
+          setMessages((prevMessages) => [
+            ...prevMessages,
+            { text: 'The connection was lost before I could answer. Please send your message again.', sender: 'bot' },
+          ]);
+        }
+        // Reopen after an idle close or a server restart, waiting longer after each failed attempt
+        if (!stopped) {
+          retryTimer = setTimeout(connect, retryDelay);
+          retryDelay = Math.min(retryDelay * 2, SOCKET_RETRY_MAX_MS);
+        }
+      };
+    };
+    connect();
+
+    return () => {
+      stopped = true;
+      clearTimeout(retryTimer);
+      socketRef.current = null;
+      awaitingReplyRef.current = null;
+      socket.close();
+    };
+  }, [isLoggedIn]);
+
   useEffect(() => {
     if (sessionId) {
       localStorage.setItem('sessionId', sessionId);
@@ -80,6 +148,12 @@ const ChatBot = () => {
         return;
       }
       setIsTyping(true);
+      const socket = socketRef.current;
+      if (socket && socket.readyState === WebSocket.OPEN) {
+        awaitingReplyRef.current = socket;
+        socket.send(JSON.stringify({ text: userMessage }));
+        return;
+      }
       try {
         const token = localStorage.getItem('token');
         const response = await fetch('http://localhost:5000/appointment', {
@@ -1,11 +1,24 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
+from flask_sock import Sock
 import jwt
-from pages.appointment_processor import handle_appointment_request
+import json
+import threading
+from pages.appointment_processor import handle_appointment_request, handle_conversation_message, ConnectionConversation
 from pages.google_login import handle_google_login
 from pages.doctor_login import handle_doctor_login
-from pages.calendar_utils import get_upcoming_appointments
+from pages.calendar_utils import get_upcoming_appointments, start_appointment_index_sync
+from pages.reminder_scheduler import reminder_scheduler
+from pages.booking_journal import booking_journal
+from pages.rate_limiter import rate_limited, rate_limited_by, get_client_identity, limiter, availability_limiter
+from pages.availability import get_availability, clear_availability_cache, MAX_RANGE_DAYS
+from pages.analytics import get_utilization, MAX_RANGE_DAYS as ANALYTICS_MAX_RANGE_DAYS
+from pages.idempotency_store import idempotency_store, fingerprint_request, NEW, IN_PROGRESS, MISMATCH
+from pages.request_profiler import profiled, profile_store, PROFILE_HEADER
+from pages.response_utils import json_response, parse_fields, select_fields, dumps_json
+from pages.clinic_time import clinic_today
 import os
+from datetime import date, timedelta
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -16,9 +29,47 @@ if not secret_key:
 
 app = Flask(__name__)
 
+WS_IDLE_TIMEOUT_SECONDS = int(os.environ.get('WS_IDLE_TIMEOUT_SECONDS', '120'))
+WS_AUTH_TIMEOUT_SECONDS = int(os.environ.get('WS_AUTH_TIMEOUT_SECONDS', '10'))
+# Every open socket holds a server thread, so only this many per process; the rest of the threads stay free for HTTP
+WS_MAX_CONNECTIONS = int(os.environ.get('WS_MAX_CONNECTIONS', '100'))
+WS_MAX_MESSAGE_BYTES = 4096
+app.config['SOCK_SERVER_OPTIONS'] = {'ping_interval': 25, 'max_message_size': WS_MAX_MESSAGE_BYTES}
+sock = Sock(app)
+ws_slots = threading.BoundedSemaphore(WS_MAX_CONNECTIONS)
+
+APPOINTMENT_FIELDS = ['id', 'summary', 'start', 'end', 'user_name', 'user_email', 'created']
+
 CORS(app)  
 
+def get_doctor_payload():
+    """
+    Verify that the request carries a doctor's token.
+    Returns (payload, error_response).
+    """
+    token = None
+    auth_header = request.headers.get('Authorization')
+    if auth_header and auth_header.startswith('Bearer '):
+        token = auth_header.split(' ')[1]
+
+    if not token:
+        return None, (jsonify({'error': 'Authentication required'}), 401)
+
+    try:
+        payload = jwt.decode(token, secret_key, algorithms=["HS256"])
+    except jwt.ExpiredSignatureError:
+        return None, (jsonify({'error': 'Token expired. Please log in again'}), 401)
+    except jwt.InvalidTokenError:
+        return None, (jsonify({'error': 'Invalid token. Please log in again'}), 401)
+
+    if payload.get('role') != 'doctor':
+        return None, (jsonify({'error': 'Access denied. Doctor privileges required'}), 403)
+    return payload, None
+
+
 @app.route('/appointment', methods=['POST', 'OPTIONS'])
+@rate_limited
+@profiled
 def appointment():
     """
     Navigates to the function for handling requests and messages from the user.
@@ -26,7 +77,7 @@ def appointment():
     if request.method == 'OPTIONS':
         response = jsonify({})
         response.headers.add('Access-Control-Allow-Origin', '*')
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
+        response.headers.add('Access-Control-Allow-Headers', f'Content-Type,Authorization,Idempotency-Key,{PROFILE_HEADER}')
         response.headers.add('Access-Control-Allow-Methods', 'POST')
         return response
     
@@ -36,15 +87,112 @@ def appointment():
     auth_header = request.headers.get('Authorization')
     if auth_header and auth_header.startswith('Bearer '):
         token = auth_header.split(' ')[1]
-    result = handle_appointment_request(text, token)
-    response = jsonify({
+
+    # Retries with the same Idempotency-Key get the stored reply without touching the calendar again
+    idempotency_key = request.headers.get('Idempotency-Key')
+    if idempotency_key:
+        idempotency_key = f"{get_client_identity()}:{idempotency_key}"
+        state, stored_response = idempotency_store.begin(idempotency_key, fingerprint_request(data))
+        if state == MISMATCH:
+            return jsonify({'error': 'Idempotency-Key was already used for a different message'}), 422
+        if state == IN_PROGRESS:
+            return jsonify({'error': 'A request with this Idempotency-Key is still being processed'}), 409
+        if state != NEW:
+            response = jsonify(stored_response)
+            response.headers.add('Idempotent-Replayed', 'true')
+            response.headers.add('Access-Control-Allow-Origin', '*')
+            return response
+
+    try:
+        result = handle_appointment_request(text, token)
+    except Exception:
+        if idempotency_key:
+            idempotency_store.release(idempotency_key)
+        raise
+
+    if result.get("event_id") or result.get("booking_id"):
+        clear_availability_cache()
+
+    body = {
         "message": result["message"],
         "status": result["status"],
-    })
+    }
+    if idempotency_key:
+        idempotency_store.complete(idempotency_key, body)
+    response = jsonify(body)
     response.headers.add('Access-Control-Allow-Origin', '*')
     return response
 
 
+def _send_frame(ws, body):
+    ws.send(dumps_json(body).decode('utf-8'))
+
+
+@sock.route('/ws/appointment')
+def appointment_socket(ws):
+    """
+    Persistent chat channel. The first frame authenticates the connection: {"token": "<jwt>"}.
+    After that every {"text": "..."} frame gets one {"message", "status"} frame back, as from POST /appointment.
+    When the process already holds WS_MAX_CONNECTIONS sockets the connection is closed and the client falls back to POST.
+    """
+    if not ws_slots.acquire(blocking=False):
+        ws.close(reason=1013, message='Too many connections')
+        return
+    try:
+        _serve_socket(ws)
+    finally:
+        ws_slots.release()
+
+
+def _serve_socket(ws):
+    auth_message = ws.receive(timeout=WS_AUTH_TIMEOUT_SECONDS)
+    if auth_message is None:
+        ws.close(message='Authentication timeout')
+        return
+    try:
+        auth_frame = json.loads(auth_message)
+    except ValueError:
+        auth_frame = {}
+    if not isinstance(auth_frame, dict):
+        auth_frame = {}
+    conversation = ConnectionConversation(auth_frame.get('token'))
+    identity = f"user:{conversation.user_email}" if conversation.authenticated else f"ip:{request.remote_addr}"
+    _send_frame(ws, {'status': 'connected', 'authenticated': conversation.authenticated})
+
+    while True:
+        frame = ws.receive(timeout=WS_IDLE_TIMEOUT_SECONDS)
+        if frame is None:
+            ws.close(message='Idle timeout')
+            return
+
+        try:
+            text = json.loads(frame).get('text', '')
+        except (ValueError, AttributeError):
+            _send_frame(ws, {'error': 'Frames must be JSON objects like {"text": "..."}', 'status': 'error'})
+            continue
+
+        # The socket shares the per-user limit with the POST endpoint
+        allowed, retry_after = limiter.hit(identity)
+        if not allowed:
+            _send_frame(ws, {
+                'error': 'Too many requests. Please slow down and try again shortly.',
+                'retry_after': retry_after,
+                'status': 'error'
+            })
+            continue
+
+        try:
+            result = handle_conversation_message(text, conversation)
+        except Exception as e:
+            print(f"Error handling chat message: {e}")
+            _send_frame(ws, {'message': 'Sorry, I encountered an error. Please try again later.', 'status': 'error'})
+            continue
+
+        if result.get("event_id") or result.get("booking_id"):
+            clear_availability_cache()
+        _send_frame(ws, {'message': result['message'], 'status': result['status']})
+
+
 @app.route('/doctor-login', methods=['POST', 'OPTIONS'])
 def doctor_login():
     """
@@ -106,13 +254,19 @@ def get_upcoming_appointments_api():
         
         if payload.get('role') != 'doctor':
             return jsonify({'error': 'Access denied. Doctor privileges required'}), 403
+        fields, fields_error = parse_fields(request.args.get('fields'), APPOINTMENT_FIELDS)
+        if fields_error:
+            return jsonify({'error': fields_error}), 400
+
         days = request.args.get('days', default=30, type=int)
         appointments = get_upcoming_appointments(days)
         
-        return jsonify({
-            'appointments': appointments,
+        return json_response({
+            'appointments': select_fields(appointments, fields),
             'count': len(appointments),
-            'doctorName': payload.get('name')
+            'doctorName': payload.get('name'),
+            # Bookings patients were told about that could not be written to the calendar
+            'failedBookings': booking_journal.failed_bookings()
         })
     except jwt.ExpiredSignatureError:
         return jsonify({'error': 'Token expired. Please log in again'}), 401
@@ -120,6 +274,107 @@ def get_upcoming_appointments_api():
         return jsonify({'error': 'Invalid token. Please log in again'}), 401
 
 
+@app.route('/availability', methods=['GET'])
+@rate_limited_by(availability_limiter)
+def availability():
+    """
+    Returns the grid of bookable half-hour slots between the from and to dates (YYYY-MM-DD, inclusive)
+    """
+    try:
+        from_date = date.fromisoformat(request.args['from']) if request.args.get('from') else clinic_today()
+        to_date = date.fromisoformat(request.args['to']) if request.args.get('to') else from_date + timedelta(days=27)
+    except ValueError:
+        return jsonify({'error': 'Dates must be in YYYY-MM-DD format'}), 400
+
+    if to_date < from_date:
+        return jsonify({'error': "'to' must not be before 'from'"}), 400
+    if (to_date - from_date).days >= MAX_RANGE_DAYS:
+        return jsonify({'error': f'The range can cover at most {MAX_RANGE_DAYS} days'}), 400
+
+    grid = get_availability(from_date, to_date)
+    if grid is None:
+        return jsonify({'error': 'Calendar service not available'}), 503
+
+    response = json_response(grid)
+    response.headers['Cache-Control'] = 'public, max-age=30'
+    return response
+
+
+@app.route('/analytics/utilization', methods=['GET', 'OPTIONS'])
+def utilization_analytics():
+    """
+    Returns booked versus available hours by weekday and hour, gaps between appointments and booking lead times
+    between the from and to dates (YYYY-MM-DD, inclusive). Doctors only.
+    """
+    if request.method == 'OPTIONS':
+        response = jsonify({})
+        response.headers.add('Access-Control-Allow-Origin', '*')
+        response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
+        response.headers.add('Access-Control-Allow-Methods', 'GET')
+        return response
+
+    _, error_response = get_doctor_payload()
+    if error_response:
+        return error_response
+
+    try:
+        to_date = date.fromisoformat(request.args['to']) if request.args.get('to') else clinic_today()
+        from_date = date.fromisoformat(request.args['from']) if request.args.get('from') else to_date - timedelta(days=90)
+    except ValueError:
+        return jsonify({'error': 'Dates must be in YYYY-MM-DD format'}), 400
+
+    if to_date < from_date:
+        return jsonify({'error': "'to' must not be before 'from'"}), 400
+    if (to_date - from_date).days >= ANALYTICS_MAX_RANGE_DAYS:
+        return jsonify({'error': f'The range can cover at most {ANALYTICS_MAX_RANGE_DAYS} days'}), 400
+
+    report = get_utilization(from_date, to_date)
+    if report is None:
+        return jsonify({'error': 'Calendar service not available'}), 503
+    return json_response(report)
+
+
+@app.route('/admin/profiles', methods=['GET'])
+def list_profiles():
+    """
+    Lists the captured request profiles, newest first. Doctors only.
+    """
+    _, error_response = get_doctor_payload()
+    if error_response:
+        return error_response
+
+    profiles = profile_store.list()
+    return jsonify({'profiles': profiles, 'count': len(profiles)})
+
+
+@app.route('/admin/profiles/<profile_id>', methods=['GET'])
+def download_profile(profile_id):
+    """
+    Downloads a captured profile as a pstats file, or as a text summary with ?format=text. Doctors only.
+    """
+    _, error_response = get_doctor_payload()
+    if error_response:
+        return error_response
+
+    profile = profile_store.get(profile_id)
+    if profile is None:
+        return jsonify({'error': 'Profile not found'}), 404
+
+    if request.args.get('format') == 'text':
+        return Response(profile['summary'], mimetype='text/plain')
+    return Response(
+        profile['stats'],
+        mimetype='application/octet-stream',
+        headers={'Content-Disposition': f'attachment; filename=profile-{profile_id}.prof'}
+    )
+
+
 if __name__ == '__main__':
+    # The debug reloader runs this file in a watcher process and again in the child that serves requests;
+    # background work starts only in the child so reminders are not sent twice
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        reminder_scheduler.start()
+        booking_journal.start_worker()
+        start_appointment_index_sync()
     app.run(debug=True)
 
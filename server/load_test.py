@@ -0,0 +1,194 @@
+"""
+Load test: replays multi-turn chat dialogues against the Flask app with many concurrent virtual patients,
+using an in-memory fake of Google Calendar.
+
+Run with:  python load_test.py --patients 50 --latency-ms 80
+Recorded dialogues can be replayed with --script dialogues.json (a JSON list of dialogues, each a list of messages).
+"""
+import argparse
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+# Settings must be in place before the app modules read them at import time
+os.environ.setdefault('SECRET_KEY', 'load-test-secret-key-that-is-long-enough')
+os.environ.setdefault('DOCTOR_USERNAME', 'loadtest')
+os.environ.setdefault('DOCTOR_PASSWORD', 'loadtest')
+os.environ.setdefault('CALENDAR_ID', 'load-test-calendar')
+os.environ['RATE_LIMIT_REQUESTS'] = '1000000'
+os.environ['BOOKING_JOURNAL_PATH'] = os.path.join(tempfile.mkdtemp(prefix='load-test-'), 'booking_journal.log')
+
+import jwt
+from app import app
+from pages import calendar_utils, appointment_processor
+from pages.booking_journal import booking_journal
+from pages.fake_calendar import FakeCalendarService
+from pages.clinic_time import clinic_today
+
+CONFIRMATION_PATTERN = re.compile(r'Appointment scheduled for (\d{4}-\d{2}-\d{2}) at (\d{2}:\d{2})')
+CLINIC_TIMES = [f"{hour:02d}:{minute:02d}" for hour in range(8, 19) for minute in (0, 30)]
+MAX_TIME_RETRIES = 2
+
+
+def clinic_days(count):
+    """
+    The next clinic days from tomorrow, Sunday to Thursday.
+    """
+    days = []
+    day = clinic_today() + timedelta(days=1)
+    while len(days) < count:
+        if day.weekday() in (6, 0, 1, 2, 3):
+            days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+def generate_dialogue(rng, days):
+    """
+    A random dialogue in one of the shapes patients use: date then time, time then date, or all at once.
+    """
+    day = rng.choice(days).strftime('%d/%m/%Y')
+    slot = rng.choice(CLINIC_TIMES)
+    shapes = [
+        [day, slot],
+        [f"{day} at {slot}"],
+        [f"at {slot}", day],
+        ["hello", f"{day} at {slot}", "thanks"],
+    ]
+    return rng.choice(shapes)
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class LoadTest:
+    """
+    Runs the virtual patients and collects per-turn latencies and booking outcomes.
+    """
+
+    def __init__(self, patients, dialogues_per_patient, scripts, seed, days):
+        self.patients = patients
+        self.dialogues_per_patient = dialogues_per_patient
+        self.scripts = scripts
+        self.seed = seed
+        self.days = days
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = Counter()
+        self.confirmations = []
+        self.errors = 0
+
+    def send(self, client, token, text, turn):
+        started = time.perf_counter()
+        response = client.post('/appointment', json={'text': text}, headers={'Authorization': f'Bearer {token}'})
+        elapsed = (time.perf_counter() - started) * 1000
+        body = response.get_json(silent=True) or {}
+        with self.lock:
+            self.latencies[turn].append(elapsed)
+            self.statuses[body.get('status', str(response.status_code))] += 1
+            if response.status_code != 200:
+                self.errors += 1
+            match = CONFIRMATION_PATTERN.search(body.get('message', ''))
+            if match:
+                self.confirmations.append(match.groups())
+        return body
+
+    def run_patient(self, index):
+        rng = random.Random(self.seed * 100003 + index)
+        client = app.test_client()
+        token = jwt.encode(
+            {'email': f'patient{index}@load.test', 'name': f'Patient {index}', 'role': 'user'},
+            os.environ['SECRET_KEY'],
+            algorithm='HS256'
+        )
+
+        for dialogue_number in range(self.dialogues_per_patient):
+            if self.scripts:
+                dialogue = self.scripts[(index + dialogue_number) % len(self.scripts)]
+            else:
+                dialogue = generate_dialogue(rng, self.days)
+
+            turn = 0
+            body = {}
+            for turn, text in enumerate(dialogue, start=1):
+                body = self.send(client, token, text, turn)
+
+            # A taken slot keeps the date in the session, so the patient tries other times like a real user would
+            retries = 0
+            while body.get('status') == 'waiting_for_time' and retries < MAX_TIME_RETRIES:
+                retries += 1
+                turn += 1
+                body = self.send(client, token, rng.choice(CLINIC_TIMES), turn)
+            if body.get('status') in ('waiting_for_time', 'waiting_for_date'):
+                self.send(client, token, 'cancel', turn + 1)
+
+    def run(self):
+        threads = [threading.Thread(target=self.run_patient, args=(i,)) for i in range(self.patients)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Multi-turn conversation load test against a fake calendar.')
+    parser.add_argument('--patients', type=int, default=20, help='concurrent virtual patients')
+    parser.add_argument('--dialogues', type=int, default=3, help='dialogues per patient')
+    parser.add_argument('--latency-ms', type=float, default=50, help='fake calendar latency per call')
+    parser.add_argument('--jitter-ms', type=float, default=20, help='extra random latency per call')
+    parser.add_argument('--days', type=int, default=3, help='clinic days the patients compete for')
+    parser.add_argument('--script', help='JSON file with recorded dialogues to replay')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--drain-timeout', type=float, default=60, help='seconds to wait for the booking journal to reach the calendar')
+    args = parser.parse_args()
+
+    scripts = None
+    if args.script:
+        with open(args.script, encoding='utf-8') as script_file:
+            scripts = json.load(script_file)
+
+    fake_calendar = FakeCalendarService(args.latency_ms / 1000, args.jitter_ms / 1000)
+    calendar_utils.service = fake_calendar
+    calendar_utils.CALENDAR_ID = os.environ['CALENDAR_ID']
+    booking_journal.start_worker()
+
+    test = LoadTest(args.patients, args.dialogues, scripts, args.seed, clinic_days(args.days))
+    wall_time = test.run()
+
+    drain_started = time.perf_counter()
+    while booking_journal.pending_intervals() and time.perf_counter() - drain_started < args.drain_timeout:
+        time.sleep(0.2)
+    pending = len(booking_journal.pending_intervals())
+    booking_journal.stop_worker()
+
+    total_requests = sum(len(values) for values in test.latencies.values())
+    confirmed_slots = Counter(test.confirmations)
+    print(f"Patients: {args.patients}, dialogues per patient: {args.dialogues}, calendar latency: {args.latency_ms} ms")
+    print(f"Requests: {total_requests} in {wall_time:.2f} s ({total_requests / wall_time:.1f} req/s), HTTP errors: {test.errors}")
+    print("Latency per turn (ms):")
+    print(f"  {'turn':>4} {'count':>7} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for turn in sorted(test.latencies):
+        values = test.latencies[turn]
+        print(f"  {turn:>4} {len(values):>7} {percentile(values, 0.5):>8.1f} {percentile(values, 0.95):>8.1f} {percentile(values, 0.99):>8.1f}")
+    print(f"Reply statuses: {dict(test.statuses)}")
+    print(f"Confirmed bookings: {len(test.confirmations)}, events in calendar: {len(fake_calendar.stored_events)}, still journaled: {pending}")
+    print(f"Double bookings: {sum(count - 1 for count in confirmed_slots.values() if count > 1)} confirmed twice, {fake_calendar.count_double_bookings()} overlapping in calendar")
+    print(f"Session store size: {len(appointment_processor.user_sessions)}")
+    print(f"Calendar API calls: {fake_calendar.calls}")
+
+
+if __name__ == '__main__':
+    main()
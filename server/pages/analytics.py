@@ -0,0 +1,179 @@
+"""
+Utilization analytics for the doctor. Appointment times are loaded once into columnar numpy arrays
+(local start minute, duration, booking lead time) and every aggregate is computed with array operations.
+"""
+import os
+from datetime import datetime, timedelta
+import numpy as np
+from pages.calendar_utils import get_appointments_between
+from pages.appointment_processor import is_within_clinic_hours
+from pages.ttl_cache import TTLCache
+from pages.clinic_time import CLINIC_TIMEZONE, clinic_tz, clinic_datetime
+
+MAX_RANGE_DAYS = 366
+ANALYTICS_CACHE_SECONDS = int(os.environ.get('ANALYTICS_CACHE_SECONDS', '300'))
+ANALYTICS_CACHE_MAX_ENTRIES = 64
+STEP_MINUTES = 15
+GAP_BUCKETS_MINUTES = [0, 30, 60, 120, 240]
+LEAD_TIME_BUCKETS_DAYS = [0, 1, 2, 7, 14, 30]
+WEEKDAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+_cache = TTLCache(ANALYTICS_CACHE_SECONDS, ANALYTICS_CACHE_MAX_ENTRIES)
+
+
+def _parse(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def _load_columns(appointments):
+    """
+    Convert the appointment dicts into arrays: local start in minutes since the epoch, duration in minutes,
+    and lead time in days (NaN when the creation time is unknown).
+    """
+    count = len(appointments)
+    local_start = np.empty(count, dtype=np.int64)
+    duration = np.empty(count, dtype=np.int64)
+    lead_days = np.full(count, np.nan)
+
+    for i, appointment in enumerate(appointments):
+        start = _parse(appointment['start'])
+        end = _parse(appointment['end'])
+        offset = start.astimezone(clinic_tz).utcoffset()
+        local_start[i] = int((start.timestamp() + offset.total_seconds()) // 60)
+        duration[i] = int((end - start).total_seconds() // 60)
+        if appointment.get('created'):
+            lead_days[i] = (start - _parse(appointment['created'])).total_seconds() / 86400
+
+    # Events end one minute early so back-to-back events do not touch; round to whole steps
+    duration = np.maximum(np.rint(duration / STEP_MINUTES).astype(np.int64), 1) * STEP_MINUTES
+    return local_start, duration, lead_days
+
+
+def _booked_minutes(local_start, duration):
+    """
+    Booked minutes per (weekday, hour), spreading long appointments over the hours they cover.
+    """
+    booked = np.zeros((7, 24))
+    if len(local_start) == 0:
+        return booked
+
+    for step in range(int(duration.max()) // STEP_MINUTES):
+        active = duration > step * STEP_MINUTES
+        minute = local_start[active] + step * STEP_MINUTES
+        # 1970-01-01 was a Thursday (weekday 3)
+        weekday = (minute // 1440 + 3) % 7
+        hour = (minute % 1440) // 60
+        np.add.at(booked, (weekday, hour), STEP_MINUTES)
+    return booked
+
+
+def _clinic_minutes_template():
+    """
+    Bookable minutes per (weekday, hour) in one week of clinic hours.
+    """
+    template = np.zeros((7, 24))
+    # Any week works; 2024-01-01 was a Monday
+    monday = datetime(2024, 1, 1)
+    for weekday in range(7):
+        for slot in range(48):
+            slot_start = clinic_tz.localize(monday + timedelta(days=weekday, minutes=slot * 30))
+            if is_within_clinic_hours(slot_start):
+                template[weekday, slot // 2] += 30
+    return template
+
+
+def _available_minutes(from_date, to_date, template):
+    """
+    Bookable minutes per (weekday, hour) over the date range.
+    """
+    days = np.arange(np.datetime64(from_date), np.datetime64(to_date) + 1)
+    # numpy counts days from 1970-01-01, a Thursday
+    weekday_counts = np.bincount((days.astype(np.int64) + 3) % 7, minlength=7)
+    return template * weekday_counts[:, None]
+
+
+def _histogram(values, edges):
+    counts = np.histogram(values, bins=np.append(edges, np.inf))[0]
+    labels = [f"{low}-{high}" for low, high in zip(edges[:-1], edges[1:])] + [f"{edges[-1]}+"]
+    return dict(zip(labels, counts.tolist()))
+
+
+def _gaps_between_appointments(local_start, duration):
+    """
+    Idle minutes between consecutive appointments on the same day.
+    """
+    if len(local_start) < 2:
+        return np.empty(0)
+    order = np.argsort(local_start)
+    starts = local_start[order]
+    ends = starts + duration[order]
+    same_day = starts[1:] // 1440 == starts[:-1] // 1440
+    gaps = starts[1:] - ends[:-1]
+    return gaps[same_day & (gaps > 0)]
+
+
+def compute_utilization(from_date, to_date):
+    """
+    Compute the utilization report between two dates (inclusive).
+    Returns None if the calendar could not be queried.
+    """
+    range_start = clinic_datetime(from_date)
+    range_end = clinic_datetime(to_date + timedelta(days=1))
+
+    appointments = get_appointments_between(range_start, range_end)
+    if appointments is None:
+        return None
+    appointments = [a for a in appointments if a.get('start') and a.get('end')]
+
+    local_start, duration, lead_days = _load_columns(appointments)
+    booked = _booked_minutes(local_start, duration)
+    available = _available_minutes(from_date, to_date, _clinic_minutes_template())
+    utilization = np.divide(booked, available, out=np.zeros_like(booked), where=available > 0)
+
+    gaps = _gaps_between_appointments(local_start, duration)
+    lead_days = lead_days[~np.isnan(lead_days)]
+    open_hours = np.flatnonzero(available.sum(axis=0))
+    hour_range = slice(open_hours.min(), open_hours.max() + 1) if len(open_hours) else slice(0, 0)
+
+    return {
+        'from': from_date.isoformat(),
+        'to': to_date.isoformat(),
+        'timezone': CLINIC_TIMEZONE,
+        'appointments': len(appointments),
+        'booked_hours': round(float(booked.sum()) / 60, 2),
+        'available_hours': round(float(available.sum()) / 60, 2),
+        'utilization': round(float(booked.sum() / available.sum()), 4) if available.sum() else 0.0,
+        'heatmap': {
+            'weekdays': WEEKDAY_NAMES,
+            'hours': list(range(24))[hour_range],
+            'booked_hours': np.round(booked[:, hour_range] / 60, 2).tolist(),
+            'available_hours': np.round(available[:, hour_range] / 60, 2).tolist(),
+            'utilization': np.round(utilization[:, hour_range], 4).tolist(),
+        },
+        'gaps_minutes': {
+            'count': int(len(gaps)),
+            'median': float(np.median(gaps)) if len(gaps) else None,
+            'histogram': _histogram(gaps, GAP_BUCKETS_MINUTES),
+        },
+        'lead_time_days': {
+            'count': int(len(lead_days)),
+            'median': round(float(np.median(lead_days)), 2) if len(lead_days) else None,
+            'p90': round(float(np.percentile(lead_days, 90)), 2) if len(lead_days) else None,
+            'histogram': _histogram(lead_days, LEAD_TIME_BUCKETS_DAYS),
+        },
+    }
+
+
+def get_utilization(from_date, to_date):
+    """
+    Return the utilization report, cached per date range.
+    """
+    key = (from_date, to_date)
+    report = _cache.get(key)
+    if report is not None:
+        return report
+
+    report = compute_utilization(from_date, to_date)
+    if report is not None:
+        _cache.set(key, report)
+    return report
@@ -0,0 +1,145 @@
+import json
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+
+class AppointmentIndex:
+    """
+    Local index from patient email to the IDs, start times and durations of their upcoming calendar events,
+    so a patient's bookings can be found without scanning the calendar.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_email = {}
+        self.by_event = {}
+
+    def add(self, email, event_id, start, duration_minutes=30):
+        """
+        Index an event for the patient.
+        """
+        if not email or not event_id:
+            return
+        email = email.lower()
+        with self.lock:
+            self._remove_locked(event_id)
+            self.by_email.setdefault(email, {})[event_id] = (start, duration_minutes)
+            self.by_event[event_id] = email
+
+    def remove(self, event_id):
+        """
+        Drop an event from the index.
+        Returns (email, start, duration_minutes) of the removed event, or None if it was not indexed.
+        """
+        with self.lock:
+            return self._remove_locked(event_id)
+
+    def move(self, event_id, new_start):
+        """
+        Update the start time of an indexed event.
+        """
+        with self.lock:
+            email = self.by_event.get(event_id)
+            if email is not None:
+                _, duration_minutes = self.by_email[email][event_id]
+                self.by_email[email][event_id] = (new_start, duration_minutes)
+
+    def duration(self, event_id, default=30):
+        """
+        Return the length in minutes of an indexed event.
+        """
+        with self.lock:
+            email = self.by_event.get(event_id)
+            if email is None:
+                return default
+            return self.by_email[email][event_id][1]
+
+    def find(self, email, now=None):
+        """
+        Return the patient's upcoming events as a list of (start, event_id) sorted by start time.
+        """
+        if not email:
+            return []
+        if now is None:
+            now = datetime.now(timezone.utc)
+        with self.lock:
+            events = self.by_email.get(email.lower(), {})
+            return sorted((start, event_id) for event_id, (start, _) in events.items() if start > now)
+
+    def intervals_between(self, time_min, time_max):
+        """
+        Return (start, end) of every indexed event that overlaps [time_min, time_max), sorted.
+        Stands in for a free/busy query when the calendar can not be reached.
+        """
+        intervals = []
+        with self.lock:
+            for events in self.by_email.values():
+                for start, duration_minutes in events.values():
+                    end = start + timedelta(minutes=duration_minutes)
+                    if start < time_max and end > time_min:
+                        intervals.append((start, end))
+        return sorted(intervals)
+
+    def replace_all(self, entries):
+        """
+        Replace the whole index with (email, event_id, start, duration_minutes) entries from a calendar sync.
+        Returns the (event_id, email, start, duration_minutes) entries that were indexed before but are missing now.
+        """
+        by_email = {}
+        by_event = {}
+        for email, event_id, start, duration_minutes in entries:
+            if not email or not event_id:
+                continue
+            email = email.lower()
+            by_email.setdefault(email, {})[event_id] = (start, duration_minutes)
+            by_event[event_id] = email
+
+        with self.lock:
+            removed = [
+                (event_id, email) + self.by_email[email][event_id]
+                for event_id, email in self.by_event.items()
+                if event_id not in by_event
+            ]
+            self.by_email = by_email
+            self.by_event = by_event
+        return removed
+
+    def save(self, path):
+        """
+        Write the index to a JSON file, replacing it atomically, so other worker processes can load it.
+        """
+        with self.lock:
+            entries = [
+                [email, event_id, start.isoformat(), duration_minutes]
+                for email, events in self.by_email.items()
+                for event_id, (start, duration_minutes) in events.items()
+            ]
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as snapshot:
+            json.dump(entries, snapshot)
+        os.replace(temp_path, path)
+
+    def load(self, path):
+        """
+        Replace the index with the one saved at path.
+        """
+        with open(path, 'r', encoding='utf-8') as snapshot:
+            entries = json.load(snapshot)
+        self.replace_all(
+            (email, event_id, datetime.fromisoformat(start), duration_minutes)
+            for email, event_id, start, duration_minutes in entries
+        )
+
+    def _remove_locked(self, event_id):
+        email = self.by_event.pop(event_id, None)
+        if email is None:
+            return None
+        events = self.by_email.get(email, {})
+        start, duration_minutes = events.pop(event_id)
+        if not events:
+            self.by_email.pop(email, None)
+        return email, start, duration_minutes
+
+
+appointment_index = AppointmentIndex()
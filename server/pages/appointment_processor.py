@@ -1,8 +1,14 @@
 import re
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import jwt
-import pytz
-from pages.calendar_utils import is_time_available, create_appointment_event
+from pages.calendar_utils import get_busy_intervals, is_calendar_configured, cancel_appointment_event, reschedule_appointment_event, weekly_recurrence, recurrence_exclusion, BOOKING_FREEBUSY_TIMEOUT_SECONDS
+from pages.appointment_index import appointment_index
+from pages.booking_journal import booking_journal
+from pages.interval_tree import IntervalTree
+from pages.clinic_time import clinic_tz, clinic_now, clinic_today, clinic_datetime, to_clinic_time
+from pages.waitlist import waitlist, WAITLIST_OFFER_MINUTES
+from pages.redis_client import get_redis_client
+import json
 import os
 from dotenv import load_dotenv
 
@@ -12,18 +18,251 @@ secret_key = os.environ.get('SECRET_KEY')
 if not secret_key:
     raise ValueError("SECRET_KEY environment variable is not set")
 
+# Conversation state is kept in process memory, or in Redis when SESSION_REDIS_URL is set so several workers can share it.
+SESSION_REDIS_URL = os.environ.get('SESSION_REDIS_URL', '')
+SESSION_TTL_SECONDS = int(os.environ.get('SESSION_TTL_SECONDS', '3600'))
+session_redis = get_redis_client(SESSION_REDIS_URL)
+
 user_sessions = {}
 
+# Patterns are compiled once at import time so each message only runs the matching
+CANCEL_PATTERNS = [re.compile(pattern) for pattern in [
+    r'\bcancel\b',
+    r'\bstop\b',
+    r'\bnever mind\b',
+    r'\bforget it\b',
+    r'\bביטול\b',
+    r'\bתעזוב\b',
+    r'\bלא רוצה\b'
+]]
+
+CANCEL_APPOINTMENT_PATTERNS = [re.compile(pattern) for pattern in [
+    r'\bcancel\s+(?:my|the|our)\s+(?:appointment|booking|visit)\b',
+    r'\bcancel\s+(?:appointment|booking)\b',
+    r'\bבטל(?:י)?\s+את\s+התור\b',
+    r'\bלבטל\s+את\s+התור\b'
+]]
+
+RESCHEDULE_PATTERNS = [re.compile(pattern) for pattern in [
+    r'\breschedule\b',
+    r'\b(?:move|change)\s+(?:my|the|our)\s+(?:appointment|booking|visit)\b',
+    r'\bלהזיז\s+את\s+התור\b',
+    r'\bלשנות\s+את\s+התור\b'
+]]
+
+DATE_PATTERNS = [re.compile(pattern) for pattern in [
+    r'(\d{1,2})[\/\.-](\d{1,2})(?:[\/\.-](\d{2,4}))?',  # MM/DD/YYYY or DD/MM/YYYY
+    r'(\d{1,2})(?:\s+|-)(january|february|march|april|may|june|july|august|september|october|november|december|jan|feb|mar|apr|jun|jul|aug|sep|oct|nov|dec)',  # DD Month
+    r'(january|february|march|april|may|june|july|august|september|october|november|december|jan|feb|mar|apr|jun|jul|aug|sep|oct|nov|dec)(?:\s+|-)(\d{1,2})',  # Month DD
+    r'(today|tomorrow|next day)'  
+]]
+
+WEEKDAY_PATTERNS = [re.compile(pattern) for pattern in [
+    r'(this|next)?\s*(monday|tuesday|wednesday|thursday|friday|saturday|sunday|mon|tue|wed|thu|fri|sat|sun)',
+    r'(?:ב|ה)?(יום\s+)?(ראשון|שני|שלישי|רביעי|חמישי|שישי|שבת)(?:\s+הבא)?'
+]]
+
+TIME_PATTERNS = [re.compile(pattern) for pattern in [
+    r'(\d{1,2})(?::(\d{2}))?\s+(am|pm)',  
+    r'(\d{1,2}):(\d{2})',  # HH:MM
+    r'at\s+(\d{1,2})(?::(\d{2}))?(?:\s+(am|pm))?'  # at HH or at HH:MM with optional am/pm
+]]
+
+THANK_YOU_PATTERNS = [re.compile(pattern) for pattern in [
+    r'\bthank(?:s| you)\b',
+    r'\bthanks\b',
+    r'\bty\b',
+    r'\bthx\b',
+    r'\bappreciate\b',
+    r'\bgrateful\b',
+    r'\bתודה\b',
+    r'\bתודה רבה\b',
+    r'\bתודה לך\b',
+    r'\bאני מודה לך\b'
+]]
+
+GOOD_DAY_PATTERNS = [re.compile(pattern) for pattern in [
+    r'\bgood day\b',
+    r'\bhave a nice day\b',
+    r'\bhave a good one\b',
+    r'\bnice day\b',
+    r'\bיום טוב\b',
+    r'\bיום נעים\b',
+    r'\bיום מוצלח\b',
+    r'\bהמשך יום נעים\b',
+    r'\bהמשך יום טוב\b',
+    r'\bשיהיה לך יום\b'
+]]
+
+GREETING_PATTERNS = [re.compile(pattern) for pattern in [
+    r'\bhello\b',
+    r'\bhi\b',
+    r'\bhey\b',
+    r'\bgood morning\b',
+    r'\bgood afternoon\b',
+    r'\bgood evening\b',
+    r'\bשלום\b',
+    r'\bהיי\b',
+    r'\bבוקר טוב\b',
+    r'\bצהריים טובים\b',
+    r'\bערב טוב\b',
+    r'\bלילה טוב\b',
+    r'\bמה שלומך\b',
+    r'\bמה נשמע\b'
+]]
+
+ENGLISH_WEEKDAYS = {
+    'monday': 0, 'mon': 0,
+    'tuesday': 1, 'tue': 1,
+    'wednesday': 2, 'wed': 2,
+    'thursday': 3, 'thu': 3,
+    'friday': 4, 'fri': 4,
+    'saturday': 5, 'sat': 5,
+    'sunday': 6, 'sun': 6
+}
+
+HEBREW_WEEKDAYS = {
+    'ראשון': 6,
+    'שני': 0,
+    'שלישי': 1,
+    'רביעי': 2,
+    'חמישי': 3,
+    'שישי': 4,
+    'שבת': 5
+}
+
+WAITLIST_LEAVE_PATTERNS = [re.compile(pattern) for pattern in [
+    r'\b(?:leave|quit|exit)\s+(?:the\s+)?wait(?:ing)?[\s-]?list\b',
+    r'\b(?:remove|take)\s+me\s+(?:from|off)\s+(?:the\s+)?wait(?:ing)?[\s-]?list\b',
+    r'(?:להסיר|הסר|הסירי)\s+אותי\s+מרשימת\s+ההמתנה'
+]]
+
+WAITLIST_JOIN_PATTERNS = [re.compile(pattern) for pattern in [
+    r'\bwait(?:ing)?[\s-]?list\b',
+    r'רשימת\s+(?:ה)?המתנה'
+]]
+
+CONFIRM_PATTERNS = [re.compile(pattern) for pattern in [
+    r'^\s*(?:yes|yeah|yep|sure|ok|okay)\b',
+    r'\baccept\b',
+    r'\b(?:book|take)\s+it\b',
+    r'^\s*כן\b',
+    r'\bמאשר(?:ת)?\b'
+]]
+
+DECLINE_PATTERNS = [re.compile(pattern) for pattern in [
+    r'^\s*(?:no|nope)\b',
+    r'\bdecline\b',
+    r'\bpass\b',
+    r'^\s*לא\b'
+]]
+
+WEEKDAY_NAME_PATTERN = re.compile(
+    r'\b(sunday|monday|tuesday|wednesday|thursday|friday|sun|mon|tue|wed|thu|fri)s?\b'
+    r'|(?:\bיום\s+|\bב)(ראשון|שני|שלישי|רביעי|חמישי|שישי)\b'
+)
+
+WAITLIST_WINDOW_PATTERNS = [re.compile(pattern) for pattern in [
+    r'between\s+(\d{1,2})(?::(\d{2}))?\s*(am|pm)?\s+and\s+(\d{1,2})(?::(\d{2}))?\s*(am|pm)?',
+    r'בין\s+(\d{1,2})(?::(\d{2}))?()\s+ל-?(\d{1,2})(?::(\d{2}))?()'
+]]
+
+# Parts of the day as (start, end) minutes after midnight
+PART_OF_DAY_WINDOWS = [(re.compile(pattern), window) for pattern, window in [
+    (r'\bmornings?\b|בבוקר', (8 * 60, 12 * 60)),
+    (r'\bafternoons?\b|אחר הצהריים|אחה"צ', (12 * 60, 16 * 60)),
+    (r'\bevenings?\b|בערב', (16 * 60, 19 * 60 + 30))
+]]
+
+RECURRING_PATTERNS = [re.compile(pattern) for pattern in [
+    r'\bevery\s+(?:other\s+)?(?:sunday|monday|tuesday|wednesday|thursday|friday|sun|mon|tue|wed|thu|fri)\b',
+    r'\b(?:weekly|biweekly)\b',
+    r'כל\s+יום\s+(?:ראשון|שני|שלישי|רביעי|חמישי|שישי)',
+    r'כל\s+(?:שבוע|שבועיים)'
+]]
+
+EVERY_OTHER_WEEK_PATTERN = re.compile(r'\bevery\s+other\b|\bevery\s+(?:2|two)\s+weeks\b|\bbiweekly\b|כל\s+שבועיים')
+
+# How long a series runs, either as a number of weeks or a number of appointments
+SERIES_LENGTH_PATTERNS = [(re.compile(pattern), unit) for pattern, unit in [
+    (r'\bfor\s+(\d{1,2})\s+weeks?\b', 'weeks'),
+    (r'\b(\d{1,2})\s+(?:times|sessions|appointments|visits)\b', 'times'),
+    (r'למשך\s+(\d{1,2})\s+שבועות', 'weeks'),
+    (r'(\d{1,2})\s+(?:פעמים|מפגשים)', 'times')
+]]
+
+SERIES_MAX_OCCURRENCES = 26
+
+CLINIC_WEEKDAYS = [6, 0, 1, 2, 3, 4]
+CLINIC_DAY_MINUTES = (8 * 60, 19 * 60 + 30)
+
+DEFAULT_APPOINTMENT_TYPE = 'standard'
+
+# Minutes per appointment type and the start-time granularity each one may use
+APPOINTMENT_TYPES = {
+    'follow_up': {'label': 'follow-up', 'minutes': 15, 'granularity': 15},
+    'standard': {'label': 'standard appointment', 'minutes': 30, 'granularity': 30},
+    'first_visit': {'label': 'first visit', 'minutes': 60, 'granularity': 30},
+}
+
+APPOINTMENT_TYPE_PATTERNS = [(appointment_type, [re.compile(pattern) for pattern in patterns]) for appointment_type, patterns in [
+    ('first_visit', [
+        r'\bfirst\s+(?:visit|appointment|time)\b',
+        r'\bnew\s+patient\b',
+        r'\bintake\b',
+        r'ביקור\s+ראשון',
+        r'פגישה\s+ראשונה'
+    ]),
+    ('follow_up', [
+        r'\bfollow[\s-]?up\b',
+        r'\bcheck[\s-]?up\b',
+        r'\bquick\s+(?:visit|appointment)\b',
+        r'ביקורת',
+        r'מעקב'
+    ]),
+    ('standard', [
+        r'\bstandard\s+(?:visit|appointment)\b',
+        r'\bregular\s+(?:visit|appointment)\b'
+    ])
+]]
+
+def _encode_session_value(value):
+    """Make dates JSON serializable for the Redis session store"""
+    if isinstance(value, date):
+        return {'__date__': value.isoformat()}
+    raise TypeError(f"Cannot store {type(value).__name__} in a session")
+
+def _decode_session_value(obj):
+    """Restore dates stored by _encode_session_value"""
+    if '__date__' in obj:
+        return date.fromisoformat(obj['__date__'])
+    return obj
+
 def get_user_session(user_id):
     """Get user session data"""
+    if session_redis is not None:
+        stored = session_redis.get(f"session:{user_id}")
+        if not stored:
+            return {}
+        data = json.loads(stored, object_hook=_decode_session_value)
+        for key in ('pending_time', 'requested_time'):
+            if key in data:
+                data[key] = tuple(data[key])
+        return data
     return user_sessions.get(user_id, {})
 
 def set_user_session(user_id, data):
     """Set user session data"""
+    if session_redis is not None:
+        session_redis.set(f"session:{user_id}", json.dumps(data, default=_encode_session_value), ex=SESSION_TTL_SECONDS)
+        return
     user_sessions[user_id] = data
 
 def clear_user_session(user_id):
     """Clear user session data"""
+    if session_redis is not None:
+        session_redis.delete(f"session:{user_id}")
+        return
     if user_id in user_sessions:
         del user_sessions[user_id]
 
@@ -38,54 +277,631 @@ def get_user_id_from_token(token):
     except:
         return "anonymous"
 
+class Conversation:
+    """
+    One patient's side of the chat: who they are, decoded from the token once, and where their booking state is kept.
+    A POST request builds one per message on top of the shared session store.
+    """
+
+    def __init__(self, token):
+        self.user_id = "anonymous"
+        self.user_email = None
+        self.user_name = "Anonymous"
+        if token:
+            try:
+                user_info = jwt.decode(token, secret_key, algorithms=['HS256'])
+                self.user_email = user_info.get('email')
+                self.user_id = self.user_email or "anonymous"
+                self.user_name = user_info.get('name', 'Guest')
+            except Exception:
+                pass
+
+    @property
+    def authenticated(self):
+        return self.user_email is not None
+
+    def get_session(self):
+        return get_user_session(self.user_id)
+
+    def set_session(self, data):
+        set_user_session(self.user_id, data)
+
+    def clear_session(self):
+        clear_user_session(self.user_id)
+
+
+class ConnectionConversation(Conversation):
+    """
+    Conversation of a persistent connection: the token is decoded once and the booking state is read from the connection.
+    Changes are written through to the shared session store, so a patient who falls back to POST
+    or reconnects after a restart carries on with the same booking.
+    """
+
+    def __init__(self, token):
+        super().__init__(token)
+        self.session = get_user_session(self.user_id) if self.authenticated else {}
+
+    def get_session(self):
+        return self.session
+
+    def set_session(self, data):
+        self.session = data
+        if self.authenticated:
+            set_user_session(self.user_id, data)
+
+    def clear_session(self):
+        self.session = {}
+        if self.authenticated:
+            clear_user_session(self.user_id)
+
+
 def check_cancel_request(text):
     """
     Check if user wants to cancel the current booking process
     """
-    cancel_patterns = [
-        r'\bcancel\b',
-        r'\bstop\b',
-        r'\bnever mind\b',
-        r'\bforget it\b',
-        r'\bביטול\b',
-        r'\bתעזוב\b',
-        r'\bלא רוצה\b'
-    ]
-    
     text_lower = text.lower()
-    for pattern in cancel_patterns:
-        if re.search(pattern, text_lower):
+    for pattern in CANCEL_PATTERNS:
+        if pattern.search(text_lower):
+            return True
+    return False
+
+def check_cancel_appointment_request(text):
+    """
+    Check if user wants to cancel an existing appointment (not just the current booking process)
+    """
+    text_lower = text.lower()
+    for pattern in CANCEL_APPOINTMENT_PATTERNS:
+        if pattern.search(text_lower):
+            return True
+    return False
+
+def check_reschedule_request(text):
+    """
+    Check if user wants to move an existing appointment
+    """
+    text_lower = text.lower()
+    for pattern in RESCHEDULE_PATTERNS:
+        if pattern.search(text_lower):
             return True
     return False
 
-def is_date_in_past(date_obj):
+def detect_appointment_type(text):
+    """
+    Return the appointment type named in the message, or None if the message does not name one
+    """
+    text_lower = text.lower()
+    for appointment_type, patterns in APPOINTMENT_TYPE_PATTERNS:
+        for pattern in patterns:
+            if pattern.search(text_lower):
+                return appointment_type
+    return None
+
+def appointment_type_for_duration(duration_minutes):
+    """
+    Return the appointment type of an existing booking from its length
+    """
+    for appointment_type, appointment_info in APPOINTMENT_TYPES.items():
+        if appointment_info['minutes'] == duration_minutes:
+            return appointment_type
+    return DEFAULT_APPOINTMENT_TYPE
+
+def _format_appointment_list(appointments):
+    """
+    Format the patient's appointments for a chat message
+    """
+    return "\n".join(
+        f"- {to_clinic_time(appointment[0]).strftime('%B %d, %Y at %H:%M')}" for appointment in appointments
+    )
+
+def _select_patient_appointment(user_email, date_only, now=None, time_only=None):
+    """
+    Find the patient's appointment to act on with one index lookup, together with their bookings that are
+    still waiting in the journal to be written to the calendar.
+    Returns (appointment, error_response); appointment is a (start, event_id, booking) triple, where
+    booking is the journal record of a pending booking (and event_id is None) or None for a calendar event.
+    """
+    if not user_email:
+        return None, {
+            "message": "Please log in with Google so I can find your appointments.",
+            "status": "error"
+        }
+
+    now = now or clinic_now()
+    appointments = [(start, event_id, None) for start, event_id in appointment_index.find(user_email, now)]
+    for booking in booking_journal.pending_bookings(user_email):
+        for occurrence in booking.get('occurrences', [booking['start']]):
+            start = datetime.fromisoformat(occurrence)
+            if start > now:
+                appointments.append((start, None, booking))
+    appointments.sort(key=lambda appointment: appointment[0])
+    if not appointments:
+        return None, {
+            "message": "I couldn't find any upcoming appointments for you.",
+            "status": "error"
+        }
+
+    if date_only:
+        appointments = [a for a in appointments if to_clinic_time(a[0]).date() == date_only]
+        if not appointments:
+            return None, {
+                "message": f"You have no appointment on {date_only.strftime('%B %d, %Y')}.",
+                "status": "error"
+            }
+        if time_only:
+            # Several appointments on the same day are told apart by their time
+            appointments = [a for a in appointments if (to_clinic_time(a[0]).hour, to_clinic_time(a[0]).minute) == time_only] or appointments
+
+    if len(appointments) > 1:
+        return None, {
+            "message": f"You have several upcoming appointments:\n{_format_appointment_list(appointments)}\nPlease tell me the date and time of the one you mean, for example: '{to_clinic_time(appointments[0][0]).strftime('%B %d at %H:%M')}'.",
+            "status": "waiting_for_date"
+        }
+
+    appointment = appointments[0]
+    if appointment[2] and appointment[2].get('recurrence'):
+        return None, {
+            "message": "That appointment is part of a weekly series that is still being saved to the calendar. Please try again in a few minutes.",
+            "status": "error"
+        }
+    return appointment, None
+
+def handle_cancel_appointment(text, user_email, now=None):
+    """
+    Cancel an existing appointment of the patient.
+    """
+    appointment_details = parse_appointment_request(text, now)
+    appointment, error_response = _select_patient_appointment(user_email, appointment_details["date_only"], now, appointment_details["time_only"])
+    if error_response:
+        return error_response
+
+    start, event_id, booking = appointment
+    local_start = to_clinic_time(start)
+    message = f"Your appointment on {local_start.strftime('%Y-%m-%d')} at {local_start.strftime('%H:%M')} has been cancelled."
+    if booking:
+        # Not in the calendar yet: closing it in the journal is enough
+        if not booking_journal.cancel(booking['id']):
+            return {
+                "message": "Your appointment is being saved to the calendar right now. Please try again in a moment.",
+                "status": "error"
+            }
+        waitlist.slot_opened(start, booking['duration_minutes'], now)
+        return {"message": message, "status": "success", "booking_id": booking['id']}
+
+    duration_minutes = appointment_index.duration(event_id)
+    if not cancel_appointment_event(event_id):
+        return {
+            "message": "An error occurred while cancelling your appointment. Please try again later.",
+            "status": "error"
+        }
+    waitlist.slot_opened(start, duration_minutes, now, event_id)
+
+    return {"message": message, "status": "success", "event_id": event_id}
+
+def split_reschedule_request(text):
+    """
+    Split a reschedule message into the part naming the current appointment and the part with the new date and time.
+    """
+    current_part, separator, new_part = text.lower().rpartition(' to ')
+    if not separator:
+        return "", text
+    return current_part, new_part
+
+def handle_reschedule_request(text, user_email, now=None, new_part=None):
+    """
+    Move an existing appointment of the patient to the new date and time in the message,
+    e.g. 'reschedule my appointment on June 8 to June 9 at 10:00'.
+    new_part is the new date and time from an earlier message, when this one only says which appointment to move.
+    """
+    if new_part is None:
+        current_part, new_part = split_reschedule_request(text)
+    else:
+        current_part = text
+
+    new_details = parse_appointment_request(new_part, now)
+    current_details = parse_appointment_request(current_part, now) if current_part else {"date_only": None, "time_only": None}
+
+    appointment, error_response = _select_patient_appointment(user_email, current_details["date_only"], now, current_details["time_only"])
+    if error_response:
+        return error_response
+
+    if not new_details["valid"]:
+        return {
+            "message": "Please tell me the new date and time, for example: 'reschedule my appointment to June 9 at 10:00'.",
+            "status": "error"
+        }
+
+    start, event_id, booking = appointment
+    new_datetime = new_details["datetime"]
+
+    # The appointment keeps its length when it moves
+    duration_minutes = booking['duration_minutes'] if booking else appointment_index.duration(event_id)
+    granularity = APPOINTMENT_TYPES[appointment_type_for_duration(duration_minutes)]['granularity']
+    slot_error = check_appointment_slot(new_datetime, duration_minutes, granularity, ignore_start=start, now=now)
+    if slot_error:
+        return slot_error
+
+    local_start = to_clinic_time(start)
+    message = f"Your appointment on {local_start.strftime('%Y-%m-%d')} at {local_start.strftime('%H:%M')} has been moved to {new_datetime.strftime('%Y-%m-%d')} at {new_datetime.strftime('%H:%M')}."
+    if booking:
+        moved = booking_journal.move(booking['id'], new_datetime)
+        if moved is None:
+            return {
+                "message": "Your appointment could not be moved right now. Please try again in a moment.",
+                "status": "error"
+            }
+        waitlist.slot_opened(start, duration_minutes, now)
+        return {"message": message, "status": "success", "booking_id": moved['id']}
+
+    if not reschedule_appointment_event(event_id, new_datetime, duration_minutes):
+        return {
+            "message": "An error occurred while rescheduling your appointment. Please try again later.",
+            "status": "error"
+        }
+    waitlist.slot_opened(start, duration_minutes, now, event_id)
+
+    return {"message": message, "status": "success", "event_id": event_id}
+
+def check_waitlist_leave_request(text):
+    """
+    Check if user wants to leave the waitlist
+    """
+    text_lower = text.lower()
+    for pattern in WAITLIST_LEAVE_PATTERNS:
+        if pattern.search(text_lower):
+            return True
+    return False
+
+def check_waitlist_join_request(text):
+    """
+    Check if user wants to join the waitlist
+    """
+    text_lower = text.lower()
+    for pattern in WAITLIST_JOIN_PATTERNS:
+        if pattern.search(text_lower):
+            return True
+    return False
+
+def _window_minutes(hour, minute, meridiem):
+    """
+    Minutes after midnight of a window bound; hours without am/pm that are before opening are afternoon hours
+    """
+    hour = int(hour)
+    minute = int(minute) if minute else 0
+    if meridiem == 'pm' and hour < 12:
+        hour += 12
+    elif meridiem == 'am' and hour == 12:
+        hour = 0
+    elif not meridiem and hour < 8:
+        hour += 12
+    return hour * 60 + minute
+
+def parse_waitlist_preferences(text, user_session, duration_minutes, now=None):
+    """
+    Extract the weekdays and time window a patient wants from a waitlist request.
+    Falls back to the date or time already given in the conversation, or those of the request that was just
+    turned down, then to any clinic day and time.
+    Returns (weekdays, window_start, window_end, day) with the window in minutes after midnight;
+    day is the one date the patient wants, or None if any matching date will do.
+    """
+    text_lower = text.lower()
+    details = parse_appointment_request(text, now)
+
+    weekdays = set()
+    day = None
+    for match in WEEKDAY_NAME_PATTERN.finditer(text_lower):
+        if match.group(1):
+            weekdays.add(ENGLISH_WEEKDAYS[match.group(1)])
+        else:
+            weekdays.add(HEBREW_WEEKDAYS[match.group(2)])
+    if not weekdays:
+        day = details["date_only"] or user_session.get('pending_date') or user_session.get('requested_date')
+        weekdays = {day.weekday()} if day else set(CLINIC_WEEKDAYS)
+
+    window = None
+    for pattern in WAITLIST_WINDOW_PATTERNS:
+        window_match = pattern.search(text_lower)
+        if window_match:
+            window = (
+                _window_minutes(window_match.group(1), window_match.group(2), window_match.group(3)),
+                _window_minutes(window_match.group(4), window_match.group(5), window_match.group(6) or window_match.group(3))
+            )
+            break
+    if window is None:
+        for pattern, part_of_day in PART_OF_DAY_WINDOWS:
+            if pattern.search(text_lower):
+                window = part_of_day
+                break
+    if window is None:
+        pending_time = details["time_only"] or user_session.get('pending_time') or user_session.get('requested_time')
+        if pending_time:
+            hour, minute = pending_time
+            window = (hour * 60 + minute, hour * 60 + minute + duration_minutes)
+        else:
+            window = CLINIC_DAY_MINUTES
+
+    window_start = max(window[0], CLINIC_DAY_MINUTES[0])
+    window_end = min(window[1], CLINIC_DAY_MINUTES[1])
+    return weekdays & set(CLINIC_WEEKDAYS), window_start, window_end, day
+
+def handle_waitlist_join(text, user_session, user_email, user_name, appointment_type, now=None):
+    """
+    Put the patient on the waitlist for the weekdays and time window in the message.
+    """
+    if not user_email:
+        return {
+            "message": "Please log in with Google so I can add you to the waitlist.",
+            "status": "error"
+        }
+
+    appointment_info = APPOINTMENT_TYPES[appointment_type]
+    weekdays, window_start, window_end, day = parse_waitlist_preferences(text, user_session, appointment_info['minutes'], now)
+    if not weekdays or window_end - window_start < appointment_info['minutes']:
+        return {
+            "message": "I couldn't find clinic hours that match those preferences. For example: 'add me to the waitlist for Tuesday mornings' or 'waitlist for Monday between 14:00 and 17:00'.",
+            "status": "error"
+        }
+
+    entry = waitlist.join(user_email, user_name, weekdays, window_start, window_end, appointment_info['minutes'], appointment_info['granularity'], day, day, now)
+    if day:
+        days_text = day.strftime('%B %d, %Y')
+    else:
+        day_names = ", ".join(name.capitalize() for name, number in ENGLISH_WEEKDAYS.items() if len(name) > 3 and number in weekdays)
+        days_text = f"{day_names} until {date.fromisoformat(entry['last_day']).strftime('%B %d, %Y')}"
+    return {
+        "message": f"You're on the waitlist for a {appointment_info['label']} on {days_text} between {window_start // 60:02d}:{window_start % 60:02d} and {window_end // 60:02d}:{window_end % 60:02d}. When a matching slot opens up I'll offer it to you, and the offer is held for {WAITLIST_OFFER_MINUTES} minutes. Say 'leave the waitlist' to stop waiting.",
+        "status": "success"
+    }
+
+def _format_offer(offer):
+    """
+    Describe an open waitlist offer for a chat message
+    """
+    local_start = to_clinic_time(offer['start'])
+    local_expiry = to_clinic_time(offer['expires_at'])
+    return f"Good news: a {offer['duration_minutes']}-minute slot opened up on {local_start.strftime('%B %d, %Y at %H:%M')}. Reply 'yes' to book it or 'no' to pass. The offer is held until {local_expiry.strftime('%H:%M')}."
+
+def check_confirmation(text):
+    """
+    Check if user answers yes to a question
+    """
+    text_lower = text.lower()
+    for pattern in CONFIRM_PATTERNS:
+        if pattern.search(text_lower):
+            return True
+    return False
+
+def check_decline(text):
+    """
+    Check if user answers no to a question
+    """
+    text_lower = text.lower()
+    for pattern in DECLINE_PATTERNS:
+        if pattern.search(text_lower):
+            return True
+    return False
+
+def handle_waitlist_offer_reply(text, user_email, user_name, offer, now=None):
+    """
+    Book or pass on the patient's open waitlist offer. Returns None if the message is not a reply to the offer.
+    """
+    if check_confirmation(text):
+        if waitlist.take_offer(user_email, now) is None:
+            return {
+                "message": "Sorry, that offer has expired. You are still on the waitlist.",
+                "status": "error"
+            }
+        appointment_datetime = to_clinic_time(offer['start'])
+        result = process_complete_appointment(appointment_datetime, user_name, user_email, appointment_type_for_duration(offer['duration_minutes']), now)
+        if result["status"] != "success":
+            return {
+                "message": "Sorry, that slot was taken in the meantime. You are still on the waitlist.",
+                "status": "error"
+            }
+        waitlist.leave(user_email)
+        return result
+
+    if check_decline(text):
+        waitlist.decline(user_email, now)
+        return {
+            "message": "No problem, I passed that slot on. You are still on the waitlist for the next one.",
+            "status": "success"
+        }
+
+    return None
+
+def check_recurring_request(text):
+    """
+    Check if user asks for a recurring series of appointments
+    """
+    text_lower = text.lower()
+    for pattern in RECURRING_PATTERNS:
+        if pattern.search(text_lower):
+            return True
+    return False
+
+def parse_series_request(text, appointment_type, now=None):
+    """
+    Extract a weekly series such as 'every Tuesday at 9 for 8 weeks'.
+    Returns (series, error_response); series holds only session-safe values so it can wait for confirmation.
+    """
+    text_lower = text.lower()
+    weekday_match = WEEKDAY_NAME_PATTERN.search(text_lower)
+    time_only = parse_appointment_request(text, now)["time_only"]
+    if not weekday_match or not time_only:
+        return None, {
+            "message": "Please tell me the day, time and length of the series, for example: 'every Tuesday at 9:00 for 8 weeks'.",
+            "status": "error"
+        }
+
+    interval_weeks = 2 if EVERY_OTHER_WEEK_PATTERN.search(text_lower) else 1
+    count = None
+    for pattern, unit in SERIES_LENGTH_PATTERNS:
+        length_match = pattern.search(text_lower)
+        if length_match:
+            number = int(length_match.group(1))
+            count = -(-number // interval_weeks) if unit == 'weeks' else number
+            break
+    if not count:
+        return None, {
+            "message": "How long should the series run? For example: 'every Tuesday at 9:00 for 8 weeks' or '6 times'.",
+            "status": "error"
+        }
+    if count > SERIES_MAX_OCCURRENCES:
+        return None, {
+            "message": f"A series can have at most {SERIES_MAX_OCCURRENCES} appointments. Please choose a shorter series.",
+            "status": "error"
+        }
+
+    if weekday_match.group(1):
+        weekday = ENGLISH_WEEKDAYS[weekday_match.group(1)]
+    else:
+        weekday = HEBREW_WEEKDAYS[weekday_match.group(2)]
+    hour, minute = time_only
+
+    # The series starts on the next such weekday whose slot is still ahead
+    now = now or clinic_now()
+    today = now.date()
+    first_date = today + timedelta(days=(weekday - today.weekday()) % 7)
+    if is_datetime_in_past(clinic_datetime(first_date, hour, minute), now):
+        first_date += timedelta(weeks=1)
+
+    return {
+        'first_date': first_date,
+        'hour': hour,
+        'minute': minute,
+        'count': count,
+        'interval_weeks': interval_weeks,
+        'appointment_type': appointment_type,
+    }, None
+
+def expand_series(series):
+    """
+    Start times of every appointment in a series, in clinic time
+    """
+    return [
+        clinic_datetime(
+            series['first_date'] + timedelta(weeks=number * series['interval_weeks']),
+            series['hour'],
+            series['minute']
+        )
+        for number in range(series['count'])
+    ]
+
+def find_series_conflicts(occurrences, duration_minutes):
+    """
+    Return the occurrences that overlap existing bookings, using one free/busy query for the whole span.
+    """
+    duration = timedelta(minutes=duration_minutes)
+    # The journal is read first: a booking the worker commits in between is then still seen in the calendar
+    pending = booking_journal.pending_intervals()
+    bookings = IntervalTree(get_booked_intervals(occurrences[0], occurrences[-1] + duration) + pending)
+    return [occurrence for occurrence in occurrences if not bookings.is_free(occurrence, occurrence + duration)]
+
+def _describe_series(series, occurrences):
+    weekday_name = occurrences[0].strftime('%A')
+    frequency = f"every other {weekday_name}" if series['interval_weeks'] == 2 else f"every {weekday_name}"
+    return f"{frequency} at {series['hour']:02d}:{series['minute']:02d}"
+
+def book_series(series, user_name, user_email, confirmed=False):
+    """
+    Check every occurrence of a series and book it with a single journaled calendar write.
+    Unless confirmed, occurrences that are already taken are reported and the patient is asked before the rest are booked.
+    """
+    if not is_calendar_configured():
+        return dict(CALENDAR_NOT_CONFIGURED_RESPONSE)
+
+    appointment_info = APPOINTMENT_TYPES[series['appointment_type']]
+    duration_minutes = appointment_info['minutes']
+    occurrences = expand_series(series)
+
+    # Every occurrence has the same weekday and time, so clinic hours are checked once
+    if not is_within_clinic_hours(occurrences[0]) or not fits_clinic_hours(occurrences[0], duration_minutes):
+        return {
+            "message": f"The series {_describe_series(series, occurrences)} is outside of clinic hours. The clinic is open Sunday–Thursday 08:00–19:00 and Friday 08:00–12:00.",
+            "status": "error"
+        }
+
+    is_valid_time, time_error_message = is_valid_appointment_time(occurrences[0], appointment_info['granularity'])
+    if not is_valid_time:
+        return {
+            "message": time_error_message,
+            "status": "error"
+        }
+
+    conflicts = find_series_conflicts(occurrences, duration_minutes)
+    free = [occurrence for occurrence in occurrences if occurrence not in conflicts]
+    if not free:
+        return {
+            "message": f"All {len(occurrences)} dates {_describe_series(series, occurrences)} are already booked. Please choose a different time.",
+            "status": "error"
+        }
+
+    conflict_list = "\n".join(f"- {conflict.strftime('%B %d, %Y')}" for conflict in conflicts)
+    if conflicts and not confirmed:
+        return {
+            "message": f"These dates of the series {_describe_series(series, occurrences)} are already booked:\n{conflict_list}\nReply 'yes' to book the other {len(free)}, or choose a different time.",
+            "status": "waiting_for_confirmation"
+        }
+
+    recurrence = weekly_recurrence(series['count'], series['interval_weeks'])
+    if conflicts:
+        recurrence.append(recurrence_exclusion(conflicts))
+
+    try:
+        booking = booking_journal.reserve(occurrences[0], user_name, user_email, duration_minutes, recurrence, free)
+        if booking is None:
+            return {
+                "message": "Some of those dates were just booked by someone else. Please try again.",
+                "status": "error"
+            }
+    except Exception as e:
+        return {
+            "message": f"An error occurred while booking the series: {str(e)}",
+            "status": "error"
+        }
+
+    message = f"Series scheduled: {len(free)} appointments {_describe_series(series, occurrences)}{_type_suffix(series['appointment_type'])}, from {free[0].strftime('%Y-%m-%d')} to {free[-1].strftime('%Y-%m-%d')}."
+    if conflicts:
+        message += f" Skipped:\n{conflict_list}"
+    return {
+        "message": message,
+        "status": "success",
+        "booking_id": booking['id']
+    }
+
+def handle_recurring_request(text, conversation, appointment_type, now=None):
+    """
+    Handle a request for a recurring series of appointments.
+    """
+    series, error_response = parse_series_request(text, appointment_type, now)
+    if error_response:
+        return error_response
+
+    result = book_series(series, conversation.user_name, conversation.user_email)
+    if result["status"] == "waiting_for_confirmation":
+        conversation.set_session({'pending_series': series})
+    return result
+
+def is_date_in_past(date_obj, now=None):
     """
     Check if the given date is in the past
     """
-    today = datetime.now().date()
-    return date_obj < today
+    return date_obj < clinic_today(now)
 
-def is_datetime_in_past(datetime_obj):
+def is_datetime_in_past(datetime_obj, now=None):
     """
     Check if the given datetime is in the past
     """
-    jerusalem = pytz.timezone('Asia/Jerusalem')
-    now = datetime.now(jerusalem)
-    
-    # Convert datetime_obj to Jerusalem timezone if it's not already
-    if datetime_obj.tzinfo is None:
-        datetime_obj = jerusalem.localize(datetime_obj)
-    else:
-        datetime_obj = datetime_obj.astimezone(jerusalem)
-    
-    return datetime_obj < now
+    return to_clinic_time(datetime_obj) < (now or clinic_now())
 
-def parse_appointment_request(text):
+def parse_appointment_request(text, now=None):
     """
     Function to extract date and time from a text message.
     Returns a dictionary with date, time, and validation status.
     """
     text = text.lower()
+    now = now or clinic_now()
+    today = now.date()
     
     appointment_details = {
         "datetime": None,
@@ -96,30 +912,11 @@ def parse_appointment_request(text):
         "has_time": False
     }
     
-    date_patterns = [
-        r'(\d{1,2})[\/\.-](\d{1,2})(?:[\/\.-](\d{2,4}))?',  # MM/DD/YYYY or DD/MM/YYYY
-        r'(\d{1,2})(?:\s+|-)(january|february|march|april|may|june|july|august|september|october|november|december|jan|feb|mar|apr|jun|jul|aug|sep|oct|nov|dec)',  # DD Month
-        r'(january|february|march|april|may|june|july|august|september|october|november|december|jan|feb|mar|apr|jun|jul|aug|sep|oct|nov|dec)(?:\s+|-)(\d{1,2})',  # Month DD
-        r'(today|tomorrow|next day)'  
-    ]
-    
-    weekday_patterns = [
-        r'(this|next)?\s*(monday|tuesday|wednesday|thursday|friday|saturday|sunday|mon|tue|wed|thu|fri|sat|sun)',
-        r'(?:ב|ה)?(יום\s+)?(ראשון|שני|שלישי|רביעי|חמישי|שישי|שבת)(?:\s+הבא)?'
-    ]
-    
-    time_patterns = [
-        r'(\d{1,2})(?::(\d{2}))?\s+(am|pm)',  
-        r'(\d{1,2}):(\d{2})',  # HH:MM
-        r'at\s+(\d{1,2})(?::(\d{2}))?(?:\s+(am|pm))?'  # at HH or at HH:MM with optional am/pm
-    ]
-
     extracted_date = None
     
-    for pattern in weekday_patterns:
-        weekday_match = re.search(pattern, text)
+    for pattern in WEEKDAY_PATTERNS:
+        weekday_match = pattern.search(text)
         if weekday_match:
-            today = datetime.now().date()
             today_weekday = today.weekday()  
             
             matched_weekday = None
@@ -130,30 +927,10 @@ def parse_appointment_request(text):
             else:
                 weekday_text = weekday_match.group(1) if weekday_match.group(1) else ""
             
-            english_weekdays = {
-                'monday': 0, 'mon': 0,
-                'tuesday': 1, 'tue': 1,
-                'wednesday': 2, 'wed': 2,
-                'thursday': 3, 'thu': 3,
-                'friday': 4, 'fri': 4,
-                'saturday': 5, 'sat': 5,
-                'sunday': 6, 'sun': 6
-            }
-            
-            hebrew_weekdays = {
-                'ראשון': 6,  
-                'שני': 0,   
-                'שלישי': 1,  
-                'רביעי': 2,  
-                'חמישי': 3,  
-                'שישי': 4,  
-                'שבת': 5     
-            }
-            
-            if weekday_text and weekday_text.lower() in english_weekdays:
-                matched_weekday = english_weekdays[weekday_text.lower()]
-            elif weekday_text and weekday_text in hebrew_weekdays:
-                matched_weekday = hebrew_weekdays[weekday_text]
+            if weekday_text and weekday_text.lower() in ENGLISH_WEEKDAYS:
+                matched_weekday = ENGLISH_WEEKDAYS[weekday_text.lower()]
+            elif weekday_text and weekday_text in HEBREW_WEEKDAYS:
+                matched_weekday = HEBREW_WEEKDAYS[weekday_text]
 
             if matched_weekday is not None:
                 is_next = False
@@ -164,7 +941,7 @@ def parse_appointment_request(text):
 
                 if is_next:
                     days_to_add = ((matched_weekday - today_weekday) + 7) % 7
-                    if is_day_in_current_hebrew_week(matched_weekday) == False:
+                    if is_day_in_current_hebrew_week(matched_weekday, now) == False:
                         days_to_add += 7
                 else:
                     days_to_add = ((matched_weekday - today_weekday) + 7) % 7
@@ -175,24 +952,24 @@ def parse_appointment_request(text):
                 break
 
     if not extracted_date:
-        for pattern in date_patterns:
-            date_match = re.search(pattern, text)
+        for pattern in DATE_PATTERNS:
+            date_match = pattern.search(text)
             if date_match:
                 if 'today' in date_match.groups():
-                    extracted_date = datetime.now().date()
+                    extracted_date = today
                 elif 'tomorrow' in date_match.groups():
-                    extracted_date = (datetime.now() + timedelta(days=1)).date()
+                    extracted_date = today + timedelta(days=1)
                 elif 'next day' in date_match.groups():
-                    extracted_date = (datetime.now() + timedelta(days=1)).date()
+                    extracted_date = today + timedelta(days=1)
                 elif len(date_match.groups()) >= 2:
                     if date_match.group(1) and not date_match.group(1).isdigit():
                         month = _month_to_number(date_match.group(1))
                         day = int(date_match.group(2))
-                        year = datetime.now().year
+                        year = today.year
                     elif date_match.group(2) and not date_match.group(2).isdigit():
                         day = int(date_match.group(1))
                         month = _month_to_number(date_match.group(2))
-                        year = datetime.now().year
+                        year = today.year
                     else:
                         first_num = int(date_match.group(1))
                         second_num = int(date_match.group(2))
@@ -204,7 +981,7 @@ def parse_appointment_request(text):
                         else:  
                             day, month = first_num, second_num
                         
-                        year = int(date_match.group(3)) if date_match.groups()[2] and date_match.group(3) and date_match.group(3).isdigit() else datetime.now().year
+                        year = int(date_match.group(3)) if date_match.groups()[2] and date_match.group(3) and date_match.group(3).isdigit() else today.year
                         if year < 100:  
                             year += 2000
                     
@@ -217,8 +994,8 @@ def parse_appointment_request(text):
                     break
     
     extracted_time = None
-    for pattern in time_patterns:
-        time_match = re.search(pattern, text)
+    for pattern in TIME_PATTERNS:
+        time_match = pattern.search(text)
         if time_match:
             hour = int(time_match.group(1))
             minute = int(time_match.group(2)) if time_match.group(2) and time_match.group(2).isdigit() else 0
@@ -241,13 +1018,7 @@ def parse_appointment_request(text):
     if extracted_date and extracted_time:
         hour, minute = extracted_time
         try:
-            appointment_datetime = datetime.combine(
-                extracted_date, 
-                datetime.min.time().replace(hour=hour, minute=minute)
-            )
-            
-            jerusalem = pytz.timezone('Asia/Jerusalem')
-            appointment_datetime = jerusalem.localize(appointment_datetime)
+            appointment_datetime = clinic_datetime(extracted_date, hour, minute)
             
             appointment_details["datetime"] = appointment_datetime
             appointment_details["valid"] = True
@@ -282,59 +1053,16 @@ def check_greeting_or_thanks(text):
     """
     text_lower = text.lower()
     
-    thank_you_patterns = [
-        r'\bthank(?:s| you)\b',
-        r'\bthanks\b',
-        r'\bty\b',
-        r'\bthx\b',
-        r'\bappreciate\b',
-        r'\bgrateful\b',
-        r'\bתודה\b',
-        r'\bתודה רבה\b',
-        r'\bתודה לך\b',
-        r'\bאני מודה לך\b'
-    ]
-    
-    good_day_patterns = [
-        r'\bgood day\b',
-        r'\bhave a nice day\b',
-        r'\bhave a good one\b',
-        r'\bnice day\b',
-        r'\bיום טוב\b',
-        r'\bיום נעים\b',
-        r'\bיום מוצלח\b',
-        r'\bהמשך יום נעים\b',
-        r'\bהמשך יום טוב\b',
-        r'\bשיהיה לך יום\b'
-    ]
-    
-    greeting_patterns = [
-        r'\bhello\b',
-        r'\bhi\b',
-        r'\bhey\b',
-        r'\bgood morning\b',
-        r'\bgood afternoon\b',
-        r'\bgood evening\b',
-        r'\bשלום\b',
-        r'\bהיי\b',
-        r'\bבוקר טוב\b',
-        r'\bצהריים טובים\b',
-        r'\bערב טוב\b',
-        r'\bלילה טוב\b',
-        r'\bמה שלומך\b',
-        r'\bמה נשמע\b'
-    ]
-    
-    for pattern in thank_you_patterns:
-        if re.search(pattern, text_lower):
+    for pattern in THANK_YOU_PATTERNS:
+        if pattern.search(text_lower):
             return "Have fun! I was happy to help, have a nice day."
     
-    for pattern in good_day_patterns:
-        if re.search(pattern, text_lower):
+    for pattern in GOOD_DAY_PATTERNS:
+        if pattern.search(text_lower):
             return "Thank you! Have a wonderful day too!"
     
-    for pattern in greeting_patterns:
-        if re.search(pattern, text_lower):
+    for pattern in GREETING_PATTERNS:
+        if pattern.search(text_lower):
             return "Hello! How can I help you schedule an appointment today?"
     
     return None
@@ -349,6 +1077,44 @@ def handle_appointment_request(text, token):
     """
     Handling a new appointment request with support for partial input (date only or time only).
     """
+    return handle_conversation_message(text, Conversation(token))
+
+def handle_conversation_message(text, conversation, now=None):
+    """
+    Handle one message of a conversation.
+    A patient with an open waitlist offer hears about it with the next reply, and can answer it after that.
+    A message with its own date or time is a new request rather than an answer to the offer.
+    The clock is read once here and the same "now" is used for every date check of the message.
+    """
+    now = now or clinic_now()
+    offer = waitlist.offer_for(conversation.user_email, now) if conversation.user_email else None
+    if offer is None:
+        return _handle_message(text, conversation, now)
+
+    if offer['announced']:
+        details = parse_appointment_request(text, now)
+        if not details["has_date"] and not details["has_time"]:
+            offer_response = handle_waitlist_offer_reply(text, conversation.user_email, conversation.user_name, offer, now)
+            if offer_response:
+                return offer_response
+
+    result = _handle_message(text, conversation, now)
+    if not offer['announced'] and waitlist.mark_announced(conversation.user_email):
+        result = dict(result, message=f"{result['message']}\n\n{_format_offer(offer)}")
+    return result
+
+def _ask_which_appointment(conversation, result, pending):
+    """
+    Keep a cancel or reschedule request in the session while the patient says which of their appointments they mean.
+    """
+    if result["status"] == "waiting_for_date":
+        conversation.set_session(pending)
+    return result
+
+def _handle_message(text, conversation, now):
+    """
+    Handle one chat message of the booking conversation.
+    """
     greeting_response = check_greeting_or_thanks(text)
     if greeting_response:
         return {
@@ -356,29 +1122,74 @@ def handle_appointment_request(text, token):
             "status": "success"
         }
     
-    user_id = get_user_id_from_token(token)
-    user_session = get_user_session(user_id)
-    
+    user_session = conversation.get_session()
+    user_email = conversation.user_email
+    user_name = conversation.user_name
+
+    # Check if user wants to cancel or move an existing appointment
+    if check_reschedule_request(text):
+        conversation.clear_session()
+        # The new time is kept in case the patient has to say which appointment to move
+        pending = {'pending_reschedule': split_reschedule_request(text)[1]}
+        return _ask_which_appointment(conversation, handle_reschedule_request(text, user_email, now), pending)
+
+    if check_cancel_appointment_request(text):
+        conversation.clear_session()
+        return _ask_which_appointment(conversation, handle_cancel_appointment(text, user_email, now), {'pending_cancel': True})
+
+    if ('pending_cancel' in user_session or 'pending_reschedule' in user_session) and parse_appointment_request(text, now)["has_date"]:
+        # The patient was asked which of several appointments they meant and answered with its date
+        conversation.clear_session()
+        if 'pending_cancel' in user_session:
+            return _ask_which_appointment(conversation, handle_cancel_appointment(text, user_email, now), user_session)
+        result = handle_reschedule_request(text, user_email, now, new_part=user_session['pending_reschedule'])
+        return _ask_which_appointment(conversation, result, user_session)
+
+    if check_waitlist_leave_request(text):
+        conversation.clear_session()
+        if user_email and waitlist.leave(user_email):
+            return {
+                "message": "You have been removed from the waitlist.",
+                "status": "success"
+            }
+        return {
+            "message": "You are not on the waitlist.",
+            "status": "success"
+        }
+
     # Check if user wants to cancel
     if check_cancel_request(text):
-        clear_user_session(user_id)
+        conversation.clear_session()
         return {
             "message": "Appointment booking cancelled. How else can I help you?",
             "status": "success"
         }
     
-    appointment_details = parse_appointment_request(text)
-    
-    user_name = "Anonymous"
-    user_email = None
-    
-    if token:
-        try:
-            user_info = jwt.decode(token, secret_key, algorithms=['HS256'])
-            user_email = user_info.get('email')    
-            user_name = user_info.get('name', 'Guest')
-        except Exception as e:
-            pass
+    appointment_details = parse_appointment_request(text, now)
+    named_type = detect_appointment_type(text)
+    appointment_type = named_type or user_session.get('appointment_type') or DEFAULT_APPOINTMENT_TYPE
+
+    if check_waitlist_join_request(text):
+        result = handle_waitlist_join(text, user_session, user_email, user_name, appointment_type, now)
+        if result["status"] == "success":
+            conversation.clear_session()
+        return result
+
+    if 'pending_series' in user_session:
+        # The patient was asked whether to book the free dates of a series
+        conversation.clear_session()
+        if check_confirmation(text):
+            return book_series(user_session['pending_series'], user_name, user_email, confirmed=True)
+        if check_decline(text):
+            return {
+                "message": "Okay, I didn't book the series. How else can I help you?",
+                "status": "success"
+            }
+        user_session = {}
+
+    if check_recurring_request(text):
+        conversation.clear_session()
+        return handle_recurring_request(text, conversation, appointment_type, now)
 
     # Check if user is in the middle of appointment booking process
     if 'pending_date' in user_session:
@@ -389,32 +1200,30 @@ def handle_appointment_request(text, token):
             hour, minute = appointment_details["time_only"]
             
             try:
-                appointment_datetime = datetime.combine(
-                    saved_date, 
-                    datetime.min.time().replace(hour=hour, minute=minute)
-                )
-                
-                jerusalem = pytz.timezone('Asia/Jerusalem')
-                appointment_datetime = jerusalem.localize(appointment_datetime)
+                appointment_datetime = clinic_datetime(saved_date, hour, minute)
                 
                 # Check if the datetime is in the past
-                if is_datetime_in_past(appointment_datetime):
+                if is_datetime_in_past(appointment_datetime, now):
                     return {
                         "message": f"The requested time {appointment_datetime.strftime('%Y-%m-%d %H:%M')} is in the past. Please choose a different time for {saved_date.strftime('%B %d, %Y')}.",
                         "status": "waiting_for_time"
                     }
                 
                 # Process the complete appointment
-                result = process_complete_appointment(appointment_datetime, user_name, user_email)
+                result = process_complete_appointment(appointment_datetime, user_name, user_email, appointment_type, now)
                 
                 # If appointment failed due to time issues, keep the date in session
                 if result["status"] == "error" and ("not available" in result["message"] or "outside of clinic hours" in result["message"] or "must start at" in result["message"]):
+                    session = {'pending_date': saved_date, 'appointment_type': appointment_type}
+                    if "not available" in result["message"]:
+                        session.update(_requested_slot(appointment_datetime))
+                    conversation.set_session(session)
                     return {
                         "message": f"{result['message']} Please choose a different time for {saved_date.strftime('%B %d, %Y')}.",
                         "status": "waiting_for_time"
                     }
                 
-                clear_user_session(user_id)
+                conversation.clear_session()
                 return result
                 
             except ValueError:
@@ -423,6 +1232,8 @@ def handle_appointment_request(text, token):
                     "status": "waiting_for_time"
                 }
         else:
+            if appointment_type != user_session.get('appointment_type'):
+                conversation.set_session({'pending_date': user_session['pending_date'], 'appointment_type': appointment_type})
             return {
                 "message": f"Please provide a time for your appointment on {user_session['pending_date'].strftime('%B %d, %Y')}. For example: '2:30 PM' or '14:30'",
                 "status": "waiting_for_time"
@@ -431,7 +1242,7 @@ def handle_appointment_request(text, token):
     elif 'pending_time' in user_session:
         if appointment_details["has_date"]:
             new_date = appointment_details["date_only"]
-            if is_date_in_past(new_date):
+            if is_date_in_past(new_date, now):
                 return {
                     "message": f"The date {new_date.strftime('%B %d, %Y')} is in the past. Please choose a future date.",
                     "status": "waiting_for_date"
@@ -447,24 +1258,22 @@ def handle_appointment_request(text, token):
             hour, minute = saved_time
             
             try:
-                appointment_datetime = datetime.combine(
-                    new_date, 
-                    datetime.min.time().replace(hour=hour, minute=minute)
-                )
+                appointment_datetime = clinic_datetime(new_date, hour, minute)
                 
-                jerusalem = pytz.timezone('Asia/Jerusalem')
-                appointment_datetime = jerusalem.localize(appointment_datetime)
-                
-                if is_datetime_in_past(appointment_datetime):
+                if is_datetime_in_past(appointment_datetime, now):
                     return {
                         "message": f"The requested time {appointment_datetime.strftime('%Y-%m-%d %H:%M')} is in the past. Please choose a future date and time.",
                         "status": "error"
                     }
                 
-                result = process_complete_appointment(appointment_datetime, user_name, user_email)
+                result = process_complete_appointment(appointment_datetime, user_name, user_email, appointment_type, now)
                 
                 # If appointment failed due to time issues, keep the time in session
                 if result["status"] == "error" and ("not available" in result["message"] or "outside of clinic hours" in result["message"]):
+                    session = {'pending_time': saved_time, 'appointment_type': appointment_type}
+                    if "not available" in result["message"]:
+                        session.update(_requested_slot(appointment_datetime))
+                    conversation.set_session(session)
                     hour, minute = saved_time
                     time_str = f"{hour:02d}:{minute:02d}"
                     return {
@@ -472,7 +1281,7 @@ def handle_appointment_request(text, token):
                         "status": "waiting_for_date"
                     }
                 
-                clear_user_session(user_id)
+                conversation.clear_session()
                 return result
                 
             except ValueError:
@@ -481,6 +1290,8 @@ def handle_appointment_request(text, token):
                     "status": "waiting_for_date"
                 }
         else:
+            if appointment_type != user_session.get('appointment_type'):
+                conversation.set_session({'pending_time': user_session['pending_time'], 'appointment_type': appointment_type})
             hour, minute = user_session['pending_time']
             time_str = f"{hour:02d}:{minute:02d}"
             return {
@@ -491,18 +1302,23 @@ def handle_appointment_request(text, token):
     if appointment_details["valid"]:
         appointment_datetime = appointment_details["datetime"]
         
-        if is_datetime_in_past(appointment_datetime):
+        if is_datetime_in_past(appointment_datetime, now):
             return {
                 "message": f"The requested time {appointment_datetime.strftime('%Y-%m-%d %H:%M')} is in the past. Please choose a future date and time.",
                 "status": "error"
             }
         
-        return process_complete_appointment(appointment_datetime, user_name, user_email)
+        result = process_complete_appointment(appointment_datetime, user_name, user_email, appointment_type, now)
+        if result["status"] == "success":
+            conversation.clear_session()
+        elif "not available" in result["message"]:
+            conversation.set_session(dict(_requested_slot(appointment_datetime), appointment_type=appointment_type))
+        return result
         
     elif appointment_details["has_date"] and not appointment_details["has_time"]:
         selected_date = appointment_details["date_only"]
         
-        if is_date_in_past(selected_date):
+        if is_date_in_past(selected_date, now):
             return {
                 "message": f"The date {selected_date.strftime('%B %d, %Y')} is in the past. Please choose a future date.",
                 "status": "error"
@@ -514,20 +1330,28 @@ def handle_appointment_request(text, token):
                 "status": "error"
             }
         
-        set_user_session(user_id, {'pending_date': selected_date})
+        conversation.set_session({'pending_date': selected_date, 'appointment_type': appointment_type})
         
         return {
-            "message": f"Great! I have your date as {selected_date.strftime('%B %d, %Y')}. What time would you like your appointment? Please provide a time like '2:30 PM' or '14:30'.",
+            "message": f"Great! I have your date as {selected_date.strftime('%B %d, %Y')}{_type_suffix(appointment_type)}. What time would you like your appointment? Please provide a time like '2:30 PM' or '14:30'.",
             "status": "waiting_for_time"
         }
         
     elif appointment_details["has_time"] and not appointment_details["has_date"]:
         hour, minute = appointment_details["time_only"]
         time_str = f"{hour:02d}:{minute:02d}"
-        set_user_session(user_id, {'pending_time': appointment_details["time_only"]})
+        conversation.set_session({'pending_time': appointment_details["time_only"], 'appointment_type': appointment_type})
         
         return {
-            "message": f"I have your time as {time_str}. What date would you like your appointment? Please provide a date like 'June 8' or 'next Monday' (note: the clinic is closed on Saturdays).",
+            "message": f"I have your time as {time_str}{_type_suffix(appointment_type)}. What date would you like your appointment? Please provide a date like 'June 8' or 'next Monday' (note: the clinic is closed on Saturdays).",
+            "status": "waiting_for_date"
+        }
+    
+    elif named_type:
+        conversation.set_session({'appointment_type': appointment_type})
+        appointment_info = APPOINTMENT_TYPES[appointment_type]
+        return {
+            "message": f"Sure, a {appointment_info['label']} takes {appointment_info['minutes']} minutes. What date and time would you like? For example: 'June 8 at 2:30 PM'.",
             "status": "waiting_for_date"
         }
     
@@ -537,42 +1361,181 @@ def handle_appointment_request(text, token):
             "status": "error"
         }
 
-def process_complete_appointment(appointment_datetime, user_name, user_email):
-    """Process a complete appointment request with both date and time"""
-    
-    if is_datetime_in_past(appointment_datetime):
+def _requested_slot(appointment_datetime):
+    """
+    Session fields for a request that was turned down, so that 'join the waitlist' waits for that date and time
+    """
+    local_datetime = to_clinic_time(appointment_datetime)
+    return {'requested_date': local_datetime.date(), 'requested_time': (local_datetime.hour, local_datetime.minute)}
+
+def _type_suffix(appointment_type):
+    """
+    Describe a non-standard appointment type in a reply, e.g. ' (first visit, 60 minutes)'
+    """
+    if appointment_type == DEFAULT_APPOINTMENT_TYPE:
+        return ""
+    appointment_info = APPOINTMENT_TYPES[appointment_type]
+    return f" ({appointment_info['label']}, {appointment_info['minutes']} minutes)"
+
+def clinic_day_window(day):
+    """
+    Return the (open, close) aware datetimes of the clinic on the given date, or None if it is closed.
+    The close is when the last half-hour slot ends.
+    """
+    weekday = day.weekday()
+    if weekday in [6, 0, 1, 2, 3]:
+        closing_hour = 19
+    elif weekday == 4:
+        closing_hour = 12
+    else:
+        return None
+
+    return clinic_datetime(day, 8), clinic_datetime(day, closing_hour, 30)
+
+# A journaled booking could never be written without a calendar, so none is taken
+CALENDAR_NOT_CONFIGURED_RESPONSE = {
+    "message": "Sorry, I can't book appointments online at the moment. Please contact the clinic to book one.",
+    "status": "error"
+}
+
+def get_booked_intervals(time_min, time_max):
+    """
+    Busy intervals of the calendar from one free/busy query. When the calendar can not be reached within
+    BOOKING_FREEBUSY_TIMEOUT_SECONDS, the indexed appointments stand in, so booking does not wait on Google;
+    the journal worker checks the calendar again before it writes the booking, and reports it to the patient
+    if the slot turns out to be taken.
+    """
+    busy = get_busy_intervals(time_min, time_max, BOOKING_FREEBUSY_TIMEOUT_SECONDS)
+    if busy is None:
+        print("Free/busy query failed; checking the slot against the local appointment index")
+        return appointment_index.intervals_between(time_min, time_max)
+    return busy
+
+def get_day_bookings(day):
+    """
+    Build an interval tree over everything that holds time on the given date: calendar events from one
+    free/busy query plus bookings still waiting in the journal.
+    """
+    window = clinic_day_window(day)
+    if window is None:
+        return IntervalTree([])
+
+    # The journal is read before the calendar, so a booking the worker commits in between is seen in the calendar;
+    # read the other way round, it would be in neither
+    pending = [(start, end) for start, end in booking_journal.pending_intervals() if start < window[1] and end > window[0]]
+    return IntervalTree(get_booked_intervals(*window) + pending)
+
+def _align_up(moment, granularity):
+    """
+    Round an aware datetime up to the next clinic-local multiple of granularity minutes
+    """
+    local_moment = to_clinic_time(moment)
+    past_step = timedelta(
+        minutes=(local_moment.hour * 60 + local_moment.minute) % granularity,
+        seconds=local_moment.second,
+        microseconds=local_moment.microsecond
+    )
+    if not past_step:
+        return local_moment
+    return clinic_tz.normalize(local_moment - past_step + timedelta(minutes=granularity))
+
+def find_best_fit_slot(bookings, day, duration_minutes, granularity, not_before=None):
+    """
+    Best-fit placement: among the free gaps of the day that can hold the appointment, pick the one
+    that leaves the least time over, so long free stretches stay open for long appointments.
+    Ties go to the earliest gap. Returns the start of the slot, or None if nothing fits.
+    """
+    window = clinic_day_window(day)
+    if window is None:
+        return None
+
+    window_start, window_end = window
+    if not_before is not None:
+        window_start = max(window_start, not_before)
+
+    duration = timedelta(minutes=duration_minutes)
+    best = None
+    for gap_start, gap_end in bookings.free_gaps(window_start, window_end):
+        start = _align_up(gap_start, granularity)
+        if start + duration > gap_end:
+            continue
+        leftover = gap_end - start - duration
+        if best is None or leftover < best[0]:
+            best = (leftover, start)
+    return best[1] if best else None
+
+def check_appointment_slot(appointment_datetime, duration_minutes, granularity=30, ignore_start=None, now=None):
+    """
+    Check that an appointment of the given length can start at the requested time.
+    Returns an error response, or None if the slot is free.
+    ignore_start is the start of a booking that should not count as a conflict (the one being moved).
+    """
+    if not is_calendar_configured():
+        return dict(CALENDAR_NOT_CONFIGURED_RESPONSE)
+
+    now = now or clinic_now()
+    if is_datetime_in_past(appointment_datetime, now):
         return {
             "message": f"The requested time {appointment_datetime.strftime('%Y-%m-%d %H:%M')} is in the past. Please choose a future date and time.",
             "status": "error"
         }
-    
+
     if not is_within_clinic_hours(appointment_datetime):
         return {
             "message": f"The requested time {appointment_datetime.strftime('%Y-%m-%d %H:%M')} is outside of clinic hours. The clinic is open Sunday–Thursday 08:00–19:00 and Friday 08:00–12:00.",
             "status": "error"
         }
-    
-    is_valid_time, time_error_message = is_valid_appointment_time(appointment_datetime)
+
+    if not fits_clinic_hours(appointment_datetime, duration_minutes):
+        return {
+            "message": f"A {duration_minutes}-minute appointment at {appointment_datetime.strftime('%Y-%m-%d %H:%M')} would run past closing time, outside of clinic hours. Please choose an earlier time.",
+            "status": "error"
+        }
+
+    is_valid_time, time_error_message = is_valid_appointment_time(appointment_datetime, granularity)
     if not is_valid_time:
         return {
             "message": time_error_message,
             "status": "error"
         }
-    
-    is_available = is_time_available(appointment_datetime)
-    
-    if not is_available:
+
+    day = to_clinic_time(appointment_datetime).date()
+    bookings = get_day_bookings(day)
+    end_datetime = appointment_datetime + timedelta(minutes=duration_minutes)
+    conflicts = [interval for interval in bookings.overlapping(appointment_datetime, end_datetime) if interval[0] != ignore_start]
+    if conflicts:
+        message = f"The appointment on {appointment_datetime.strftime('%Y-%m-%d')} at {appointment_datetime.strftime('%H:%M')} is not available."
+        suggestion = find_best_fit_slot(bookings, day, duration_minutes, granularity, now)
+        if suggestion is not None:
+            message += f" The best free slot for it that day is {suggestion.strftime('%H:%M')}."
         return {
-            "message": f"The appointment on {appointment_datetime.strftime('%Y-%m-%d')} at {appointment_datetime.strftime('%H:%M')} is not available. Please choose another time.",
+            "message": f"{message} Please choose another time, or say 'join the waitlist' to be offered a slot if one opens up.",
             "status": "error"
         }
+
+    return None
+
+def process_complete_appointment(appointment_datetime, user_name, user_email, appointment_type=DEFAULT_APPOINTMENT_TYPE, now=None):
+    """Process a complete appointment request with both date and time"""
+    appointment_info = APPOINTMENT_TYPES[appointment_type]
+    duration_minutes = appointment_info['minutes']
+
+    slot_error = check_appointment_slot(appointment_datetime, duration_minutes, appointment_info['granularity'], now=now)
+    if slot_error:
+        return slot_error
     
     try:
-        event = create_appointment_event(appointment_datetime, user_name, user_email)
+        # The booking is acknowledged once it is durable in the local journal; it is written to the calendar in the background
+        booking = booking_journal.reserve(appointment_datetime, user_name, user_email, duration_minutes)
+        if booking is None:
+            return {
+                "message": f"The appointment on {appointment_datetime.strftime('%Y-%m-%d')} at {appointment_datetime.strftime('%H:%M')} is not available. Please choose another time.",
+                "status": "error"
+            }
         return {
-            "message": f"Appointment scheduled for {appointment_datetime.strftime('%Y-%m-%d')} at {appointment_datetime.strftime('%H:%M')}.",
+            "message": f"Appointment scheduled for {appointment_datetime.strftime('%Y-%m-%d')} at {appointment_datetime.strftime('%H:%M')}{_type_suffix(appointment_type)}.",
             "status": "success",
-            "event_id": event.get('id')
+            "booking_id": booking['id']
         }
     except Exception as e:
         return {
@@ -588,8 +1551,7 @@ def is_within_clinic_hours(dt):
     if not dt:
         return False
 
-    jerusalem = pytz.timezone('Asia/Jerusalem')
-    local_dt = dt.astimezone(jerusalem)
+    local_dt = to_clinic_time(dt)
 
     weekday = local_dt.weekday() 
     hour = local_dt.hour
@@ -602,20 +1564,31 @@ def is_within_clinic_hours(dt):
     else:
         return False 
 
-def is_valid_appointment_time(appointment_datetime):
+def fits_clinic_hours(dt, duration_minutes=30):
+    """
+    Check if an appointment of the given length starts within clinic hours and ends by closing time.
+    """
+    if not is_within_clinic_hours(dt):
+        return False
+    window = clinic_day_window(to_clinic_time(dt).date())
+    return dt + timedelta(minutes=duration_minutes) <= window[1]
+
+def is_valid_appointment_time(appointment_datetime, granularity=30):
     """
     Check if the appointment time is valid.
     """
     minute = appointment_datetime.minute
-    if minute not in [0, 30]:
+    if minute % granularity != 0:
+        if granularity == 15:
+            return False, "Follow-up appointments must start at a quarter hour (XX:00, XX:15, XX:30 or XX:45). Please choose a valid time."
         return False, "Appointments must start at the hour (XX:00) or half hour (XX:30). Please choose a valid time."
     return True, ""
 
-def is_day_in_current_hebrew_week(target_weekday):
+def is_day_in_current_hebrew_week(target_weekday, now=None):
     """
     Check if the target day was already in the current Hebrew week. 
     """
-    today = datetime.now()
+    today = now or clinic_now()
     today_weekday = today.weekday()  
     today_hebrew_weekday = (today_weekday + 1) % 7
     target_hebrew_weekday = (target_weekday + 1) % 7    
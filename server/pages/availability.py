@@ -0,0 +1,110 @@
+"""
+The grid has one bitset per day: bit i is set when the half-hour slot starting i*30 minutes
+after local midnight is inside clinic hours, in the future and free in the calendar.
+"""
+import os
+from datetime import datetime, timedelta
+from pages.calendar_utils import get_busy_intervals
+from pages.appointment_processor import is_within_clinic_hours
+from pages.booking_journal import booking_journal
+from pages.clinic_time import CLINIC_TIMEZONE, clinic_tz, clinic_now, clinic_datetime
+from pages.ttl_cache import TTLCache
+
+SLOT_MINUTES = 30
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+MAX_RANGE_DAYS = 92
+AVAILABILITY_CACHE_SECONDS = int(os.environ.get('AVAILABILITY_CACHE_SECONDS', '60'))
+AVAILABILITY_CACHE_MAX_ENTRIES = 256
+
+_cache = TTLCache(AVAILABILITY_CACHE_SECONDS, AVAILABILITY_CACHE_MAX_ENTRIES)
+
+
+def _merge_intervals(intervals):
+    """
+    Merge overlapping (start, end) intervals into a sorted, non-overlapping list.
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _day_bitset(day, busy, now):
+    """
+    Build the bitset of bookable, free slots for one day.
+    busy is a sorted, non-overlapping list of (start, end) datetimes.
+    """
+    bits = 0
+    busy_index = 0
+    midnight = datetime.combine(day, datetime.min.time())
+
+    for slot in range(SLOTS_PER_DAY):
+        slot_start = clinic_tz.localize(midnight + timedelta(minutes=slot * SLOT_MINUTES))
+        if slot_start <= now or not is_within_clinic_hours(slot_start):
+            continue
+        slot_end = slot_start + timedelta(minutes=SLOT_MINUTES)
+
+        # Slots are visited in order, so busy intervals that ended before this slot are never needed again
+        while busy_index < len(busy) and busy[busy_index][1] <= slot_start:
+            busy_index += 1
+        if busy_index < len(busy) and busy[busy_index][0] < slot_end:
+            continue
+        bits |= 1 << slot
+
+    return bits
+
+
+def compute_availability(from_date, to_date):
+    """
+    Compute the availability grid between two dates (inclusive) from one free/busy query.
+    Returns a dict ready to be sent as JSON, or None if the calendar could not be queried.
+    """
+    range_start = clinic_datetime(from_date)
+    range_end = clinic_datetime(to_date + timedelta(days=1))
+
+    # Journal first, so a booking committed to the calendar between the two reads is not missed
+    pending = booking_journal.pending_intervals()
+    busy = get_busy_intervals(range_start, range_end)
+    if busy is None:
+        return None
+    busy = _merge_intervals(busy + pending)
+
+    now = clinic_now()
+    days = []
+    day = from_date
+    while day <= to_date:
+        days.append(format(_day_bitset(day, busy, now), f'0{SLOTS_PER_DAY // 4}x'))
+        day += timedelta(days=1)
+
+    return {
+        'from': from_date.isoformat(),
+        'to': to_date.isoformat(),
+        'timezone': CLINIC_TIMEZONE,
+        'slot_minutes': SLOT_MINUTES,
+        'days': days,
+    }
+
+
+def get_availability(from_date, to_date):
+    """
+    Return the availability grid, served from a short-lived cache when possible.
+    """
+    key = (from_date, to_date)
+    grid = _cache.get(key)
+    if grid is not None:
+        return grid
+
+    grid = compute_availability(from_date, to_date)
+    if grid is not None:
+        _cache.set(key, grid)
+    return grid
+
+
+def clear_availability_cache():
+    """
+    Drop cached grids, e.g. after an appointment was booked.
+    """
+    _cache.clear()
@@ -0,0 +1,355 @@
+"""
+Bookings are committed to an append-only journal file (one JSON record per line, fsynced) and acknowledged
+right away. A background worker replays pending bookings to Google Calendar with retries, and records the
+outcome in the journal so a restart picks up where it left off. A booking that can not be written is kept
+in a separate failures file for the doctor, and the patient is told through the failure sender.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from pages.calendar_utils import cancel_appointment_event, create_appointment_event, find_event_by_booking_id, get_busy_intervals, recurrence_exclusion
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows; the journal is then only safe within a single process
+    fcntl = None
+
+BOOKING_JOURNAL_PATH = os.environ.get('BOOKING_JOURNAL_PATH', 'booking_journal.log')
+BOOKING_RETRY_BASE_SECONDS = 2
+BOOKING_RETRY_MAX_SECONDS = 300
+BOOKING_MAX_ATTEMPTS = int(os.environ.get('BOOKING_MAX_ATTEMPTS', '10'))
+BOOKING_WORKER_IDLE_SECONDS = 5
+FAILED_BOOKINGS_LIMIT = 100
+
+
+class LoggingFailureSender:
+    """
+    Local stand-in that prints failed-booking notices and keeps them in memory, for development and tests.
+    A real sender (email, SMS) only has to provide the same send method.
+    """
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, failure):
+        print(f"Booking failed for {failure['user_name']} <{failure['user_email']}>: {failure['start']} could not be booked ({failure['reason']})")
+        self.sent.append(failure)
+
+
+class BookingJournal:
+    """
+    Durable write-ahead journal of bookings that have been acknowledged but not yet written to the calendar.
+    """
+
+    def __init__(self, path, sender):
+        self.path = path
+        self.failed_path = f"{path}.failed"
+        self.sender = sender
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.worker_lock_file = None
+
+    @contextmanager
+    def _locked(self):
+        """Hold the thread lock and, where supported, an exclusive file lock shared with other worker processes."""
+        with self.lock:
+            if fcntl is None:
+                yield
+                return
+            with open(f"{self.path}.lock", 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_pending(self):
+        """Return the pending booking records in journal order; called with the lock held."""
+        if not os.path.exists(self.path):
+            return []
+
+        bookings = {}
+        with open(self.path, 'r', encoding='utf-8') as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn last line from a crash mid-write was never acknowledged
+                    continue
+                if record.get('type') == 'booking':
+                    bookings[record['id']] = record
+                else:
+                    bookings.pop(record.get('id'), None)
+        return list(bookings.values())
+
+    def _append(self, record, path=None):
+        """Append a record and fsync it; called with the lock held."""
+        with open(path or self.path, 'a', encoding='utf-8') as journal:
+            journal.write(json.dumps(record) + '\n')
+            journal.flush()
+            os.fsync(journal.fileno())
+
+    def _booking_intervals(self, booking):
+        """(start, end) of every slot a booking holds; a recurring series holds one per occurrence."""
+        duration = timedelta(minutes=booking['duration_minutes'])
+        for start in booking.get('occurrences', [booking['start']]):
+            start = datetime.fromisoformat(start)
+            yield start, start + duration
+
+    def _overlaps(self, pending, start_time, end_time):
+        for booking in pending:
+            for booking_start, booking_end in self._booking_intervals(booking):
+                if booking_start < end_time and booking_end > start_time:
+                    return True
+        return False
+
+    def reserve(self, start_time: datetime, user_name, user_email, duration_minutes=30, recurrence=None, occurrences=None):
+        """
+        Reserve the slot locally and commit the booking to the journal.
+        For a recurring series, recurrence holds the Calendar recurrence rules and occurrences the start times they expand to.
+        Returns the booking record, or None if a pending booking already holds an overlapping slot.
+        """
+        duration = timedelta(minutes=duration_minutes)
+        with self._locked():
+            pending = self._read_pending()
+            for occurrence in occurrences or [start_time]:
+                if self._overlaps(pending, occurrence, occurrence + duration):
+                    return None
+
+            record = {
+                'type': 'booking',
+                'id': uuid.uuid4().hex,
+                'start': start_time.isoformat(),
+                'duration_minutes': duration_minutes,
+                'user_name': user_name,
+                'user_email': user_email,
+            }
+            if recurrence:
+                record['recurrence'] = recurrence
+                record['occurrences'] = [occurrence.isoformat() for occurrence in occurrences]
+            self._append(record)
+        self.wake.set()
+        return record
+
+    def pending_bookings(self, user_email):
+        """
+        Return the patient's bookings that are not in the calendar yet, in journal order.
+        """
+        with self._locked():
+            pending = self._read_pending()
+        return [booking for booking in pending if (booking['user_email'] or '').lower() == user_email.lower()]
+
+    def cancel(self, booking_id):
+        """
+        Cancel a booking that is not in the calendar yet. Returns False if it is no longer pending.
+        """
+        with self._locked():
+            if not any(booking['id'] == booking_id for booking in self._read_pending()):
+                return False
+            self._append({'type': 'cancelled', 'id': booking_id})
+        return True
+
+    def move(self, booking_id, start_time: datetime):
+        """
+        Move a single booking that is not in the calendar yet to a new start time.
+        The old booking is cancelled and the new one journaled together. Returns the new booking record,
+        or None if the old one is no longer pending or another pending booking holds the new slot.
+        """
+        with self._locked():
+            pending = self._read_pending()
+            booking = next((booking for booking in pending if booking['id'] == booking_id), None)
+            if booking is None or booking.get('recurrence'):
+                return None
+            others = [other for other in pending if other['id'] != booking_id]
+            if self._overlaps(others, start_time, start_time + timedelta(minutes=booking['duration_minutes'])):
+                return None
+
+            record = dict(booking, id=uuid.uuid4().hex, start=start_time.isoformat())
+            self._append({'type': 'cancelled', 'id': booking_id})
+            self._append(record)
+        self.wake.set()
+        return record
+
+    def pending_intervals(self):
+        """
+        Return (start, end) of the bookings that are not in the calendar yet.
+        """
+        with self._locked():
+            pending = self._read_pending()
+        intervals = []
+        for booking in pending:
+            intervals.extend(self._booking_intervals(booking))
+        return sorted(intervals)
+
+    def start_worker(self):
+        """
+        Start the replay worker. With several processes, only the one holding the worker lock replays.
+        """
+        if self.thread is not None:
+            return
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, name='booking-journal', daemon=True)
+        self.thread.start()
+
+    def stop_worker(self):
+        """
+        Stop the replay worker; pending bookings stay in the journal for the next start.
+        """
+        self.stopped.set()
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join(timeout=10)
+            self.thread = None
+
+    def _acquire_worker_lock(self):
+        if fcntl is None:
+            return True
+        lock_file = open(f"{self.path}.worker", 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self.worker_lock_file = lock_file
+        return True
+
+    def _run(self):
+        while not self._acquire_worker_lock():
+            if self.stopped.wait(BOOKING_WORKER_IDLE_SECONDS):
+                return
+
+        attempts = {}
+        next_attempt = {}
+        while not self.stopped.is_set():
+            self.wake.clear()
+            with self._locked():
+                pending = self._read_pending()
+                if not pending and os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+                    # Everything was replayed, so the journal can start over empty
+                    open(self.path, 'w').close()
+
+            now = time.monotonic()
+            for booking in pending:
+                if next_attempt.get(booking['id'], 0) > now:
+                    continue
+                if self._replay(booking):
+                    attempts.pop(booking['id'], None)
+                    next_attempt.pop(booking['id'], None)
+                    continue
+
+                attempts[booking['id']] = attempts.get(booking['id'], 0) + 1
+                if attempts[booking['id']] >= BOOKING_MAX_ATTEMPTS:
+                    print(f"Giving up on booking {booking['id']} for {booking['user_name']} at {booking['start']} after {attempts[booking['id']]} attempts")
+                    self._fail(booking, 'calendar unavailable')
+                    continue
+                delay = min(BOOKING_RETRY_BASE_SECONDS * 2 ** (attempts[booking['id']] - 1), BOOKING_RETRY_MAX_SECONDS)
+                next_attempt[booking['id']] = time.monotonic() + delay
+
+            if next_attempt:
+                timeout = max(0.1, min(next_attempt.values()) - time.monotonic())
+            else:
+                timeout = BOOKING_WORKER_IDLE_SECONDS
+            self.wake.wait(timeout)
+
+    def _replay(self, booking):
+        """
+        Write one pending booking to the calendar. Returns True once the journal has its outcome.
+        """
+        start_time = datetime.fromisoformat(booking['start'])
+
+        # Reconcile first: the event may have been created just before a crash, before it was journaled
+        existing = find_event_by_booking_id(booking['id'])
+        if existing is None:
+            return False
+        if existing:
+            self._commit(booking, existing['id'])
+            return True
+
+        intervals = list(self._booking_intervals(booking))
+        busy = get_busy_intervals(intervals[0][0], intervals[-1][1])
+        if busy is None:
+            return False
+        taken = [start for start, end in intervals if any(busy_start < end and busy_end > start for busy_start, busy_end in busy)]
+        recurrence = booking.get('recurrence')
+        if taken and (not recurrence or len(taken) == len(intervals)):
+            print(f"Booking {booking['id']} for {booking['user_name']} at {booking['start']} conflicts with an event added directly to the calendar")
+            self._fail(booking, 'slot taken')
+            return True
+        if taken:
+            # Skip the occurrences that were taken in the meantime and keep the rest of the series
+            print(f"Series {booking['id']} for {booking['user_name']} skips {len(taken)} occurrences that conflict with events added directly to the calendar")
+            recurrence = recurrence + [recurrence_exclusion(taken)]
+
+        event = create_appointment_event(
+            start_time,
+            booking['user_name'],
+            booking['user_email'],
+            booking['duration_minutes'],
+            booking_id=booking['id'],
+            recurrence=recurrence,
+            occurrences=[start for start, _ in intervals if start not in taken],
+        )
+        if not event:
+            return False
+        self._commit(booking, event.get('id'))
+        return True
+
+    def _commit(self, booking, event_id):
+        """
+        Record that the booking is in the calendar. If the patient cancelled or moved it while it was being written,
+        the event is deleted again instead.
+        """
+        with self._locked():
+            still_pending = any(pending['id'] == booking['id'] for pending in self._read_pending())
+            if still_pending:
+                self._append({'type': 'committed', 'id': booking['id'], 'event_id': event_id})
+        if not still_pending:
+            print(f"Booking {booking['id']} was cancelled while it was written to the calendar; deleting event {event_id}")
+            cancel_appointment_event(event_id)
+
+    def _fail(self, booking, reason):
+        """
+        Give up on a booking: keep it in the failures file for the doctor, close it in the journal and tell the patient.
+        """
+        failure = dict(booking, type='failed', reason=reason, failed_at=datetime.now(timezone.utc).isoformat())
+        with self._locked():
+            if not any(pending['id'] == booking['id'] for pending in self._read_pending()):
+                # Cancelled by the patient in the meantime, so there is nothing to report
+                return
+            # The failures file is written first, so a crash in between retries the booking rather than losing it
+            self._append(failure, self.failed_path)
+            self._append({'type': 'failed', 'id': booking['id'], 'reason': reason})
+        try:
+            self.sender.send(failure)
+        except Exception as e:
+            print(f"Error sending failed booking notice: {e}")
+
+    def failed_bookings(self, limit=FAILED_BOOKINGS_LIMIT):
+        """
+        Return the most recent bookings that could not be written to the calendar, newest first.
+        """
+        with self._locked():
+            if not os.path.exists(self.failed_path):
+                return []
+            with open(self.failed_path, 'r', encoding='utf-8') as failures:
+                lines = failures.readlines()
+
+        records = []
+        for line in reversed(lines):
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+            if len(records) >= limit:
+                break
+        return records
+
+
+booking_journal = BookingJournal(BOOKING_JOURNAL_PATH, LoggingFailureSender())
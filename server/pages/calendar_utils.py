@@ -1,14 +1,25 @@
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
+from googleapiclient.http import build_http
+import google_auth_httplib2
 from datetime import datetime, timedelta, timezone
-import pytz
 import re
 import os
+import threading
 from googleapiclient.errors import HttpError
+from pages.appointment_index import appointment_index
+from pages.reminder_scheduler import reminder_scheduler
+from pages.waitlist import waitlist
+from pages.clinic_time import CLINIC_TIMEZONE, clinic_tz
 
 SERVICE_ACCOUNT_FILE = 'credentials.json'
 CALENDAR_ID = os.environ.get('CALENDAR_ID', '')
 SCOPES = ['https://www.googleapis.com/auth/calendar']
+INDEX_SYNC_DAYS = int(os.environ.get('INDEX_SYNC_DAYS', '180'))
+INDEX_SYNC_SECONDS = int(os.environ.get('INDEX_SYNC_SECONDS', '300'))
+INDEX_SNAPSHOT_PATH = os.environ.get('INDEX_SNAPSHOT_PATH', 'appointment_index.json')
+INDEX_RELOAD_SECONDS = 10
+BOOKING_FREEBUSY_TIMEOUT_SECONDS = int(os.environ.get('BOOKING_FREEBUSY_TIMEOUT_SECONDS', '3'))
 
 try:
     credentials = service_account.Credentials.from_service_account_file(
@@ -16,8 +27,40 @@ try:
     service = build('calendar', 'v3', credentials=credentials)
 except Exception as e:
     print(f"Error initializing Google Calendar service: {e}")
+    credentials = None
     service = None
 
+_thread_state = threading.local()
+
+
+def _http(timeout=None):
+    """
+    Authorized HTTP connection of the current thread. httplib2 is not thread-safe, and request threads,
+    the index sync and the journal worker all share the one service object, so each thread sends its
+    calls over its own connection. build_http gives it the client library's default timeout, so a hung
+    call fails instead of holding its thread; calls that need a shorter timeout get a connection of their own.
+    """
+    if credentials is None:
+        return None
+    connections = getattr(_thread_state, 'connections', None)
+    if connections is None:
+        connections = _thread_state.connections = {}
+    http = connections.get(timeout)
+    if http is None:
+        http = build_http()
+        if timeout is not None:
+            http.timeout = timeout
+        http = connections[timeout] = google_auth_httplib2.AuthorizedHttp(credentials, http=http)
+    return http
+
+
+def is_calendar_configured():
+    """
+    Check that a calendar service and CALENDAR_ID are set up, without calling the API.
+    """
+    return service is not None and bool(CALENDAR_ID)
+
+
 def is_calendar_available():
     """
     Check if the Google Calendar service is available and properly configured.
@@ -28,7 +71,7 @@ def is_calendar_available():
         return False
     
     try:
-        service.calendarList().get(calendarId=CALENDAR_ID).execute()
+        service.calendarList().get(calendarId=CALENDAR_ID).execute(http=_http())
         return True
     except HttpError as e:
         print(f"Calendar access error: {e}")
@@ -37,41 +80,68 @@ def is_calendar_available():
         print(f"Unexpected error checking calendar availability: {e}")
         return False
 
-def is_time_available(start_time: datetime, duration_minutes=30) -> bool:
+
+def _parse_calendar_datetime(value):
     """
-    Check if the given time slot is available.
+    Parse an RFC 3339 timestamp returned by the Calendar API.
+    """
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def get_busy_intervals(time_min: datetime, time_max: datetime, timeout=None):
+    """
+    Fetch the busy intervals of the clinic calendar between two aware datetimes with a single free/busy query.
+    Returns a sorted list of (start, end) aware datetimes, or None if the calendar could not be queried
+    within timeout seconds (by default the client library's timeout).
     """
     if not service or not CALENDAR_ID:
-        print("Calendar service not available. Cannot check time availability.")
-        return False
-        
-    try:
-        if start_time.tzinfo is None:
-            jerusalem = pytz.timezone('Asia/Jerusalem')
-            start_time = jerusalem.localize(start_time).astimezone(timezone.utc)
-        else:
-            start_time = start_time.astimezone(timezone.utc)
-        end_time = start_time + timedelta(minutes=duration_minutes)
+        print("Calendar service not available. Cannot fetch busy intervals.")
+        return None
 
-        events_result = service.events().list(
-            calendarId=CALENDAR_ID,
-            timeMin=start_time.isoformat(),
-            timeMax=end_time.isoformat(),
-            singleEvents=True,
-            orderBy='startTime'
-        ).execute()
-        return len(events_result.get('items', [])) == 0
+    try:
+        freebusy_result = service.freebusy().query(body={
+            'timeMin': time_min.astimezone(timezone.utc).isoformat(),
+            'timeMax': time_max.astimezone(timezone.utc).isoformat(),
+            'items': [{'id': CALENDAR_ID}],
+        }).execute(http=_http(timeout))
+        busy = freebusy_result.get('calendars', {}).get(CALENDAR_ID, {}).get('busy', [])
+        return sorted(
+            (_parse_calendar_datetime(interval['start']), _parse_calendar_datetime(interval['end']))
+            for interval in busy
+        )
     except HttpError as e:
-        print(f"Google Calendar API error when checking availability: {e}")
-        return False
+        print(f"Google Calendar API error when fetching busy intervals: {e}")
+        return None
     except Exception as e:
-        print(f"Unexpected error when checking time availability: {e}")
-        return False
+        print(f"Unexpected error when fetching busy intervals: {e}")
+        return None
+
+
+def weekly_recurrence(count, interval_weeks=1):
+    """
+    Recurrence rule of a weekly appointment series, in the format the Calendar API expects.
+    """
+    return [f"RRULE:FREQ=WEEKLY;INTERVAL={interval_weeks};COUNT={count}"]
 
 
-def create_appointment_event(start_time: datetime, user_name, user_email, duration_minutes=30):
+def recurrence_exclusion(starts):
+    """
+    EXDATE line that skips the given occurrences of a series.
+    """
+    return f"EXDATE;TZID={CLINIC_TIMEZONE}:" + ",".join(start.astimezone(clinic_tz).strftime('%Y%m%dT%H%M%S') for start in starts)
+
+
+def instance_event_id(event_id, start_time: datetime):
+    """
+    ID the Calendar API gives one occurrence of a recurring event.
+    """
+    return f"{event_id}_{start_time.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}"
+
+
+def create_appointment_event(start_time: datetime, user_name, user_email, duration_minutes=30, booking_id=None, recurrence=None, occurrences=None):
     """
     Create a meeting event on the clinic calendar 
+    A recurring series is created as one event with recurrence rules; occurrences lists the start times it expands to.
     """
     if not service or not CALENDAR_ID:
         print("Calendar service not available. Cannot create appointment.")
@@ -84,10 +154,23 @@ def create_appointment_event(start_time: datetime, user_name, user_email, durati
             'summary': f'Appointment for {user_name}',
             'description': f'Contact Information:\nName: {user_name}' + 
                           (f'\nEmail: {user_email}' if user_email else ''),
-            'start': {'dateTime': start_time.isoformat(), 'timeZone': 'Asia/Jerusalem'},
-            'end': {'dateTime': end_time.isoformat(), 'timeZone': 'Asia/Jerusalem'},
+            'start': {'dateTime': start_time.isoformat(), 'timeZone': CLINIC_TIMEZONE},
+            'end': {'dateTime': end_time.isoformat(), 'timeZone': CLINIC_TIMEZONE},
         }
-        created_event = service.events().insert(calendarId=CALENDAR_ID, body=event).execute()
+        if booking_id:
+            event['extendedProperties'] = {'private': {'booking_id': booking_id}}
+        if recurrence:
+            event['recurrence'] = recurrence
+        created_event = service.events().insert(calendarId=CALENDAR_ID, body=event).execute(http=_http())
+        if recurrence:
+            # Occurrences are indexed under the IDs the Calendar API gives the single instances
+            for occurrence in occurrences or []:
+                occurrence_id = instance_event_id(created_event.get('id'), occurrence)
+                appointment_index.add(user_email, occurrence_id, occurrence, duration_minutes)
+                reminder_scheduler.schedule(occurrence_id, occurrence, user_name, user_email)
+        else:
+            appointment_index.add(user_email, created_event.get('id'), start_time, duration_minutes)
+            reminder_scheduler.schedule(created_event.get('id'), start_time, user_name, user_email)
         return created_event
     except HttpError as e:
         print(f"Google Calendar API error when creating appointment: {e}")
@@ -97,6 +180,137 @@ def create_appointment_event(start_time: datetime, user_name, user_email, durati
         return None
 
 
+def find_event_by_booking_id(booking_id):
+    """
+    Look up the event created for a journaled booking.
+    Returns the event, False if there is none, or None if the calendar could not be queried.
+    """
+    if not service or not CALENDAR_ID:
+        print("Calendar service not available. Cannot look up booking.")
+        return None
+
+    try:
+        events_result = service.events().list(
+            calendarId=CALENDAR_ID,
+            privateExtendedProperty=f'booking_id={booking_id}',
+            singleEvents=True
+        ).execute(http=_http())
+        items = events_result.get('items', [])
+        return items[0] if items else False
+    except HttpError as e:
+        print(f"Google Calendar API error when looking up booking: {e}")
+        return None
+    except Exception as e:
+        print(f"Unexpected error when looking up booking: {e}")
+        return None
+
+
+def cancel_appointment_event(event_id):
+    """
+    Delete an appointment event from the clinic calendar.
+    """
+    if not service or not CALENDAR_ID:
+        print("Calendar service not available. Cannot cancel appointment.")
+        return False
+
+    try:
+        service.events().delete(calendarId=CALENDAR_ID, eventId=event_id).execute(http=_http())
+        appointment_index.remove(event_id)
+        reminder_scheduler.cancel(event_id)
+        return True
+    except HttpError as e:
+        print(f"Google Calendar API error when cancelling appointment: {e}")
+        return False
+    except Exception as e:
+        print(f"Unexpected error when cancelling appointment: {e}")
+        return False
+
+
+def reschedule_appointment_event(event_id, new_start_time: datetime, duration_minutes=30):
+    """
+    Move an appointment event to a new start time.
+    """
+    if not service or not CALENDAR_ID:
+        print("Calendar service not available. Cannot reschedule appointment.")
+        return None
+
+    try:
+        end_time = new_start_time + timedelta(minutes=duration_minutes-1)
+        updated_event = service.events().patch(calendarId=CALENDAR_ID, eventId=event_id, body={
+            'start': {'dateTime': new_start_time.isoformat(), 'timeZone': CLINIC_TIMEZONE},
+            'end': {'dateTime': end_time.isoformat(), 'timeZone': CLINIC_TIMEZONE},
+        }).execute(http=_http())
+        appointment_index.move(event_id, new_start_time)
+        description = updated_event.get('description', '')
+        name_match = re.search(r'Name: (.+?)(?:\n|$)', description)
+        email_match = re.search(r'Email: (.+?)(?:\n|$)', description)
+        reminder_scheduler.schedule(
+            event_id,
+            new_start_time,
+            name_match.group(1).strip() if name_match else None,
+            email_match.group(1).strip() if email_match else None,
+        )
+        return updated_event
+    except HttpError as e:
+        print(f"Google Calendar API error when rescheduling appointment: {e}")
+        return None
+    except Exception as e:
+        print(f"Unexpected error when rescheduling appointment: {e}")
+        return None
+
+
+def _fetch_appointments(time_min: datetime, time_max: datetime):
+    """
+    List the appointment events between two aware datetimes.
+    Raises on Calendar API errors.
+    """
+    print(f"Fetching appointments from {time_min.isoformat()} to {time_max.isoformat()}")
+
+    events = []
+    page_token = None
+    while True:
+        events_result = service.events().list(
+            calendarId=CALENDAR_ID,
+            timeMin=time_min.isoformat(),
+            timeMax=time_max.isoformat(),
+            singleEvents=True,
+            orderBy='startTime',
+            pageToken=page_token
+        ).execute(http=_http())
+        events.extend(events_result.get('items', []))
+        page_token = events_result.get('nextPageToken')
+        if not page_token:
+            break
+
+    if not events:
+        print('No upcoming appointments found.')
+        return []
+
+    appointments = []
+
+    for event in events:
+        summary = event.get('summary', '')
+        if 'Appointment for' not in summary:
+            continue
+
+        description = event.get('description', '')
+        name_match = re.search(r'Name: (.+?)(?:\n|$)', description)
+        email_match = re.search(r'Email: (.+?)(?:\n|$)', description)
+
+        appointment = {
+            'id': event.get('id'),
+            'summary': summary,
+            'start': event['start'].get('dateTime'),
+            'end': event['end'].get('dateTime'),
+            'user_name': name_match.group(1).strip() if name_match else None,
+            'user_email': email_match.group(1).strip() if email_match else None,
+            'created': event.get('created'),
+        }
+
+        appointments.append(appointment)
+    return appointments
+
+
 def get_upcoming_appointments(days=30):
     """
     Fetch upcoming appointments from the clinic calendar.
@@ -107,50 +321,112 @@ def get_upcoming_appointments(days=30):
         
     try:
         now = datetime.now(timezone.utc)
-        time_min = now.isoformat()
-        time_max = (now + timedelta(days=days)).isoformat()
+        return _fetch_appointments(now, now + timedelta(days=days))
+    except HttpError as e:
+        print(f"Google Calendar API error when fetching appointments: {e}")
+        return []
+    except Exception as e:
+        print(f"Error fetching appointments from Google Calendar: {e}")
+        return []
 
-        print(f"Fetching appointments from {time_min} to {time_max}")
 
-        events_result = service.events().list(
-            calendarId=CALENDAR_ID,
-            timeMin=time_min,
-            timeMax=time_max,
-            singleEvents=True,
-            orderBy='startTime'
-        ).execute()
-
-        events = events_result.get('items', [])
-        if not events:
-            print('No upcoming appointments found.')
-            return []
-
-        appointments = []
-     
-        for event in events:
-            summary = event.get('summary', '')
-            if 'Appointment for' not in summary:
-                continue
-
-            description = event.get('description', '')
-            name_match = re.search(r'Name: (.+?)(?:\n|$)', description)
-            email_match = re.search(r'Email: (.+?)(?:\n|$)', description)
-
-            appointment = {
-                'summary': summary,
-                'start': event['start'].get('dateTime'),
-                'end': event['end'].get('dateTime'),
-                'user_name': name_match.group(1).strip() if name_match else None,
-                'user_email': email_match.group(1).strip() if email_match else None,
-            }
-
-            appointments.append(appointment)
-            print(appointments)
-        return appointments
+def get_appointments_between(time_min: datetime, time_max: datetime):
+    """
+    Fetch the appointments between two aware datetimes, past or future.
+    Returns None if the calendar could not be queried.
+    """
+    if not service or not CALENDAR_ID:
+        print("Calendar service not available. Cannot fetch appointments.")
+        return None
 
+    try:
+        return _fetch_appointments(time_min, time_max)
     except HttpError as e:
         print(f"Google Calendar API error when fetching appointments: {e}")
-        return []
+        return None
     except Exception as e:
         print(f"Error fetching appointments from Google Calendar: {e}")
+        return None
+
+
+def sync_appointment_index():
+    """
+    Rebuild the patient appointment index from the clinic calendar and queue reminders for any new events.
+    Slots of events that disappeared are offered to the waitlist.
+    Returns the (event_id, email, start, duration_minutes) entries that disappeared from the calendar since the last sync.
+    """
+    if not service or not CALENDAR_ID:
         return []
+
+    now = datetime.now(timezone.utc)
+    try:
+        appointments = _fetch_appointments(now, now + timedelta(days=INDEX_SYNC_DAYS))
+    except Exception as e:
+        # Keep the current index rather than wiping it because of a failed fetch
+        print(f"Error fetching appointments for the index sync: {e}")
+        return []
+
+    entries = []
+    for appointment in appointments:
+        if appointment['user_email'] and appointment['start'] and appointment['end']:
+            start = _parse_calendar_datetime(appointment['start'])
+            # Events end one minute before the slot does
+            duration_minutes = int((_parse_calendar_datetime(appointment['end']) - start).total_seconds() // 60) + 1
+            entries.append((appointment['user_email'], appointment['id'], start, duration_minutes))
+            # Only new or moved events are queued; known ones are left alone
+            reminder_scheduler.schedule(appointment['id'], start, appointment['user_name'], appointment['user_email'])
+
+    removed = appointment_index.replace_all(entries)
+    try:
+        appointment_index.save(INDEX_SNAPSHOT_PATH)
+    except OSError as e:
+        print(f"Error saving the appointment index snapshot: {e}")
+    for event_id, _, start, duration_minutes in removed:
+        reminder_scheduler.cancel(event_id)
+        # A worker that cancelled the event has already offered its slot; the waitlist skips it then
+        waitlist.slot_opened(start, duration_minutes, now, event_id)
+    waitlist.expire_offers(now)
+    return removed
+
+
+def start_appointment_index_sync():
+    """
+    Sync the appointment index now and then every INDEX_SYNC_SECONDS in a background thread.
+    """
+    def run():
+        while True:
+            try:
+                sync_appointment_index()
+            except Exception as e:
+                print(f"Error syncing appointment index: {e}")
+            stop_event.wait(INDEX_SYNC_SECONDS)
+            if stop_event.is_set():
+                return
+
+    stop_event = threading.Event()
+    threading.Thread(target=run, name='appointment-index-sync', daemon=True).start()
+    return stop_event
+
+
+def start_appointment_index_reload():
+    """
+    Load the index snapshot saved by the worker that runs the sync whenever it changes, in a background thread.
+    Set the returned event to stop, e.g. when this worker takes over the sync itself.
+    """
+    def run():
+        loaded_mtime = None
+        while not stop_event.is_set():
+            try:
+                mtime = os.path.getmtime(INDEX_SNAPSHOT_PATH)
+                if mtime != loaded_mtime:
+                    appointment_index.load(INDEX_SNAPSHOT_PATH)
+                    loaded_mtime = mtime
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"Error loading the appointment index snapshot: {e}")
+            stop_event.wait(INDEX_RELOAD_SECONDS)
+
+    stop_event = threading.Event()
+    threading.Thread(target=run, name='appointment-index-reload', daemon=True).start()
+    return stop_event
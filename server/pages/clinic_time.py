@@ -0,0 +1,40 @@
+"""
+The clinic timezone is resolved once from CLINIC_TIMEZONE. Dates and times patients type are read in clinic time,
+and a request reads the clock once and passes that "now" down, so every check in the request agrees on the date.
+"""
+import os
+from datetime import datetime, time
+import pytz
+
+CLINIC_TIMEZONE = os.environ.get('CLINIC_TIMEZONE', 'Asia/Jerusalem')
+clinic_tz = pytz.timezone(CLINIC_TIMEZONE)
+
+
+def clinic_now():
+    """
+    Current time in the clinic timezone.
+    """
+    return datetime.now(clinic_tz)
+
+
+def clinic_today(now=None):
+    """
+    Current date at the clinic.
+    """
+    return (now or clinic_now()).date()
+
+
+def clinic_datetime(day, hour=0, minute=0):
+    """
+    Aware datetime for a wall-clock time at the clinic on the given date.
+    """
+    return clinic_tz.localize(datetime.combine(day, time(hour, minute)))
+
+
+def to_clinic_time(moment):
+    """
+    Convert an aware datetime to clinic time; naive datetimes are taken to be clinic time already.
+    """
+    if moment.tzinfo is None:
+        return clinic_tz.localize(moment)
+    return moment.astimezone(clinic_tz)
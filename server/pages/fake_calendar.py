@@ -0,0 +1,208 @@
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+import pytz
+
+
+def _parse(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def _instances(event):
+    """
+    Expand a recurring event into its single instances, like the API does with singleEvents=True.
+    Only the weekly rules with COUNT and EXDATE lines that the server writes are understood.
+    """
+    if not event.get('recurrence'):
+        return [event]
+
+    rule = dict(part.split('=') for part in event['recurrence'][0][len('RRULE:'):].split(';'))
+    excluded = set()
+    for line in event['recurrence'][1:]:
+        if line.startswith('EXDATE'):
+            excluded.update(line.split(':', 1)[1].split(','))
+
+    tz = pytz.timezone(event['start'].get('timeZone', 'UTC'))
+    first_start = _parse(event['start']['dateTime']).astimezone(tz)
+    length = _parse(event['end']['dateTime']) - first_start
+    instances = []
+    for number in range(int(rule['COUNT'])):
+        local_start = first_start.replace(tzinfo=None) + timedelta(weeks=number * int(rule.get('INTERVAL', 1)))
+        if local_start.strftime('%Y%m%dT%H%M%S') in excluded:
+            continue
+        start = tz.localize(local_start)
+        instance = dict(event)
+        instance.pop('recurrence')
+        instance['id'] = f"{event['id']}_{start.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}"
+        instance['recurringEventId'] = event['id']
+        instance['start'] = {'dateTime': start.isoformat(), 'timeZone': tz.zone}
+        instance['end'] = {'dateTime': (start + length).isoformat(), 'timeZone': tz.zone}
+        instances.append(instance)
+    return instances
+
+
+class _FakeRequest:
+    """
+    Stands in for a googleapiclient request: the call happens, after the configured latency, on execute().
+    """
+
+    def __init__(self, calendar, action):
+        self.calendar = calendar
+        self.action = action
+
+    def execute(self, http=None):
+        self.calendar.wait_latency()
+        return self.action()
+
+
+class _FakeEvents:
+    def __init__(self, calendar):
+        self.calendar = calendar
+
+    def list(self, calendarId, timeMin=None, timeMax=None, singleEvents=True, orderBy=None, pageToken=None, privateExtendedProperty=None):
+        def action():
+            events = self.calendar.instances()
+            if privateExtendedProperty:
+                key, _, value = privateExtendedProperty.partition('=')
+                events = [e for e in events if e.get('extendedProperties', {}).get('private', {}).get(key) == value]
+            if timeMin:
+                events = [e for e in events if _parse(e['end']['dateTime']) > _parse(timeMin)]
+            if timeMax:
+                events = [e for e in events if _parse(e['start']['dateTime']) < _parse(timeMax)]
+            events.sort(key=lambda e: _parse(e['start']['dateTime']))
+            return {'items': events}
+        return _FakeRequest(self.calendar, action)
+
+    def insert(self, calendarId, body):
+        def action():
+            event = dict(body)
+            event['id'] = uuid.uuid4().hex
+            event['created'] = datetime.now(timezone.utc).isoformat()
+            with self.calendar.lock:
+                self.calendar.stored_events[event['id']] = event
+            return event
+        return _FakeRequest(self.calendar, action)
+
+    def patch(self, calendarId, eventId, body):
+        def action():
+            with self.calendar.lock:
+                if eventId not in self.calendar.stored_events:
+                    # Changing one occurrence of a series turns it into a standalone exception
+                    instance = self.calendar.exclude_instance(eventId)
+                    self.calendar.stored_events[eventId] = instance
+                self.calendar.stored_events[eventId].update(body)
+                return dict(self.calendar.stored_events[eventId])
+        return _FakeRequest(self.calendar, action)
+
+    def delete(self, calendarId, eventId):
+        def action():
+            with self.calendar.lock:
+                if self.calendar.stored_events.pop(eventId, None) is None:
+                    self.calendar.exclude_instance(eventId)
+            return ''
+        return _FakeRequest(self.calendar, action)
+
+
+class _FakeFreeBusy:
+    def __init__(self, calendar):
+        self.calendar = calendar
+
+    def query(self, body):
+        def action():
+            time_min, time_max = _parse(body['timeMin']), _parse(body['timeMax'])
+            intervals = sorted(
+                (_parse(e['start']['dateTime']), _parse(e['end']['dateTime']))
+                for e in self.calendar.instances()
+            )
+            busy = []
+            for start, end in intervals:
+                if end <= time_min or start >= time_max:
+                    continue
+                if busy and start <= busy[-1][1]:
+                    busy[-1] = (busy[-1][0], max(busy[-1][1], end))
+                else:
+                    busy.append((start, end))
+            return {'calendars': {
+                calendar_id['id']: {'busy': [{'start': s.isoformat(), 'end': e.isoformat()} for s, e in busy]}
+                for calendar_id in body.get('items', [])
+            }}
+        return _FakeRequest(self.calendar, action)
+
+
+class _FakeCalendarList:
+    def __init__(self, calendar):
+        self.calendar = calendar
+
+    def get(self, calendarId):
+        return _FakeRequest(self.calendar, lambda: {'id': calendarId})
+
+
+class FakeCalendarService:
+    """
+    In-memory fake of the parts of the Google Calendar API that the server uses, with configurable latency.
+    Used by the load test in place of calendar_utils.service.
+    """
+
+    def __init__(self, latency_seconds=0.0, jitter_seconds=0.0):
+        self.latency = latency_seconds
+        self.jitter = jitter_seconds
+        self.lock = threading.Lock()
+        self.stored_events = {}
+        self.calls = 0
+
+    def wait_latency(self):
+        with self.lock:
+            self.calls += 1
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def events(self):
+        return _FakeEvents(self)
+
+    def freebusy(self):
+        return _FakeFreeBusy(self)
+
+    def calendarList(self):
+        return _FakeCalendarList(self)
+
+    def instances(self):
+        """
+        All single events, with recurring series expanded.
+        """
+        with self.lock:
+            events = list(self.stored_events.values())
+        return [instance for event in events for instance in _instances(event)]
+
+    def exclude_instance(self, instance_id):
+        """
+        Drop one occurrence from its series; called with the lock held. Returns the dropped instance, or None.
+        """
+        series_id = instance_id.rsplit('_', 1)[0]
+        series = self.stored_events.get(series_id)
+        if not series or not series.get('recurrence'):
+            return None
+        instance = next((i for i in _instances(series) if i['id'] == instance_id), None)
+        if instance is None:
+            return None
+        local_start = _parse(instance['start']['dateTime']).astimezone(pytz.timezone(series['start'].get('timeZone', 'UTC')))
+        series['recurrence'] = series['recurrence'] + [f"EXDATE;TZID={series['start'].get('timeZone', 'UTC')}:{local_start.strftime('%Y%m%dT%H%M%S')}"]
+        return instance
+
+    def count_double_bookings(self):
+        """
+        Count pairs of overlapping events.
+        """
+        intervals = sorted(
+            (_parse(e['start']['dateTime']), _parse(e['end']['dateTime']))
+            for e in self.instances()
+        )
+        overlaps = 0
+        for i, (start, end) in enumerate(intervals):
+            for other_start, _ in intervals[i + 1:]:
+                if other_start >= end:
+                    break
+                overlaps += 1
+        return overlaps
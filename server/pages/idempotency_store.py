@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pages.redis_client import get_redis_client
+
+# Stored responses expire after IDEMPOTENCY_TTL_SECONDS; the in-process store keeps at most IDEMPOTENCY_MAX_ENTRIES.
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', '86400'))
+IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get('IDEMPOTENCY_MAX_ENTRIES', '10000'))
+IDEMPOTENCY_REDIS_URL = os.environ.get('IDEMPOTENCY_REDIS_URL', '')
+
+IN_PROGRESS = 'in_progress'
+COMPLETED = 'completed'
+NEW = 'new'
+MISMATCH = 'mismatch'
+
+
+def fingerprint_request(payload):
+    """
+    Hash the request body so a reused key with a different message can be detected.
+    """
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class IdempotencyStore:
+    """
+    Bounded TTL store of responses keyed by idempotency key.
+    A key is reserved while its request is running, so a concurrent retry does not run it twice.
+    """
+
+    def __init__(self, ttl_seconds, max_entries, redis_client=None, prefix='idempotency'):
+        self.ttl = ttl_seconds
+        self.max_entries = max_entries
+        self.redis = redis_client
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def begin(self, key, fingerprint):
+        """
+        Reserve the key for a new request.
+        Returns (state, stored_response); stored_response is only set for COMPLETED.
+        """
+        if self.redis is not None:
+            return self._begin_redis(key, fingerprint)
+
+        now = time.monotonic()
+        with self.lock:
+            self._evict_expired(now)
+            entry = self.entries.get(key)
+            if entry is None:
+                self.entries[key] = {'state': IN_PROGRESS, 'fingerprint': fingerprint, 'expires': now + self.ttl}
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+                return NEW, None
+            if entry['fingerprint'] != fingerprint:
+                return MISMATCH, None
+            return entry['state'], entry.get('response')
+
+    def complete(self, key, response):
+        """
+        Store the response for the reserved key.
+        """
+        if self.redis is not None:
+            return self._complete_redis(key, response)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry['state'] = COMPLETED
+                entry['response'] = response
+                entry['expires'] = time.monotonic() + self.ttl
+                self.entries.move_to_end(key)
+
+    def release(self, key):
+        """
+        Forget a reserved key whose request failed, so the client can retry it.
+        """
+        if self.redis is not None:
+            self.redis.delete(f"{self.prefix}:{key}")
+            return
+
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def _evict_expired(self, now):
+        """Entries are kept in insertion order, so expired ones are at the front; called with the lock held."""
+        while self.entries:
+            oldest_key = next(iter(self.entries))
+            if self.entries[oldest_key]['expires'] > now:
+                break
+            del self.entries[oldest_key]
+
+    def _begin_redis(self, key, fingerprint):
+        redis_key = f"{self.prefix}:{key}"
+        entry = {'state': IN_PROGRESS, 'fingerprint': fingerprint}
+        if self.redis.set(redis_key, json.dumps(entry), nx=True, ex=self.ttl):
+            return NEW, None
+
+        stored = self.redis.get(redis_key)
+        if stored is None:
+            # Expired between the two calls; treat it as a new request
+            return self._begin_redis(key, fingerprint)
+        entry = json.loads(stored)
+        if entry['fingerprint'] != fingerprint:
+            return MISMATCH, None
+        return entry['state'], entry.get('response')
+
+    def _complete_redis(self, key, response):
+        redis_key = f"{self.prefix}:{key}"
+        stored = self.redis.get(redis_key)
+        fingerprint = json.loads(stored)['fingerprint'] if stored else None
+        entry = {'state': COMPLETED, 'fingerprint': fingerprint, 'response': response}
+        self.redis.set(redis_key, json.dumps(entry), ex=self.ttl)
+
+
+idempotency_store = IdempotencyStore(
+    IDEMPOTENCY_TTL_SECONDS,
+    IDEMPOTENCY_MAX_ENTRIES,
+    redis_client=get_redis_client(IDEMPOTENCY_REDIS_URL),
+)
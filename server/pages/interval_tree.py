@@ -0,0 +1,91 @@
+class _Node:
+    def __init__(self, center, by_start, by_end, left, right):
+        self.center = center
+        self.by_start = by_start
+        self.by_end = by_end
+        self.left = left
+        self.right = right
+
+
+class IntervalTree:
+    """
+    Static centered interval tree over half-open (start, end) intervals.
+    Overlap and gap queries take O(log n + k log k), k being the intervals in the query window,
+    instead of scanning every booking of the day.
+    """
+
+    def __init__(self, intervals):
+        self.root = self._build(sorted(intervals))
+
+    def _build(self, intervals):
+        if not intervals:
+            return None
+        center = intervals[len(intervals) // 2][0]
+        left, here, right = [], [], []
+        for interval in intervals:
+            if interval[1] <= center:
+                left.append(interval)
+            elif interval[0] > center:
+                right.append(interval)
+            else:
+                here.append(interval)
+        return _Node(
+            center,
+            sorted(here),
+            sorted(here, key=lambda interval: interval[1], reverse=True),
+            self._build(left),
+            self._build(right),
+        )
+
+    def overlapping(self, start, end):
+        """
+        Return the intervals that overlap [start, end).
+        """
+        found = []
+        node = self.root
+        stack = [node] if node else []
+        while stack:
+            node = stack.pop()
+            if end <= node.center:
+                # Intervals here contain the center, so they overlap when they start before the query ends
+                for interval in node.by_start:
+                    if interval[0] >= end:
+                        break
+                    found.append(interval)
+                if node.left:
+                    stack.append(node.left)
+            elif start > node.center:
+                for interval in node.by_end:
+                    if interval[1] <= start:
+                        break
+                    found.append(interval)
+                if node.right:
+                    stack.append(node.right)
+            else:
+                found.extend(node.by_start)
+                if node.left:
+                    stack.append(node.left)
+                if node.right:
+                    stack.append(node.right)
+        return found
+
+    def is_free(self, start, end):
+        """
+        Check that nothing overlaps [start, end).
+        """
+        return not self.overlapping(start, end)
+
+    def free_gaps(self, window_start, window_end):
+        """
+        Return the free (start, end) gaps inside the window, in order.
+        Only the intervals the tree finds overlapping the window are swept.
+        """
+        gaps = []
+        cursor = window_start
+        for start, end in sorted(self.overlapping(window_start, window_end)):
+            if start > cursor:
+                gaps.append((cursor, start))
+            cursor = max(cursor, end)
+        if cursor < window_end:
+            gaps.append((cursor, window_end))
+        return gaps
@@ -0,0 +1,190 @@
+import math
+import os
+import threading
+import time
+import zlib
+from functools import wraps
+from flask import request, jsonify
+from pages.appointment_processor import get_user_id_from_token
+from pages.redis_client import get_redis_client
+
+# The limits are in the ENV file so they can be tuned per deployment.
+RATE_LIMIT_REQUESTS = int(os.environ.get('RATE_LIMIT_REQUESTS', '20'))
+RATE_LIMIT_WINDOW_SECONDS = int(os.environ.get('RATE_LIMIT_WINDOW_SECONDS', '60'))
+RATE_LIMIT_SHARDS = int(os.environ.get('RATE_LIMIT_SHARDS', '16'))
+RATE_LIMIT_REDIS_URL = os.environ.get('RATE_LIMIT_REDIS_URL', '')
+AVAILABILITY_RATE_LIMIT_REQUESTS = int(os.environ.get('AVAILABILITY_RATE_LIMIT_REQUESTS', '120'))
+
+
+class _Shard:
+    """
+    A slice of the in-process counters with its own lock, so concurrent clients rarely contend.
+    Each key maps to [window_index, current_count, previous_count].
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.last_sweep = 0
+
+
+class SlidingWindowRateLimiter:
+    """
+    Sliding-window counter limiter: the previous window's count is weighted by how much of it
+    still overlaps the sliding window, which approximates a true sliding log in O(1) memory per key.
+    """
+
+    def __init__(self, limit, window_seconds, shards=16, redis_client=None, prefix='rate-limit'):
+        self.limit = limit
+        self.window = window_seconds
+        self.shards = [_Shard() for _ in range(max(1, shards))]
+        self.redis = redis_client
+        self.prefix = prefix
+
+    def hit(self, key, now=None):
+        """
+        Record a request for the key. Only allowed requests are counted, so a client that waits
+        as long as it was told to is let through.
+        Returns (allowed, retry_after_seconds).
+        """
+        if now is None:
+            now = time.time()
+        window_index = int(now // self.window)
+        elapsed = now - window_index * self.window
+        weight = 1 - elapsed / self.window
+
+        if self.redis is not None:
+            try:
+                allowed, current, previous = self._hit_redis(key, window_index, weight)
+            except Exception as e:
+                print(f"Rate limiter Redis error, falling back to local counters: {e}")
+                allowed, current, previous = self._hit_local(key, window_index, weight, now)
+        else:
+            allowed, current, previous = self._hit_local(key, window_index, weight, now)
+
+        if allowed:
+            return True, 0
+        return False, self._retry_after(current, previous, elapsed)
+
+    def _allows(self, current, previous, weight):
+        """current and previous are the requests counted before this one."""
+        return previous * weight + current < self.limit
+
+    def _hit_local(self, key, window_index, weight, now):
+        shard = self.shards[zlib.crc32(key.encode('utf-8')) % len(self.shards)]
+        with shard.lock:
+            if now - shard.last_sweep > self.window:
+                self._sweep(shard, window_index)
+                shard.last_sweep = now
+
+            entry = shard.counters.get(key)
+            if entry is None or entry[0] < window_index - 1:
+                entry = [window_index, 0, 0]
+            elif entry[0] == window_index - 1:
+                entry = [window_index, 0, entry[1]]
+            shard.counters[key] = entry
+            current, previous = entry[1], entry[2]
+            allowed = self._allows(current, previous, weight)
+            if allowed:
+                entry[1] += 1
+            return allowed, current, previous
+
+    def _sweep(self, shard, window_index):
+        """Drop keys that have not been seen for two windows; called with the shard lock held."""
+        stale = [key for key, entry in shard.counters.items() if entry[0] < window_index - 1]
+        for key in stale:
+            del shard.counters[key]
+
+    def _hit_redis(self, key, window_index, weight):
+        current_key = f"{self.prefix}:{key}:{window_index}"
+        previous_key = f"{self.prefix}:{key}:{window_index - 1}"
+        pipeline = self.redis.pipeline()
+        pipeline.incr(current_key)
+        pipeline.expire(current_key, self.window * 2)
+        pipeline.get(previous_key)
+        counted, _, previous = pipeline.execute()
+        current, previous = int(counted) - 1, int(previous or 0)
+        allowed = self._allows(current, previous, weight)
+        if not allowed:
+            # Take the rejected request back out of the count
+            self.redis.decr(current_key)
+        return allowed, current, previous
+
+    def _retry_after(self, current, previous, elapsed):
+        """
+        Seconds until previous * weight + current drops below the limit again, with the counts
+        of a rejected request: nothing more is counted while the client waits.
+        """
+        if current < self.limit:
+            # Enough of the previous window slides out in this window, or the next window starts with room
+            needed = self.window - elapsed
+            if previous > 0:
+                needed = min(needed, self.window * (1 - (self.limit - current) / previous) - elapsed)
+        else:
+            # This window's requests become the previous window's, and enough of them have to slide out
+            needed = self.window - elapsed + self.window * (1 - self.limit / current)
+        # The weighted count has to drop strictly below the limit, so round past an exact boundary
+        return max(1, math.floor(needed) + 1)
+
+
+limiter = SlidingWindowRateLimiter(
+    RATE_LIMIT_REQUESTS,
+    RATE_LIMIT_WINDOW_SECONDS,
+    shards=RATE_LIMIT_SHARDS,
+    redis_client=get_redis_client(RATE_LIMIT_REDIS_URL),
+)
+
+# A date picker asks for several months at once, so availability lookups are counted apart from chat messages
+availability_limiter = SlidingWindowRateLimiter(
+    AVAILABILITY_RATE_LIMIT_REQUESTS,
+    RATE_LIMIT_WINDOW_SECONDS,
+    shards=RATE_LIMIT_SHARDS,
+    redis_client=get_redis_client(RATE_LIMIT_REDIS_URL),
+    prefix='availability-rate-limit',
+)
+
+
+def get_client_identity():
+    """
+    Identify the caller by the email in their JWT, or by client IP for anonymous users.
+    """
+    token = None
+    auth_header = request.headers.get('Authorization')
+    if auth_header and auth_header.startswith('Bearer '):
+        token = auth_header.split(' ')[1]
+
+    user_id = get_user_id_from_token(token)
+    if user_id != "anonymous":
+        return f"user:{user_id}"
+    return f"ip:{request.remote_addr}"
+
+
+def rate_limited_by(request_limiter):
+    """
+    Decorator that answers with 429 and a Retry-After header once the caller exceeds the limiter's limit.
+    CORS preflight requests are never counted.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method == 'OPTIONS':
+                return view(*args, **kwargs)
+
+            allowed, retry_after = request_limiter.hit(get_client_identity())
+            if not allowed:
+                response = jsonify({
+                    'error': 'Too many requests. Please slow down and try again shortly.',
+                    'retry_after': retry_after
+                })
+                response.status_code = 429
+                response.headers['Retry-After'] = str(retry_after)
+                response.headers.add('Access-Control-Allow-Origin', '*')
+                response.headers.add('Access-Control-Expose-Headers', 'Retry-After')
+                return response
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Chat messages share one per-user limit across POST /appointment and the WebSocket
+rate_limited = rate_limited_by(limiter)
@@ -0,0 +1,28 @@
+"""Redis is optional: it is only needed when a shared backend URL is configured in the ENV file."""
+import threading
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_redis_client(url):
+    """
+    Return a shared Redis client for the given URL, or None if Redis is not configured or installed.
+    """
+    if not url:
+        return None
+    if redis is None:
+        print(f"Redis backend requested ({url}) but the 'redis' package is not installed. Falling back to in-process storage.")
+        return None
+
+    with _clients_lock:
+        client = _clients.get(url)
+        if client is None:
+            client = redis.Redis.from_url(url)
+            _clients[url] = client
+        return client
@@ -0,0 +1,184 @@
+"""
+Reminders are kept in a min-heap ordered by the time they are due, and a single worker thread
+sleeps until the earliest one is due, so nothing polls the calendar to find them.
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+from datetime import timedelta
+
+REMINDER_OFFSETS = [timedelta(hours=24), timedelta(hours=2)]
+REMINDER_BATCH_SIZE = int(os.environ.get('REMINDER_BATCH_SIZE', '50'))
+REMINDER_BATCH_WINDOW_SECONDS = int(os.environ.get('REMINDER_BATCH_WINDOW_SECONDS', '5'))
+REMINDER_RETRY_SECONDS = 60
+REMINDER_MAX_ATTEMPTS = 3
+REMINDER_PRUNE_SECONDS = 3600
+
+
+class LoggingReminderSender:
+    """
+    Local stand-in sender that prints the reminders and keeps them in memory, for development and tests.
+    A real sender (email, SMS) only has to provide the same send_batch method.
+    """
+
+    def __init__(self):
+        self.sent = []
+
+    def send_batch(self, reminders):
+        for reminder in reminders:
+            print(f"Reminder for {reminder['user_name']} <{reminder['user_email']}>: appointment at {reminder['start'].isoformat()} (in {reminder['hours_before']} hours)")
+        self.sent.extend(reminders)
+
+
+class ReminderScheduler:
+    """
+    Timer queue of appointment reminders.
+    Every scheduling of an event gets a new version, and cancelling drops the event; heap entries whose version
+    is not the event's current one are skipped when they come up.
+    """
+
+    def __init__(self, sender, offsets=None, batch_size=REMINDER_BATCH_SIZE, batch_window_seconds=REMINDER_BATCH_WINDOW_SECONDS):
+        self.sender = sender
+        self.offsets = offsets if offsets is not None else REMINDER_OFFSETS
+        self.batch_size = batch_size
+        self.batch_window = batch_window_seconds
+        self.condition = threading.Condition()
+        self.heap = []
+        self.events = {}
+        self.sequence = itertools.count()
+        self.last_prune = 0
+        self.thread = None
+        self.stopped = False
+
+    def schedule(self, event_id, start, user_name, user_email):
+        """
+        Queue the reminders of an appointment. Scheduling the same event and start time again is a no-op.
+        """
+        if not event_id or not user_email or start is None:
+            return
+
+        with self.condition:
+            current = self.events.get(event_id)
+            if current is not None and current[1] == start:
+                return
+            # Versions are never reused, so heap entries from before a cancel or move can not match again
+            version = next(self.sequence)
+            self.events[event_id] = (version, start)
+
+            now = time.time()
+            for offset in self.offsets:
+                due = (start - offset).timestamp()
+                if due <= now:
+                    continue
+                reminder = {
+                    'event_id': event_id,
+                    'start': start,
+                    'user_name': user_name,
+                    'user_email': user_email,
+                    'hours_before': int(offset.total_seconds() // 3600),
+                    'attempts': 0,
+                }
+                heapq.heappush(self.heap, (due, next(self.sequence), version, reminder))
+            self._compact_if_needed(now)
+            self.condition.notify()
+
+    def cancel(self, event_id):
+        """
+        Stop the pending reminders of a cancelled appointment.
+        """
+        with self.condition:
+            self.events.pop(event_id, None)
+
+    def start(self):
+        """
+        Start the worker thread.
+        """
+        if self.thread is not None:
+            return
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run, name='reminder-scheduler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop the worker thread; reminders still in the heap are not sent.
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+            self.thread = None
+
+    def _is_current(self, version, reminder):
+        current = self.events.get(reminder['event_id'])
+        return current is not None and current[0] == version
+
+    def _compact_if_needed(self, now):
+        """Forget appointments that have started and rebuild the heap when most of it is stale entries; called with the lock held."""
+        if now - self.last_prune >= REMINDER_PRUNE_SECONDS:
+            # Their reminders are all due already, and the index sync only lists upcoming events
+            for event_id in [event_id for event_id, (_, start) in self.events.items() if start.timestamp() <= now]:
+                del self.events[event_id]
+            self.last_prune = now
+
+        if len(self.heap) < 64:
+            return
+        live = [entry for entry in self.heap if self._is_current(entry[2], entry[3])]
+        if len(live) * 2 < len(self.heap):
+            heapq.heapify(live)
+            self.heap = live
+
+    def _next_batch(self):
+        """
+        Wait until reminders are due and pop them. Returns None when the scheduler is stopped.
+        """
+        with self.condition:
+            while not self.stopped:
+                while self.heap and not self._is_current(self.heap[0][2], self.heap[0][3]):
+                    heapq.heappop(self.heap)
+
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+
+                wait_seconds = self.heap[0][0] - time.time()
+                if wait_seconds > 0:
+                    self.condition.wait(wait_seconds)
+                    continue
+
+                # Send everything that is due now or within the batch window together
+                batch = []
+                cutoff = time.time() + self.batch_window
+                while self.heap and self.heap[0][0] <= cutoff and len(batch) < self.batch_size:
+                    _, _, version, reminder = heapq.heappop(self.heap)
+                    if self._is_current(version, reminder):
+                        batch.append((version, reminder))
+                if batch:
+                    return batch
+            return None
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                self.sender.send_batch([reminder for _, reminder in batch])
+            except Exception as e:
+                print(f"Error sending appointment reminders: {e}")
+                self._retry(batch)
+
+    def _retry(self, batch):
+        with self.condition:
+            due = time.time() + REMINDER_RETRY_SECONDS
+            for version, reminder in batch:
+                reminder['attempts'] += 1
+                if reminder['attempts'] < REMINDER_MAX_ATTEMPTS:
+                    heapq.heappush(self.heap, (due, next(self.sequence), version, reminder))
+            self.condition.notify()
+
+
+reminder_scheduler = ReminderScheduler(LoggingReminderSender())
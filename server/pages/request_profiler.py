@@ -0,0 +1,197 @@
+"""
+Opt-in profiling of single requests. A request is profiled when it carries a doctor's token in the
+X-Profile-Token header, or at random with probability PROFILE_SAMPLE_RATE. Only the last PROFILE_BUFFER_SIZE
+profiles are kept, in PROFILE_DIR.
+"""
+import cProfile
+import io
+import json
+import marshal
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from functools import wraps
+import jwt
+from flask import request, make_response
+from pages.rate_limiter import get_client_identity
+
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_BUFFER_SIZE = int(os.environ.get('PROFILE_BUFFER_SIZE', '20'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_HEADER = 'X-Profile-Token'
+PROFILE_SUMMARY_LINES = 40
+
+PROFILE_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+secret_key = os.environ.get('SECRET_KEY')
+
+
+class ProfileStore:
+    """
+    Captured profiles, kept as files in a directory that every worker process shares, so a profile
+    captured by one worker can be listed and downloaded through any other. Only the newest `size` are kept.
+    Each profile is a <id>.json file with its metadata and text summary, and a <id>.prof file with the pstats data.
+    """
+
+    def __init__(self, directory, size):
+        self.directory = directory
+        self.size = size
+
+    def _path(self, profile_id, extension):
+        return os.path.join(self.directory, f"{profile_id}.{extension}")
+
+    def _write(self, path, data):
+        # Readers in other processes only ever see complete files
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, 'wb') as f:
+            f.write(data)
+        os.replace(temporary_path, path)
+
+    def add(self, profile):
+        # Ids sort by capture time, and the random half keeps ids of different processes apart
+        profile_id = f"{time.time_ns():016x}{uuid.uuid4().hex[:16]}"
+        os.makedirs(self.directory, exist_ok=True)
+        stats = profile.pop('stats')
+        profile['id'] = profile_id
+        # The stats file is written first, so a listed profile can always be downloaded
+        self._write(self._path(profile_id, 'prof'), stats)
+        self._write(self._path(profile_id, 'json'), json.dumps(profile).encode('utf-8'))
+        self._prune()
+        return profile_id
+
+    def _load(self, profile_id):
+        try:
+            with open(self._path(profile_id, 'json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            # Pruned by another worker in the meantime
+            return None
+
+    def _profile_ids(self):
+        """
+        Ids of the stored profiles, newest first.
+        """
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        profile_ids = []
+        for name in names:
+            profile_id, extension = os.path.splitext(name)
+            if extension == '.json' and PROFILE_ID_PATTERN.fullmatch(profile_id):
+                profile_ids.append(profile_id)
+        return sorted(profile_ids, reverse=True)
+
+    def _prune(self):
+        for profile_id in self._profile_ids()[self.size:]:
+            for extension in ('json', 'prof'):
+                try:
+                    os.remove(self._path(profile_id, extension))
+                except FileNotFoundError:
+                    pass
+
+    def list(self):
+        """
+        Return the metadata of the stored profiles, newest first.
+        """
+        profiles = []
+        for profile_id in self._profile_ids()[:self.size]:
+            profile = self._load(profile_id)
+            if profile is not None:
+                profile.pop('summary', None)
+                profiles.append(profile)
+        return profiles
+
+    def get(self, profile_id):
+        """
+        Return the profile with its metadata, summary and pstats data, or None if it is unknown or was pruned.
+        """
+        if not PROFILE_ID_PATTERN.fullmatch(profile_id):
+            return None
+        profile = self._load(profile_id)
+        if profile is None:
+            return None
+        try:
+            with open(self._path(profile_id, 'prof'), 'rb') as f:
+                profile['stats'] = f.read()
+        except OSError:
+            return None
+        return profile
+
+
+profile_store = ProfileStore(PROFILE_DIR, PROFILE_BUFFER_SIZE)
+
+# cProfile can only profile one request at a time, so concurrent requests are skipped rather than queued
+_profiler_lock = threading.Lock()
+
+
+def _profile_trigger():
+    """
+    Decide if the current request should be profiled. Returns 'header', 'sample' or None.
+    """
+    profile_token = request.headers.get(PROFILE_HEADER)
+    if profile_token:
+        try:
+            payload = jwt.decode(profile_token, secret_key, algorithms=["HS256"])
+            if payload.get('role') == 'doctor':
+                return 'header'
+        except jwt.InvalidTokenError:
+            pass
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return 'sample'
+    return None
+
+
+def _summarize(profiler):
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats('cumulative').print_stats(PROFILE_SUMMARY_LINES)
+    return stream.getvalue()
+
+
+def profiled(view):
+    """
+    Decorator that captures a cProfile profile of the request when profiling was requested or sampled.
+    The profile id is returned in the X-Profile-Id response header.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method == 'OPTIONS':
+            return view(*args, **kwargs)
+
+        trigger = _profile_trigger()
+        if trigger is None or not _profiler_lock.acquire(blocking=False):
+            return view(*args, **kwargs)
+
+        try:
+            profiler = cProfile.Profile()
+            started = time.perf_counter()
+            profiler.enable()
+            try:
+                response = make_response(view(*args, **kwargs))
+            finally:
+                profiler.disable()
+            duration_ms = (time.perf_counter() - started) * 1000
+
+            profiler.create_stats()
+            profile_id = profile_store.add({
+                'path': request.path,
+                'method': request.method,
+                'trigger': trigger,
+                'client': get_client_identity(),
+                'captured_at': datetime.now(timezone.utc).isoformat(),
+                'duration_ms': round(duration_ms, 2),
+                'stats': marshal.dumps(profiler.stats),
+                'summary': _summarize(profiler),
+            })
+        finally:
+            _profiler_lock.release()
+
+        response.headers['X-Profile-Id'] = str(profile_id)
+        return response
+    return wrapper
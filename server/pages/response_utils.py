@@ -0,0 +1,88 @@
+import gzip
+import json
+from flask import Response, request
+
+# orjson and brotli are optional: without them the standard json module and gzip are used.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_MIN_BYTES = 1024
+
+
+def dumps_json(payload):
+    """
+    Serialize the payload to UTF-8 JSON bytes, using orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def parse_fields(fields_param, allowed_fields):
+    """
+    Parse a comma separated ?fields= value.
+    Returns (fields, error). fields is None when the parameter was not given.
+    """
+    if not fields_param:
+        return None, None
+
+    fields = [field.strip() for field in fields_param.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in allowed_fields]
+    if unknown:
+        return None, f"Unknown fields: {', '.join(unknown)}. Allowed fields: {', '.join(allowed_fields)}"
+    return fields, None
+
+
+def select_fields(items, fields):
+    """
+    Keep only the requested fields of every item.
+    """
+    if fields is None:
+        return items
+    return [{field: item.get(field) for field in fields} for item in items]
+
+
+def _choose_encoding():
+    accepted = set()
+    for part in request.headers.get('Accept-Encoding', '').split(','):
+        coding, _, params = part.partition(';')
+        quality = 1.0
+        params = params.strip().lower()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if coding.strip() and quality > 0:
+            accepted.add(coding.strip().lower())
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def json_response(payload, status=200):
+    """
+    Build a JSON response, compressed with brotli or gzip when the client accepts it and the body is large.
+    """
+    body = dumps_json(payload)
+    headers = {'Vary': 'Accept-Encoding'}
+
+    if len(body) >= COMPRESSION_MIN_BYTES:
+        encoding = _choose_encoding()
+        if encoding == 'br':
+            body = brotli.compress(body, quality=5)
+            headers['Content-Encoding'] = 'br'
+        elif encoding == 'gzip':
+            body = gzip.compress(body, compresslevel=6)
+            headers['Content-Encoding'] = 'gzip'
+
+    return Response(body, status=status, headers=headers, mimetype='application/json')
@@ -0,0 +1,461 @@
+"""
+Patients whose slot was taken can join a waitlist with the weekdays, time window and appointment length they want.
+Entries are indexed by (weekday, half-hour bucket) of the start times they accept, so a slot that opens up only
+looks at the patients who could take it, in the order they joined. The waitlist is kept in process memory,
+or in Redis when WAITLIST_REDIS_URL is set so that every worker sees the same entries and offers. In Redis every
+entry, bucket and offer is its own key, so a patient's offer is one lookup and matching reads only one bucket.
+"""
+import heapq
+import itertools
+import json
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from pages.clinic_time import clinic_tz, clinic_today, clinic_datetime
+from pages.redis_client import get_redis_client
+
+WAITLIST_OFFER_MINUTES = int(os.environ.get('WAITLIST_OFFER_MINUTES', '30'))
+WAITLIST_ENTRY_DAYS = int(os.environ.get('WAITLIST_ENTRY_DAYS', '30'))
+WAITLIST_REDIS_URL = os.environ.get('WAITLIST_REDIS_URL', '')
+WAITLIST_LOCK_SECONDS = 10
+BUCKET_MINUTES = 30
+
+
+class LoggingOfferSender:
+    """
+    Local stand-in that prints waitlist offers and keeps them in memory, for development and tests.
+    A real sender (email, SMS) only has to provide the same send method.
+    """
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, offer):
+        print(f"Waitlist offer for {offer['user_name']} <{offer['user_email']}>: {offer['start'].isoformat()} ({offer['duration_minutes']} minutes), expires {offer['expires_at'].isoformat()}")
+        self.sent.append(offer)
+
+
+class InProcessWaitlistStore:
+    """
+    Waitlist state in process memory, for a single worker.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.sequence = itertools.count(1)
+        self.entries = {}
+        self.by_email = {}
+        self.buckets = {}
+        self.offers = {}
+        self.expiry_heap = []
+        self.passed = {}
+        self.released = {}
+
+    def locked(self):
+        return self.lock
+
+    def next_id(self):
+        with self.lock:
+            return next(self.sequence)
+
+    def add_entry(self, entry, bucket_keys, expires_at):
+        with self.lock:
+            self._remove(entry['user_email'])
+            self.entries[entry['id']] = entry
+            self.by_email[entry['user_email']] = entry['id']
+            # Entry ids grow with every join, so appending keeps each bucket in first-come order
+            for key in bucket_keys:
+                self.buckets.setdefault(key, []).append(entry['id'])
+
+    def remove_entry(self, email):
+        with self.lock:
+            return self._remove(email)
+
+    def _remove(self, email):
+        # Bucket lists drop removed ids lazily when they are read
+        self.offers.pop(email, None)
+        entry_id = self.by_email.pop(email, None)
+        if entry_id is None:
+            return False
+        del self.entries[entry_id]
+        return True
+
+    def bucket_entries(self, key, today):
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if not bucket:
+                return []
+            for entry_id in bucket:
+                entry = self.entries.get(entry_id)
+                if entry is not None and entry['last_day'] < today.isoformat():
+                    self._remove(entry['user_email'])
+            live = [entry_id for entry_id in bucket if entry_id in self.entries]
+            if len(live) < len(bucket):
+                self.buckets[key] = live
+            return [self.entries[entry_id] for entry_id in live]
+
+    def get_offer(self, email):
+        with self.lock:
+            return self.offers.get(email)
+
+    def put_offer(self, offer):
+        with self.lock:
+            self.offers[offer['user_email']] = offer
+            heapq.heappush(self.expiry_heap, (offer['expires_at'], offer['id'], offer['user_email']))
+
+    def pop_offer(self, email):
+        with self.lock:
+            return self.offers.pop(email, None)
+
+    def mark_announced(self, email):
+        with self.lock:
+            offer = self.offers.get(email)
+            if offer is None or offer['announced']:
+                return False
+            offer['announced'] = True
+            return True
+
+    def pop_expired_offers(self, now):
+        with self.lock:
+            expired = []
+            while self.expiry_heap and self.expiry_heap[0][0] <= now:
+                _, offer_id, email = heapq.heappop(self.expiry_heap)
+                offer = self.offers.get(email)
+                if offer is not None and offer['id'] == offer_id:
+                    del self.offers[email]
+                    expired.append(offer)
+            return expired
+
+    def passed_entries(self, slot_id):
+        with self.lock:
+            return self.passed.get(slot_id, (None, set()))[1]
+
+    def add_passed(self, slot_id, entry_id, until):
+        with self.lock:
+            self.passed.setdefault(slot_id, (until, set()))[1].add(entry_id)
+
+    def release(self, key, until, now):
+        with self.lock:
+            # Slots that have started can not be offered again, so what is kept about them can go
+            for old_key in [old_key for old_key, (old_until, _) in self.passed.items() if old_until <= now]:
+                del self.passed[old_key]
+            for old_key in [old_key for old_key, old_until in self.released.items() if old_until <= now]:
+                del self.released[old_key]
+            if key in self.released:
+                return False
+            self.released[key] = until
+            return True
+
+
+class RedisWaitlistStore:
+    """
+    Waitlist state in Redis, shared by every worker.
+    Joining, leaving and reading an offer are single atomic steps; moving a slot between patients holds a Redis lock.
+    """
+
+    def __init__(self, redis_client, prefix='waitlist'):
+        self.redis = redis_client
+        self.prefix = prefix
+
+    def _key(self, *parts):
+        return ":".join([self.prefix, *(str(part) for part in parts)])
+
+    def locked(self):
+        return self.redis.lock(self._key('lock'), timeout=WAITLIST_LOCK_SECONDS, blocking_timeout=WAITLIST_LOCK_SECONDS)
+
+    def next_id(self):
+        return self.redis.incr(self._key('sequence'))
+
+    def add_entry(self, entry, bucket_keys, expires_at):
+        email = entry['user_email']
+        previous = self.redis.set(self._key('email', email), entry['id'], get=True)
+        pipe = self.redis.pipeline()
+        if previous is not None:
+            pipe.delete(self._key('entry', int(previous)))
+        pipe.delete(self._key('offer', email))
+        pipe.set(self._key('entry', entry['id']), json.dumps(entry))
+        # Entries end with their last day; bucket sets drop their ids lazily when they are read
+        pipe.expireat(self._key('email', email), expires_at)
+        pipe.expireat(self._key('entry', entry['id']), expires_at)
+        # Scored by entry id, so each bucket reads back in first-come order
+        for weekday, bucket in bucket_keys:
+            pipe.zadd(self._key('bucket', weekday, bucket), {entry['id']: entry['id']})
+        pipe.execute()
+
+    def remove_entry(self, email):
+        pipe = self.redis.pipeline()
+        pipe.get(self._key('email', email))
+        pipe.delete(self._key('email', email), self._key('offer', email))
+        entry_id, _ = pipe.execute()
+        if entry_id is None:
+            return False
+        self.redis.delete(self._key('entry', int(entry_id)))
+        return True
+
+    def bucket_entries(self, key, today):
+        bucket_key = self._key('bucket', *key)
+        entry_ids = self.redis.zrange(bucket_key, 0, -1)
+        if not entry_ids:
+            return []
+        stored = self.redis.mget([self._key('entry', int(entry_id)) for entry_id in entry_ids])
+        removed = [entry_id for entry_id, entry in zip(entry_ids, stored) if entry is None]
+        if removed:
+            self.redis.zrem(bucket_key, *removed)
+        return [json.loads(entry) for entry in stored if entry is not None]
+
+    def get_offer(self, email):
+        stored = self.redis.hgetall(self._key('offer', email))
+        return self._decode_offer(stored)
+
+    @staticmethod
+    def _decode_offer(stored):
+        if b'offer' not in stored:
+            return None
+        offer = json.loads(stored[b'offer'])
+        offer['start'] = datetime.fromisoformat(offer['start'])
+        offer['expires_at'] = datetime.fromisoformat(offer['expires_at'])
+        offer['announced'] = b'announced' in stored
+        return offer
+
+    def put_offer(self, offer):
+        key = self._key('offer', offer['user_email'])
+        stored = dict(offer, start=offer['start'].isoformat(), expires_at=offer['expires_at'].isoformat())
+        del stored['announced']
+        pipe = self.redis.pipeline()
+        pipe.delete(key)
+        pipe.hset(key, 'offer', json.dumps(stored))
+        # The offer is of no use once the slot has started
+        pipe.expireat(key, offer['start'])
+        pipe.zadd(self._key('expiry'), {f"{offer['id']}:{offer['user_email']}": offer['expires_at'].timestamp()})
+        pipe.execute()
+
+    def pop_offer(self, email):
+        pipe = self.redis.pipeline()
+        pipe.hgetall(self._key('offer', email))
+        pipe.delete(self._key('offer', email))
+        stored, _ = pipe.execute()
+        return self._decode_offer(stored)
+
+    def mark_announced(self, email):
+        key = self._key('offer', email)
+        if not self.redis.hexists(key, 'offer'):
+            return False
+        return bool(self.redis.hsetnx(key, 'announced', 1))
+
+    def pop_expired_offers(self, now):
+        """Called with the lock held."""
+        expiry_key = self._key('expiry')
+        members = self.redis.zrangebyscore(expiry_key, '-inf', now.timestamp())
+        if not members:
+            return []
+        self.redis.zrem(expiry_key, *members)
+        expired = []
+        for member in members:
+            offer_id, email = member.decode('utf-8').split(':', 1)
+            offer = self.get_offer(email)
+            if offer is not None and offer['id'] == int(offer_id):
+                self.redis.delete(self._key('offer', email))
+                expired.append(offer)
+        return expired
+
+    def passed_entries(self, slot_id):
+        return {int(entry_id) for entry_id in self.redis.smembers(self._key('passed', slot_id))}
+
+    def add_passed(self, slot_id, entry_id, until):
+        pipe = self.redis.pipeline()
+        pipe.sadd(self._key('passed', slot_id), entry_id)
+        pipe.expireat(self._key('passed', slot_id), until)
+        pipe.execute()
+
+    def release(self, key, until, now):
+        seconds = max(1, int((until - now).total_seconds()))
+        return bool(self.redis.set(self._key('released', key), 1, nx=True, ex=seconds))
+
+
+class Waitlist:
+    """
+    Waitlist entries with a bucket index for matching, and the slot offers made to them.
+    A patient has at most one entry and one open offer; joining again replaces the entry.
+    """
+
+    def __init__(self, sender, offer_minutes=WAITLIST_OFFER_MINUTES, redis_client=None, prefix='waitlist'):
+        self.sender = sender
+        self.offer_time = timedelta(minutes=offer_minutes)
+        self.tz = clinic_tz
+        if redis_client is not None:
+            self.store = RedisWaitlistStore(redis_client, prefix)
+        else:
+            self.store = InProcessWaitlistStore()
+
+    def join(self, user_email, user_name, weekdays, window_start, window_end, duration_minutes=30, granularity=30, first_day=None, last_day=None, now=None):
+        """
+        Add the patient to the waitlist. weekdays are Python weekday numbers and the window is given
+        in minutes after midnight, clinic time. The entry covers first_day to last_day, by default
+        WAITLIST_ENTRY_DAYS from today. Returns the entry.
+        """
+        first_day = first_day or clinic_today(now and now.astimezone(self.tz))
+        last_day = last_day or first_day + timedelta(days=WAITLIST_ENTRY_DAYS)
+        entry = {
+            'id': self.store.next_id(),
+            'user_email': user_email.lower(),
+            'user_name': user_name,
+            'weekdays': sorted(set(weekdays)),
+            'window_start': window_start,
+            'window_end': window_end,
+            'duration_minutes': duration_minutes,
+            'granularity': granularity,
+            'first_day': first_day.isoformat(),
+            'last_day': last_day.isoformat(),
+        }
+        last_start = window_end - duration_minutes
+        bucket_keys = [
+            (weekday, bucket)
+            for weekday in entry['weekdays']
+            for bucket in range(window_start // BUCKET_MINUTES, last_start // BUCKET_MINUTES + 1)
+        ]
+        self.store.add_entry(entry, bucket_keys, clinic_datetime(last_day + timedelta(days=1)))
+        return entry
+
+    def leave(self, user_email):
+        """
+        Remove the patient and any open offer. Returns True if the patient was on the waitlist.
+        """
+        return self.store.remove_entry(user_email.lower())
+
+    def slot_opened(self, start, duration_minutes, now=None, event_id=None):
+        """
+        Offer a freed slot to the first patient who joined and can take it.
+        If that patient needs less time, the rest of the slot is offered on.
+        event_id names the calendar event that held the slot; a slot is offered only once per event and start.
+        """
+        now = now or datetime.now(timezone.utc)
+        if start <= now:
+            return
+        if event_id is not None and not self.store.release(f"{event_id}:{start.astimezone(timezone.utc).isoformat()}", start, now):
+            return
+        with self.store.locked():
+            offers = self._expire_locked(now)
+            offers.extend(self._offer_locked({'id': self.store.next_id(), 'start': start, 'duration_minutes': duration_minutes}, now))
+        self._send(offers)
+
+    def _offer_locked(self, slot, now):
+        offers = []
+        while slot['duration_minutes'] > 0:
+            entry = self._match_locked(slot, now)
+            if entry is None:
+                break
+            offer = {
+                'id': self.store.next_id(),
+                'entry_id': entry['id'],
+                'user_email': entry['user_email'],
+                'user_name': entry['user_name'],
+                'start': slot['start'],
+                'duration_minutes': entry['duration_minutes'],
+                'expires_at': now + self.offer_time,
+                'slot_id': slot['id'],
+                'announced': False,
+            }
+            self.store.put_offer(offer)
+            offers.append(offer)
+            slot = {
+                'id': slot['id'],
+                'start': slot['start'] + timedelta(minutes=entry['duration_minutes']),
+                'duration_minutes': slot['duration_minutes'] - entry['duration_minutes'],
+            }
+        return offers
+
+    def _match_locked(self, slot, now):
+        local_start = slot['start'].astimezone(self.tz)
+        minute = local_start.hour * 60 + local_start.minute
+        candidates = self.store.bucket_entries((local_start.weekday(), minute // BUCKET_MINUTES), now.astimezone(self.tz).date())
+        if not candidates:
+            return None
+
+        slot_day = local_start.date().isoformat()
+        passed = self.store.passed_entries(slot['id'])
+        for entry in candidates:
+            if entry['id'] in passed or not entry['first_day'] <= slot_day <= entry['last_day']:
+                continue
+            if entry['duration_minutes'] > slot['duration_minutes'] or minute % entry['granularity']:
+                continue
+            if not (entry['window_start'] <= minute and minute + entry['duration_minutes'] <= entry['window_end']):
+                continue
+            if self.store.get_offer(entry['user_email']) is None:
+                return entry
+        return None
+
+    def _pass_on_locked(self, offer, now):
+        """Offer the slot the patient turned down or let expire to the next patient in line."""
+        if offer['start'] <= now:
+            return []
+        self.store.add_passed(offer['slot_id'], offer['entry_id'], offer['start'])
+        return self._offer_locked({'id': offer['slot_id'], 'start': offer['start'], 'duration_minutes': offer['duration_minutes']}, now)
+
+    def _expire_locked(self, now):
+        """Drop offers that ran out and pass their slots on to the next patient in line."""
+        offers = []
+        for offer in self.store.pop_expired_offers(now):
+            offers.extend(self._pass_on_locked(offer, now))
+        return offers
+
+    def expire_offers(self, now=None):
+        """
+        Expire old offers; called from the periodic index sync so slots move on without chat traffic.
+        """
+        now = now or datetime.now(timezone.utc)
+        with self.store.locked():
+            offers = self._expire_locked(now)
+        self._send(offers)
+
+    def offer_for(self, user_email, now=None):
+        """
+        Return the patient's open offer, or None.
+        """
+        now = now or datetime.now(timezone.utc)
+        email = user_email.lower()
+        offer = self.store.get_offer(email)
+        if offer is None or offer['expires_at'] > now:
+            return offer
+        self.expire_offers(now)
+        return self.store.get_offer(email)
+
+    def mark_announced(self, user_email):
+        """
+        Record that the patient was told about their open offer in the chat.
+        Returns True only for the first call, so the offer is announced once even if two workers answer at the same time.
+        """
+        return self.store.mark_announced(user_email.lower())
+
+    def take_offer(self, user_email, now=None):
+        """
+        Close the patient's open offer so it can be booked. Returns the offer, or None if there is none.
+        """
+        now = now or datetime.now(timezone.utc)
+        with self.store.locked():
+            offers = self._expire_locked(now)
+            offer = self.store.pop_offer(user_email.lower())
+        self._send(offers)
+        return offer
+
+    def decline(self, user_email, now=None):
+        """
+        Turn down the open offer; the slot goes to the next patient in line and the patient stays on the waitlist.
+        """
+        now = now or datetime.now(timezone.utc)
+        with self.store.locked():
+            offer = self.store.pop_offer(user_email.lower())
+            if offer is None:
+                return None
+            offers = self._pass_on_locked(offer, now)
+        self._send(offers)
+        return offer
+
+    def _send(self, offers):
+        for offer in offers:
+            try:
+                self.sender.send(offer)
+            except Exception as e:
+                print(f"Error sending waitlist offer: {e}")
+
+
+waitlist = Waitlist(LoggingOfferSender(), redis_client=get_redis_client(WAITLIST_REDIS_URL))
@@ -0,0 +1,163 @@
+"""
+Production entry point: a pre-forking gunicorn server.
+
+The app is imported once in the master before forking (loading the ENV file, building the Google Calendar
+client and compiling the chat patterns), so every worker starts warm and shares those pages copy-on-write.
+
+Run with:  python serve.py
+Graceful restart (workers finish their in-flight messages first):  kill -HUP <master pid>
+"""
+import multiprocessing
+import os
+import threading
+from dotenv import load_dotenv
+from gunicorn.app.base import BaseApplication
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+load_dotenv()
+
+# Sessions, stored replies, rate limit counters and the waitlist stay in process memory unless each has a Redis URL,
+# so more than one worker is only run when all of them are shared
+SHARED_STORE_SETTINGS = ['SESSION_REDIS_URL', 'IDEMPOTENCY_REDIS_URL', 'RATE_LIMIT_REDIS_URL', 'WAITLIST_REDIS_URL']
+MISSING_SHARED_STORES = [name for name in SHARED_STORE_SETTINGS if not os.environ.get(name)]
+
+WEB_BIND = os.environ.get('WEB_BIND', '0.0.0.0:5000')
+WEB_WORKERS = int(os.environ.get('WEB_WORKERS', '1' if MISSING_SHARED_STORES else str(multiprocessing.cpu_count())))
+WEB_THREADS = int(os.environ.get('WEB_THREADS', '16'))
+WEB_GRACEFUL_TIMEOUT = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', '30'))
+WEB_TIMEOUT = int(os.environ.get('WEB_TIMEOUT', '60'))
+WEB_MAX_REQUESTS = int(os.environ.get('WEB_MAX_REQUESTS', '0'))
+BACKGROUND_LOCK_PATH = os.environ.get('BACKGROUND_LOCK_PATH', 'background.lock')
+BACKGROUND_LOCK_RETRY_SECONDS = 10
+
+# Chat sockets may take at most half of a worker's threads, so plain HTTP requests always find a free one.
+# Set before the app is imported, which reads it
+os.environ.setdefault('WS_MAX_CONNECTIONS', str(max(1, WEB_THREADS // 2)))
+
+
+def check_shared_stores():
+    """
+    Refuse to run several workers on per-process state: conversations would break whenever their turns land
+    on different workers, and retries would miss their stored replies.
+    """
+    if WEB_WORKERS <= 1:
+        return
+    if MISSING_SHARED_STORES:
+        raise SystemExit(f"WEB_WORKERS={WEB_WORKERS} needs state shared between workers. Set {', '.join(MISSING_SHARED_STORES)}, or run a single worker.")
+    from pages.redis_client import redis
+    if redis is None:
+        raise SystemExit(f"WEB_WORKERS={WEB_WORKERS} needs the 'redis' package for the shared stores. Install it, or run a single worker.")
+
+
+def warm_up():
+    """
+    One-time setup done in the master before forking.
+    """
+    from app import app
+    from pages.appointment_processor import parse_appointment_request, check_greeting_or_thanks
+    from pages.calendar_utils import service
+
+    if service is None:
+        print("Warning: Google Calendar service is not available; bookings will wait in the journal.")
+
+    # Exercise the parsing path once so the first patient message does not pay for lazy initialisation
+    check_greeting_or_thanks("hello")
+    parse_appointment_request("next monday at 10:30")
+    return app
+
+
+def _start_when_leader(index_reload):
+    """
+    Start the calendar index sync and the reminder scheduler in exactly one worker: the one holding the background lock.
+    """
+    from pages.calendar_utils import start_appointment_index_sync
+    from pages.reminder_scheduler import reminder_scheduler
+
+    def lead():
+        # The leader lists the calendar itself, so it stops loading the snapshot it is about to write
+        index_reload.set()
+        start_appointment_index_sync()
+        reminder_scheduler.start()
+
+    if fcntl is None:
+        lead()
+        return
+
+    def run():
+        lock_file = open(BACKGROUND_LOCK_PATH, 'a')
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except OSError:
+                threading.Event().wait(BACKGROUND_LOCK_RETRY_SECONDS)
+        # Keep the file open for the life of the worker so the lock stays held
+        _start_when_leader.lock_file = lock_file
+        lead()
+
+    threading.Thread(target=run, name='background-leader', daemon=True).start()
+
+
+def post_fork(server, worker):
+    """
+    Threads do not survive fork, so background work starts in each worker.
+    """
+    from pages.calendar_utils import start_appointment_index_reload
+    from pages.booking_journal import booking_journal
+
+    # Only the leader lists the calendar; every other worker loads the index snapshot it saves.
+    # The journal worker elects a single replayer by itself
+    index_reload = start_appointment_index_reload()
+    booking_journal.start_worker()
+    _start_when_leader(index_reload)
+
+
+def worker_exit(server, worker):
+    """
+    Stop background work cleanly; journaled bookings are picked up by the next worker.
+    """
+    from pages.booking_journal import booking_journal
+    from pages.reminder_scheduler import reminder_scheduler
+
+    booking_journal.stop_worker()
+    reminder_scheduler.stop()
+
+
+class ClinicServer(BaseApplication):
+    """
+    Gunicorn application that serves the preloaded Flask app.
+    """
+
+    def __init__(self, application, options):
+        self.application = application
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+
+if __name__ == '__main__':
+    check_shared_stores()
+    options = {
+        'bind': WEB_BIND,
+        'workers': WEB_WORKERS,
+        'threads': WEB_THREADS,
+        'worker_class': 'gthread',
+        'preload_app': True,
+        'graceful_timeout': WEB_GRACEFUL_TIMEOUT,
+        'timeout': WEB_TIMEOUT,
+        'max_requests': WEB_MAX_REQUESTS,
+        'max_requests_jitter': WEB_MAX_REQUESTS // 10,
+        'post_fork': post_fork,
+        'worker_exit': worker_exit,
+    }
+    ClinicServer(warm_up(), options).run()
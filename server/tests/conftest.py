@@ -0,0 +1,47 @@
+import os
+import tempfile
+import pytest
+
+# Set before the server modules are imported; they read their configuration at import time
+os.environ.setdefault('SECRET_KEY', 'test-secret-key-for-the-chat-server-tests')
+os.environ.setdefault('CLINIC_TIMEZONE', 'Asia/Jerusalem')
+os.environ.setdefault('BOOKING_JOURNAL_PATH', os.path.join(tempfile.mkdtemp(), 'booking_journal.log'))
+
+from pages import calendar_utils
+from pages.fake_calendar import FakeCalendarService
+
+
+@pytest.fixture
+def calendar(monkeypatch):
+    """
+    In-memory fake of the clinic calendar in place of the Google Calendar service.
+    """
+    fake = FakeCalendarService()
+    monkeypatch.setattr(calendar_utils, 'service', fake)
+    monkeypatch.setattr(calendar_utils, 'CALENDAR_ID', 'clinic@example.com')
+    return fake
+
+
+@pytest.fixture
+def clinic(monkeypatch, tmp_path, calendar):
+    """
+    Fresh appointment index, booking journal, waitlist and sessions for a chat test, on the fake calendar.
+    """
+    from types import SimpleNamespace
+    from pages import appointment_processor
+    from pages.appointment_index import AppointmentIndex
+    from pages.booking_journal import BookingJournal, LoggingFailureSender
+    from pages.waitlist import Waitlist, LoggingOfferSender
+
+    state = SimpleNamespace(
+        calendar=calendar,
+        index=AppointmentIndex(),
+        journal=BookingJournal(str(tmp_path / 'booking_journal.log'), LoggingFailureSender()),
+        waitlist=Waitlist(LoggingOfferSender()),
+    )
+    for module in (appointment_processor, calendar_utils):
+        monkeypatch.setattr(module, 'appointment_index', state.index)
+        monkeypatch.setattr(module, 'waitlist', state.waitlist)
+    monkeypatch.setattr(appointment_processor, 'booking_journal', state.journal)
+    monkeypatch.setattr(appointment_processor, 'user_sessions', {})
+    return state
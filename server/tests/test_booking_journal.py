@@ -0,0 +1,138 @@
+from datetime import date, timedelta
+import pytest
+from pages import calendar_utils
+from pages.booking_journal import BookingJournal, LoggingFailureSender
+from pages.calendar_utils import create_appointment_event, weekly_recurrence
+from pages.clinic_time import clinic_datetime
+
+# A Monday far enough ahead that every slot is in the future
+MONDAY = date(2030, 1, 7)
+
+
+@pytest.fixture
+def sender():
+    return LoggingFailureSender()
+
+
+@pytest.fixture
+def journal(tmp_path, sender):
+    return BookingJournal(str(tmp_path / 'booking_journal.log'), sender)
+
+
+def test_reserve_holds_slot_until_replayed(journal):
+    start = clinic_datetime(MONDAY, 10)
+    assert journal.reserve(start, 'Dana', 'dana@example.com', 30)
+    assert journal.reserve(start + timedelta(minutes=15), 'Noa', 'noa@example.com', 30) is None
+    assert journal.pending_intervals() == [(start, start + timedelta(minutes=30))]
+
+
+def test_pending_booking_survives_restart(journal, sender):
+    start = clinic_datetime(MONDAY, 10)
+    booking = journal.reserve(start, 'Dana', 'dana@example.com', 30)
+
+    restarted = BookingJournal(journal.path, sender)
+    assert restarted._read_pending() == [booking]
+
+
+def test_replay_writes_booking_to_calendar(calendar, journal):
+    start = clinic_datetime(MONDAY, 10)
+    booking = journal.reserve(start, 'Dana', 'dana@example.com', 30)
+
+    assert journal._replay(booking)
+
+    events = calendar.instances()
+    assert len(events) == 1
+    assert events[0]['extendedProperties']['private']['booking_id'] == booking['id']
+    assert journal.pending_intervals() == []
+
+
+def test_replay_waits_while_calendar_is_down(monkeypatch, journal):
+    monkeypatch.setattr(calendar_utils, 'service', None)
+    booking = journal.reserve(clinic_datetime(MONDAY, 10), 'Dana', 'dana@example.com', 30)
+
+    assert not journal._replay(booking)
+    assert len(journal.pending_intervals()) == 1
+
+
+def test_replay_reconciles_event_created_before_crash(calendar, journal):
+    start = clinic_datetime(MONDAY, 10)
+    booking = journal.reserve(start, 'Dana', 'dana@example.com', 30)
+    # The event was written, but the process died before the journal recorded it
+    create_appointment_event(start, 'Dana', 'dana@example.com', 30, booking_id=booking['id'])
+
+    assert journal._replay(booking)
+
+    assert len(calendar.instances()) == 1
+    assert journal.pending_intervals() == []
+
+
+def test_replay_fails_booking_when_slot_was_taken(calendar, journal, sender):
+    start = clinic_datetime(MONDAY, 10)
+    booking = journal.reserve(start, 'Dana', 'dana@example.com', 30)
+    create_appointment_event(start + timedelta(minutes=15), 'Walk-in', None, 30)
+
+    assert journal._replay(booking)
+
+    assert len(calendar.instances()) == 1
+    assert journal.pending_intervals() == []
+    assert [failure['id'] for failure in sender.sent] == [booking['id']]
+    assert sender.sent[0]['reason'] == 'slot taken'
+    failed = journal.failed_bookings()
+    assert [failure['id'] for failure in failed] == [booking['id']]
+    assert failed[0]['user_email'] == 'dana@example.com'
+
+
+def test_replay_skips_taken_occurrences_of_series(calendar, journal, sender):
+    occurrences = [clinic_datetime(MONDAY + timedelta(weeks=week), 10) for week in range(3)]
+    booking = journal.reserve(occurrences[0], 'Dana', 'dana@example.com', 30, recurrence=weekly_recurrence(3), occurrences=occurrences)
+    create_appointment_event(occurrences[1], 'Walk-in', None, 30)
+
+    assert journal._replay(booking)
+
+    series = [event for event in calendar.instances() if event.get('recurringEventId')]
+    assert [event['start']['dateTime'] for event in series] == [occurrences[0].isoformat(), occurrences[2].isoformat()]
+    assert sender.sent == []
+
+
+def test_failed_bookings_newest_first(calendar, journal):
+    first = journal.reserve(clinic_datetime(MONDAY, 10), 'Dana', 'dana@example.com', 30)
+    second = journal.reserve(clinic_datetime(MONDAY, 11), 'Noa', 'noa@example.com', 30)
+    journal._fail(first, 'calendar unavailable')
+    journal._fail(second, 'calendar unavailable')
+
+    assert [failure['id'] for failure in journal.failed_bookings()] == [second['id'], first['id']]
+    assert [failure['id'] for failure in journal.failed_bookings(limit=1)] == [second['id']]
+
+
+def test_pending_booking_can_be_cancelled(journal):
+    booking = journal.reserve(clinic_datetime(MONDAY, 10), 'Dana', 'dana@example.com', 30)
+    assert [pending['id'] for pending in journal.pending_bookings('DANA@example.com')] == [booking['id']]
+
+    assert journal.cancel(booking['id'])
+
+    assert journal.pending_bookings('dana@example.com') == []
+    assert not journal.cancel(booking['id'])
+
+
+def test_pending_booking_can_be_moved(journal):
+    booking = journal.reserve(clinic_datetime(MONDAY, 10), 'Dana', 'dana@example.com', 30)
+    journal.reserve(clinic_datetime(MONDAY, 11), 'Noa', 'noa@example.com', 30)
+
+    assert journal.move(booking['id'], clinic_datetime(MONDAY, 11)) is None
+    moved = journal.move(booking['id'], clinic_datetime(MONDAY, 10, 30))
+
+    assert [pending['start'] for pending in journal.pending_bookings('dana@example.com')] == [moved['start']]
+    assert moved['start'] == clinic_datetime(MONDAY, 10, 30).isoformat()
+
+
+def test_event_of_booking_cancelled_during_replay_is_deleted(calendar, journal, sender):
+    start = clinic_datetime(MONDAY, 10)
+    booking = journal.reserve(start, 'Dana', 'dana@example.com', 30)
+    journal.cancel(booking['id'])
+
+    # The worker read the booking before it was cancelled
+    assert journal._replay(booking)
+
+    assert calendar.instances() == []
+    journal._fail(booking, 'calendar unavailable')
+    assert sender.sent == []
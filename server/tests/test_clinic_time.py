@@ -0,0 +1,40 @@
+from datetime import date, datetime, timezone
+from pages.appointment_processor import parse_appointment_request, is_date_in_past, is_datetime_in_past
+from pages.clinic_time import clinic_tz, clinic_today, clinic_datetime, to_clinic_time
+
+# Just after midnight at the clinic, while it is still the previous day in UTC
+JUST_AFTER_MIDNIGHT = clinic_datetime(date(2030, 1, 2), 0, 30)
+
+
+def test_clinic_date_rolls_over_at_clinic_midnight():
+    assert JUST_AFTER_MIDNIGHT.astimezone(timezone.utc).date() == date(2030, 1, 1)
+    assert clinic_today(JUST_AFTER_MIDNIGHT) == date(2030, 1, 2)
+    assert to_clinic_time(JUST_AFTER_MIDNIGHT.astimezone(timezone.utc)).date() == date(2030, 1, 2)
+
+
+def test_relative_dates_follow_the_clinic_date():
+    today = parse_appointment_request("today at 10:00", JUST_AFTER_MIDNIGHT)
+    tomorrow = parse_appointment_request("tomorrow at 10:00", JUST_AFTER_MIDNIGHT)
+
+    assert today["datetime"] == clinic_datetime(date(2030, 1, 2), 10)
+    assert tomorrow["datetime"] == clinic_datetime(date(2030, 1, 3), 10)
+
+
+def test_past_checks_use_the_clinic_clock():
+    assert is_date_in_past(date(2030, 1, 1), JUST_AFTER_MIDNIGHT)
+    assert not is_date_in_past(date(2030, 1, 2), JUST_AFTER_MIDNIGHT)
+    assert is_datetime_in_past(clinic_datetime(date(2030, 1, 2), 0, 15), JUST_AFTER_MIDNIGHT)
+    assert not is_datetime_in_past(clinic_datetime(date(2030, 1, 2), 8), JUST_AFTER_MIDNIGHT)
+
+
+def test_wall_clock_times_keep_their_hour_across_daylight_saving():
+    winter, summer = clinic_datetime(date(2030, 1, 15), 10), clinic_datetime(date(2030, 7, 15), 10)
+
+    assert to_clinic_time(winter.astimezone(timezone.utc)).hour == 10
+    assert to_clinic_time(summer.astimezone(timezone.utc)).hour == 10
+    assert winter.utcoffset() == clinic_tz.utcoffset(datetime(2030, 1, 15, 10))
+    assert summer.utcoffset() == clinic_tz.utcoffset(datetime(2030, 7, 15, 10))
+
+
+def test_naive_times_are_taken_as_clinic_time():
+    assert to_clinic_time(datetime(2030, 1, 2, 10)) == clinic_datetime(date(2030, 1, 2), 10)
@@ -0,0 +1,207 @@
+from datetime import date
+import jwt
+import pytest
+from pages.appointment_processor import Conversation, ConnectionConversation, handle_conversation_message, secret_key
+from pages.calendar_utils import create_appointment_event
+from pages.clinic_time import clinic_datetime
+
+MONDAY = date(2030, 1, 7)
+NOW = clinic_datetime(date(2030, 1, 1), 9)
+
+
+def token(email):
+    return jwt.encode({'email': email, 'name': email.split('@')[0]}, secret_key, algorithm='HS256')
+
+
+def patient(email):
+    return Conversation(token(email))
+
+
+def say(conversation, text):
+    return handle_conversation_message(text, conversation, NOW)
+
+
+def booked(email, day, hour):
+    """An appointment that is already on the calendar."""
+    return create_appointment_event(clinic_datetime(day, hour), email.split('@')[0], email)['id']
+
+
+@pytest.fixture
+def offer(clinic):
+    """B is on the waitlist for Monday mornings and has just been offered 10:00 on MONDAY."""
+    b = patient('b@example.com')
+    clinic.waitlist.join('b@example.com', 'b', {0}, 9 * 60, 12 * 60, now=NOW)
+    clinic.waitlist.slot_opened(clinic_datetime(MONDAY, 10), 30, NOW)
+    return b
+
+
+def test_offer_is_announced_before_it_can_be_taken(clinic, offer):
+    reply = say(offer, "yes please")
+    assert "slot opened up" in reply["message"]
+    assert clinic.journal.pending_intervals() == []
+
+    reply = say(offer, "yes please")
+    assert reply["status"] == "success"
+    assert clinic.journal.pending_intervals()[0][0] == clinic_datetime(MONDAY, 10)
+
+
+def test_message_with_its_own_time_is_not_an_offer_reply(clinic, offer):
+    say(offer, "hello")
+
+    reply = say(offer, "yes, I would like 9/1/2030 at 14:00 please")
+
+    assert reply["status"] == "success"
+    assert clinic.journal.pending_intervals()[0][0] == clinic_datetime(date(2030, 1, 9), 14)
+    assert clinic.waitlist.offer_for('b@example.com', NOW) is not None
+
+
+def test_waitlist_after_a_taken_slot_waits_for_that_date_and_time(clinic):
+    a, b = patient('a@example.com'), patient('b@example.com')
+    assert say(a, "8/1/2030 at 10:00")["status"] == "success"
+    assert "join the waitlist" in say(b, "8/1/2030 at 10:00")["message"]
+
+    reply = say(b, "join the waitlist")
+
+    assert "January 08, 2030 between 10:00 and 10:30" in reply["message"]
+    entry = clinic.waitlist.store.entries[clinic.waitlist.store.by_email['b@example.com']]
+    assert (entry['weekdays'], entry['first_day'], entry['last_day']) == ([1], '2030-01-08', '2030-01-08')
+
+
+def test_booking_still_in_journal_can_be_cancelled(clinic):
+    a = patient('a@example.com')
+    assert say(a, "8/1/2030 at 10:00")["status"] == "success"
+
+    reply = say(a, "cancel my appointment")
+
+    assert reply["status"] == "success"
+    assert "2030-01-08 at 10:00 has been cancelled" in reply["message"]
+    assert clinic.journal.pending_intervals() == []
+
+
+def test_booking_still_in_journal_can_be_rescheduled(clinic):
+    a = patient('a@example.com')
+    say(a, "8/1/2030 at 10:00")
+
+    reply = say(a, "reschedule my appointment to 9/1/2030 at 11:00")
+
+    assert reply["status"] == "success"
+    assert clinic.journal.pending_intervals()[0][0] == clinic_datetime(date(2030, 1, 9), 11)
+
+
+def test_no_booking_without_a_calendar(monkeypatch, clinic):
+    from pages import calendar_utils
+    monkeypatch.setattr(calendar_utils, 'service', None)
+
+    reply = say(patient('a@example.com'), "8/1/2030 at 10:00")
+
+    assert reply["status"] == "error"
+    assert "contact the clinic" in reply["message"]
+    assert clinic.journal.pending_intervals() == []
+
+
+def test_slow_calendar_falls_back_to_the_index(monkeypatch, clinic):
+    from pages import appointment_processor
+    timeouts = []
+
+    def unreachable(time_min, time_max, timeout=None):
+        timeouts.append(timeout)
+        return None
+    monkeypatch.setattr(appointment_processor, 'get_busy_intervals', unreachable)
+    clinic.index.add('b@example.com', 'event-1', clinic_datetime(date(2030, 1, 8), 10), 30)
+
+    assert "not available" in say(patient('a@example.com'), "8/1/2030 at 10:00")["message"]
+    assert say(patient('a@example.com'), "8/1/2030 at 11:00")["status"] == "success"
+    assert timeouts and set(timeouts) == {appointment_processor.BOOKING_FREEBUSY_TIMEOUT_SECONDS}
+
+
+def test_connection_state_survives_fallback_and_reconnect(clinic):
+    socket = ConnectionConversation(token('a@example.com'))
+    assert say(socket, "8/1/2030")["status"] == "waiting_for_time"
+
+    # The socket closed: the next message goes over POST, and a new socket picks up from there
+    assert patient('a@example.com').get_session()["pending_date"] == date(2030, 1, 8)
+    reconnected = ConnectionConversation(token('a@example.com'))
+    assert reconnected.get_session()["pending_date"] == date(2030, 1, 8)
+
+    assert say(patient('a@example.com'), "10:00")["status"] == "success"
+    assert ConnectionConversation(token('a@example.com')).get_session() == {}
+
+
+def test_cancel_asks_which_of_several_appointments(clinic):
+    a = patient('a@example.com')
+    booked('a@example.com', date(2030, 1, 8), 10)
+    kept = booked('a@example.com', date(2030, 1, 9), 11)
+
+    reply = say(a, "cancel my appointment")
+    assert reply["status"] == "waiting_for_date"
+    assert "January 08, 2030 at 10:00" in reply["message"] and "January 09, 2030 at 11:00" in reply["message"]
+
+    reply = say(a, "8/1/2030 at 10:00")
+
+    assert reply["status"] == "success"
+    assert "2030-01-08 at 10:00 has been cancelled" in reply["message"]
+    assert [event_id for _, event_id in clinic.index.find('a@example.com', NOW)] == [kept]
+
+
+def test_appointments_on_the_same_day_are_told_apart_by_time(clinic):
+    a = patient('a@example.com')
+    booked('a@example.com', date(2030, 1, 8), 10)
+    kept = booked('a@example.com', date(2030, 1, 8), 15)
+
+    reply = say(a, "cancel my appointment on 8/1/2030 at 10:00")
+
+    assert reply["status"] == "success"
+    assert [event_id for _, event_id in clinic.index.find('a@example.com', NOW)] == [kept]
+
+
+def test_cancel_on_a_day_without_an_appointment(clinic):
+    booked('a@example.com', date(2030, 1, 8), 10)
+
+    reply = say(patient('a@example.com'), "cancel my appointment on 10/1/2030")
+
+    assert reply["status"] == "error"
+    assert "no appointment on January 10, 2030" in reply["message"]
+    assert len(clinic.index.find('a@example.com', NOW)) == 1
+
+
+def test_other_patients_appointments_are_not_offered(clinic):
+    booked('b@example.com', date(2030, 1, 8), 10)
+
+    reply = say(patient('a@example.com'), "cancel my appointment")
+
+    assert "couldn't find any upcoming appointments" in reply["message"]
+
+
+def test_reschedule_moves_the_named_appointment(clinic):
+    a = patient('a@example.com')
+    booked('a@example.com', date(2030, 1, 8), 10)
+    moved = booked('a@example.com', date(2030, 1, 9), 11)
+
+    reply = say(a, "reschedule my appointment on 9/1/2030 to 10/1/2030 at 12:00")
+
+    assert reply["status"] == "success"
+    assert reply["event_id"] == moved
+    starts = sorted(start for start, _ in clinic.index.find('a@example.com', NOW))
+    assert starts == [clinic_datetime(date(2030, 1, 8), 10), clinic_datetime(date(2030, 1, 10), 12)]
+
+
+def test_reschedule_keeps_the_new_time_while_asking_which_appointment(clinic):
+    a = patient('a@example.com')
+    booked('a@example.com', date(2030, 1, 8), 10)
+    booked('a@example.com', date(2030, 1, 9), 11)
+
+    assert say(a, "reschedule my appointment to 10/1/2030 at 12:00")["status"] == "waiting_for_date"
+    reply = say(a, "8/1/2030")
+
+    assert reply["status"] == "success"
+    assert "moved to 2030-01-10 at 12:00" in reply["message"]
+
+
+def test_reschedule_to_a_taken_slot_is_refused(clinic):
+    booked('a@example.com', date(2030, 1, 8), 10)
+    booked('b@example.com', date(2030, 1, 9), 11)
+
+    reply = say(patient('a@example.com'), "reschedule my appointment to 9/1/2030 at 11:00")
+
+    assert reply["status"] != "success"
+    assert [start for start, _ in clinic.index.find('a@example.com', NOW)] == [clinic_datetime(date(2030, 1, 8), 10)]
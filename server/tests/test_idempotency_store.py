@@ -0,0 +1,77 @@
+import pytest
+from pages import idempotency_store as idempotency
+from pages.idempotency_store import IdempotencyStore, NEW, IN_PROGRESS, COMPLETED, MISMATCH, fingerprint_request
+
+FIRST = fingerprint_request({'text': '8/1/2030 at 10:00'})
+OTHER = fingerprint_request({'text': '9/1/2030 at 11:00'})
+
+
+@pytest.fixture(params=['memory', 'redis'])
+def store(request):
+    """The store on in-process entries and, where fakeredis is installed, on Redis."""
+    if request.param == 'redis':
+        fakeredis = pytest.importorskip('fakeredis')
+        return IdempotencyStore(60, 100, redis_client=fakeredis.FakeRedis())
+    return IdempotencyStore(60, 100)
+
+
+def test_retry_while_running_is_not_run_again(store):
+    assert store.begin('key', FIRST) == (NEW, None)
+    assert store.begin('key', FIRST) == (IN_PROGRESS, None)
+
+
+def test_retry_after_completion_gets_the_stored_response(store):
+    store.begin('key', FIRST)
+    store.complete('key', {'message': 'Appointment scheduled', 'status': 'success'})
+
+    assert store.begin('key', FIRST) == (COMPLETED, {'message': 'Appointment scheduled', 'status': 'success'})
+
+
+def test_reused_key_with_another_message_is_a_mismatch(store):
+    store.begin('key', FIRST)
+    assert store.begin('key', OTHER) == (MISMATCH, None)
+    store.complete('key', {'message': 'done', 'status': 'success'})
+    assert store.begin('key', OTHER) == (MISMATCH, None)
+
+
+def test_released_key_can_be_retried(store):
+    store.begin('key', FIRST)
+    store.release('key')
+
+    assert store.begin('key', FIRST) == (NEW, None)
+
+
+def test_fingerprint_ignores_key_order():
+    assert fingerprint_request({'text': 'hi', 'session_id': 's'}) == fingerprint_request({'session_id': 's', 'text': 'hi'})
+
+
+def test_entries_expire(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(idempotency.time, 'monotonic', lambda: clock[0])
+    store = IdempotencyStore(60, 100)
+    store.begin('key', FIRST)
+    store.complete('key', {'message': 'done', 'status': 'success'})
+
+    clock[0] += 59
+    assert store.begin('key', FIRST)[0] == COMPLETED
+    clock[0] += 2
+    assert store.begin('key', FIRST) == (NEW, None)
+
+
+def test_oldest_entries_are_dropped_when_full():
+    store = IdempotencyStore(60, 2)
+    for key in ('a', 'b', 'c'):
+        store.begin(key, FIRST)
+
+    assert store.begin('a', FIRST) == (NEW, None)
+    assert store.begin('c', FIRST) == (IN_PROGRESS, None)
+
+
+def test_redis_entries_expire():
+    fakeredis = pytest.importorskip('fakeredis')
+    client = fakeredis.FakeRedis()
+    store = IdempotencyStore(60, 100, redis_client=client)
+    store.begin('key', FIRST)
+    store.complete('key', {'message': 'done', 'status': 'success'})
+
+    assert 0 < client.ttl('idempotency:key') <= 60
@@ -0,0 +1,79 @@
+from datetime import date
+from pages.appointment_processor import find_best_fit_slot
+from pages.clinic_time import clinic_datetime
+from pages.interval_tree import IntervalTree
+
+MONDAY = date(2030, 1, 7)
+FRIDAY = date(2030, 1, 11)
+SATURDAY = date(2030, 1, 12)
+
+
+def at(hour, minute=0, day=MONDAY):
+    return clinic_datetime(day, hour, minute)
+
+
+def test_overlapping_uses_half_open_intervals():
+    tree = IntervalTree([(1, 3), (3, 5), (6, 9), (2, 8)])
+    assert sorted(tree.overlapping(3, 4)) == [(2, 8), (3, 5)]
+    assert sorted(tree.overlapping(0, 1)) == []
+    assert sorted(tree.overlapping(5, 6)) == [(2, 8)]
+    assert tree.is_free(9, 12)
+    assert not tree.is_free(8, 10)
+
+
+def test_overlapping_matches_a_scan():
+    intervals = [(start, start + length) for start, length in zip(range(0, 200, 7), [3, 11, 5, 20, 1] * 6)]
+    tree = IntervalTree(intervals)
+    for start in range(0, 210, 5):
+        for end in range(start + 1, start + 30, 4):
+            expected = sorted(interval for interval in intervals if interval[0] < end and interval[1] > start)
+            assert sorted(tree.overlapping(start, end)) == expected
+
+
+
+def test_free_gaps_match_a_scan():
+    intervals = [(start, start + length) for start, length in zip(range(0, 200, 7), [3, 11, 5, 20, 1] * 6)]
+    tree = IntervalTree(intervals)
+    for start in range(0, 210, 5):
+        for end in range(start + 1, start + 30, 4):
+            free = [minute for minute in range(start, end) if all(not a <= minute < b for a, b in intervals)]
+            gaps = tree.free_gaps(start, end)
+            assert [minute for gap_start, gap_end in gaps for minute in range(gap_start, gap_end)] == free
+            assert all(a[1] < b[0] for a, b in zip(gaps, gaps[1:]))
+
+def test_free_gaps_between_bookings():
+    tree = IntervalTree([(at(9), at(10)), (at(9, 30), at(11)), (at(13), at(14))])
+    assert tree.free_gaps(at(8), at(19, 30)) == [(at(8), at(9)), (at(11), at(13)), (at(14), at(19, 30))]
+
+
+def test_free_gaps_clip_to_window():
+    tree = IntervalTree([(at(7), at(9)), (at(18), at(20))])
+    assert tree.free_gaps(at(8), at(19)) == [(at(9), at(18))]
+    assert tree.free_gaps(at(18, 30), at(19)) == []
+    assert IntervalTree([]).free_gaps(at(8), at(9)) == [(at(8), at(9))]
+
+
+def test_best_fit_prefers_smallest_gap():
+    # A one-hour gap 10:00-11:00 and the long afternoon stretch after 12:00
+    tree = IntervalTree([(at(8), at(10)), (at(11), at(12))])
+    assert find_best_fit_slot(tree, MONDAY, 60, 30) == at(10)
+    assert find_best_fit_slot(tree, MONDAY, 90, 30) == at(12)
+
+
+def test_best_fit_takes_earliest_of_equal_gaps():
+    tree = IntervalTree([(at(8, 30), at(9)), (at(9, 30), at(19, 30))])
+    assert find_best_fit_slot(tree, MONDAY, 30, 30) == at(8)
+
+
+def test_best_fit_aligns_to_granularity():
+    tree = IntervalTree([(at(8), at(10, 10)), (at(11), at(19, 30))])
+    assert find_best_fit_slot(tree, MONDAY, 30, 30) == at(10, 30)
+    assert find_best_fit_slot(tree, MONDAY, 45, 15) == at(10, 15)
+    assert find_best_fit_slot(tree, MONDAY, 60, 30) is None
+
+
+def test_best_fit_respects_not_before_and_closed_days():
+    tree = IntervalTree([])
+    assert find_best_fit_slot(tree, MONDAY, 30, 30, not_before=at(14, 5)) == at(14, 30)
+    assert find_best_fit_slot(tree, FRIDAY, 60, 30, not_before=at(11, 45, FRIDAY)) is None
+    assert find_best_fit_slot(tree, SATURDAY, 30, 30) is None
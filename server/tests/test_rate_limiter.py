@@ -0,0 +1,56 @@
+import random
+import pytest
+from pages.rate_limiter import SlidingWindowRateLimiter
+
+
+def redis_client():
+    fakeredis = pytest.importorskip('fakeredis')
+    return fakeredis.FakeRedis()
+
+
+@pytest.fixture(params=['memory', 'redis'])
+def make_limiter(request):
+    """Limiters on the in-process counters and, where fakeredis is installed, on Redis."""
+    def make(limit=20, window_seconds=60):
+        if request.param == 'redis':
+            return SlidingWindowRateLimiter(limit, window_seconds, redis_client=redis_client())
+        return SlidingWindowRateLimiter(limit, window_seconds)
+    return make
+
+
+def test_allows_up_to_the_limit(make_limiter):
+    limiter = make_limiter(limit=3)
+    assert [limiter.hit('a', now=0.5)[0] for _ in range(4)] == [True, True, True, False]
+    assert limiter.hit('b', now=0.5) == (True, 0)
+
+
+def test_previous_window_is_weighted(make_limiter):
+    limiter = make_limiter(limit=10)
+    for _ in range(10):
+        limiter.hit('a', now=59)
+    # A quarter of the previous window still overlaps: 10 * 0.75 = 7.5 requests
+    assert [limiter.hit('a', now=75)[0] for _ in range(3)] == [True, True, True]
+    assert not limiter.hit('a', now=75)[0]
+
+
+def test_rejected_requests_are_not_counted(make_limiter):
+    limiter = make_limiter(limit=20)
+    for _ in range(25):
+        limiter.hit('a', now=30)
+
+    allowed, retry_after = limiter.hit('a', now=30)
+    assert not allowed
+    assert limiter.hit('a', now=30 + retry_after)[0]
+
+
+def test_waiting_retry_after_always_lets_the_client_through(make_limiter):
+    randomness = random.Random(7)
+    for _ in range(30):
+        limiter = make_limiter(limit=randomness.randint(1, 10), window_seconds=60)
+        now = 0.0
+        for _ in range(200):
+            now += randomness.uniform(0, 5)
+            allowed, retry_after = limiter.hit('a', now=now)
+            if not allowed:
+                now += retry_after
+                assert limiter.hit('a', now=now)[0]
@@ -0,0 +1,34 @@
+from pages.request_profiler import ProfileStore
+
+
+def captured(path):
+    return {'path': path, 'captured_at': '2030-01-01T09:00:00+00:00', 'stats': b'stats', 'summary': 'summary'}
+
+
+def test_profiles_are_shared_between_workers(tmp_path):
+    worker_a, worker_b = ProfileStore(str(tmp_path), 5), ProfileStore(str(tmp_path), 5)
+
+    first = worker_a.add(captured('/appointment'))
+    second = worker_b.add(captured('/appointment'))
+
+    assert first != second
+    assert worker_b.get(first)['stats'] == b'stats'
+    assert worker_a.get(second)['summary'] == 'summary'
+    assert {profile['id'] for profile in worker_a.list()} == {first, second}
+
+
+def test_only_the_newest_profiles_are_kept(tmp_path):
+    store = ProfileStore(str(tmp_path), 2)
+    ids = [store.add(captured(f'/{n}')) for n in range(4)]
+
+    assert store.get(ids[0]) is None
+    assert store.get(ids[3]) is not None
+    assert len(store.list()) == 2
+    assert len(list(tmp_path.iterdir())) == 4
+
+
+def test_unknown_ids_are_not_found(tmp_path):
+    store = ProfileStore(str(tmp_path), 2)
+    assert store.get('1') is None
+    assert store.get('../' * 3 + 'etc/passwd') is None
+    assert ProfileStore(str(tmp_path / 'missing'), 2).list() == []
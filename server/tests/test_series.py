@@ -0,0 +1,89 @@
+from datetime import date, timedelta
+from pages.appointment_processor import (
+    DEFAULT_APPOINTMENT_TYPE, parse_series_request, expand_series, find_series_conflicts, book_series
+)
+from pages.calendar_utils import create_appointment_event
+from pages.clinic_time import clinic_datetime, to_clinic_time
+
+NOW = clinic_datetime(date(2030, 1, 1), 9)
+
+
+def series(text, now=NOW):
+    parsed, error_response = parse_series_request(text, DEFAULT_APPOINTMENT_TYPE, now)
+    assert error_response is None, error_response
+    return parsed
+
+
+def test_series_starts_on_the_next_weekday_still_ahead():
+    assert series("every Tuesday at 10:00 for 8 weeks")['first_date'] == date(2030, 1, 1)
+    assert series("every Tuesday at 08:00 for 8 weeks")['first_date'] == date(2030, 1, 8)
+    assert series("every Thursday at 10:00 for 8 weeks")['first_date'] == date(2030, 1, 3)
+
+
+def test_series_length_in_weeks_or_appointments():
+    weekly = series("every Tuesday at 10:00 for 8 weeks")
+    assert (weekly['count'], weekly['interval_weeks']) == (8, 1)
+    every_other = series("every other Tuesday at 10:00 for 8 weeks")
+    assert (every_other['count'], every_other['interval_weeks']) == (4, 2)
+    assert series("every Tuesday at 10:00, 6 times")['count'] == 6
+
+
+def test_series_needs_a_length_and_a_limit():
+    assert parse_series_request("every Tuesday at 10:00", DEFAULT_APPOINTMENT_TYPE, NOW)[1]["status"] == "error"
+    too_long = parse_series_request("every Tuesday at 10:00, 30 times", DEFAULT_APPOINTMENT_TYPE, NOW)[1]
+    assert "at most" in too_long["message"]
+
+
+def test_expansion_keeps_the_wall_clock_time_across_daylight_saving():
+    occurrences = expand_series(series("every Sunday at 10:00 for 10 weeks", now=clinic_datetime(date(2030, 3, 1), 9)))
+
+    assert len(occurrences) == 10
+    assert all(to_clinic_time(occurrence).strftime('%A %H:%M') == 'Sunday 10:00' for occurrence in occurrences)
+    assert [b - a for a, b in zip(occurrences, occurrences[1:])].count(timedelta(weeks=1)) == 8
+    assert occurrences[0].utcoffset() != occurrences[-1].utcoffset()
+
+
+def test_every_other_week_skips_a_week():
+    occurrences = expand_series(series("every other Wednesday at 10:00 for 6 weeks"))
+    assert [occurrence.date() for occurrence in occurrences] == [date(2030, 1, 2), date(2030, 1, 16), date(2030, 1, 30)]
+
+
+def test_conflicts_are_the_taken_occurrences(clinic):
+    occurrences = expand_series(series("every Tuesday at 10:00 for 4 weeks"))
+    create_appointment_event(clinic_datetime(date(2030, 1, 15), 10), 'b', 'b@example.com')
+    clinic.journal.reserve(clinic_datetime(date(2030, 1, 22), 10, 15), 'c', 'c@example.com', 30)
+
+    assert find_series_conflicts(occurrences, 30) == [occurrences[2], occurrences[3]]
+
+
+def test_series_with_conflicts_waits_for_confirmation(clinic):
+    weekly = series("every Tuesday at 10:00 for 4 weeks")
+    create_appointment_event(clinic_datetime(date(2030, 1, 8), 10), 'b', 'b@example.com')
+
+    reply = book_series(weekly, 'a', 'a@example.com')
+    assert reply["status"] == "waiting_for_confirmation"
+    assert "January 08, 2030" in reply["message"]
+    assert clinic.journal.pending_intervals() == []
+
+    reply = book_series(weekly, 'a', 'a@example.com', confirmed=True)
+
+    assert reply["status"] == "success"
+    booking, = clinic.journal.pending_bookings('a@example.com')
+    assert len(booking['occurrences']) == 3
+    assert any(line.startswith('EXDATE') for line in booking['recurrence'])
+
+
+def test_fully_booked_series_is_refused(clinic):
+    weekly = series("every Tuesday at 10:00 for 2 weeks")
+    for day in (date(2030, 1, 1), date(2030, 1, 8)):
+        create_appointment_event(clinic_datetime(day, 10), 'b', 'b@example.com')
+
+    reply = book_series(weekly, 'a', 'a@example.com', confirmed=True)
+
+    assert reply["status"] == "error"
+    assert clinic.journal.pending_bookings('a@example.com') == []
+
+
+def test_series_outside_clinic_hours_is_refused(clinic):
+    reply = book_series(series("every Friday at 14:00 for 4 weeks"), 'a', 'a@example.com')
+    assert "outside of clinic hours" in reply["message"]
@@ -0,0 +1,195 @@
+from datetime import date, timedelta
+import pytest
+from pages.clinic_time import clinic_datetime
+from pages.waitlist import Waitlist, LoggingOfferSender, WAITLIST_ENTRY_DAYS
+
+MONDAY = date(2030, 1, 7)
+NOW = clinic_datetime(MONDAY - timedelta(days=1), 9)
+MORNING = (9 * 60, 12 * 60)
+
+
+@pytest.fixture
+def sender():
+    return LoggingOfferSender()
+
+
+def redis_client():
+    fakeredis = pytest.importorskip('fakeredis')
+    # The Redis lock runs a Lua script
+    pytest.importorskip('lupa')
+    return fakeredis.FakeRedis()
+
+
+@pytest.fixture(params=['memory', 'redis'])
+def waitlist(request, sender):
+    """The same tests run against the in-process store and, where fakeredis is installed, the Redis one."""
+    if request.param == 'redis':
+        return Waitlist(sender, offer_minutes=30, redis_client=redis_client())
+    return Waitlist(sender, offer_minutes=30)
+
+
+def at(hour, minute=0, day=MONDAY):
+    return clinic_datetime(day, hour, minute)
+
+
+def offered(sender):
+    return [(offer['user_email'], offer['start'], offer['duration_minutes']) for offer in sender.sent]
+
+
+def test_slot_goes_to_first_patient_who_can_take_it(waitlist, sender):
+    waitlist.join('tuesday@example.com', 'Tue', {1}, *MORNING, now=NOW)
+    waitlist.join('afternoon@example.com', 'Aft', {0}, 14 * 60, 17 * 60, now=NOW)
+    waitlist.join('first@example.com', 'First', {0}, *MORNING, now=NOW)
+    waitlist.join('second@example.com', 'Second', {0}, *MORNING, now=NOW)
+
+    waitlist.slot_opened(at(10), 30, NOW)
+
+    assert offered(sender) == [('first@example.com', at(10), 30)]
+    assert waitlist.offer_for('FIRST@example.com', NOW)['start'] == at(10)
+    assert waitlist.offer_for('second@example.com', NOW) is None
+
+
+def test_slot_must_fit_window_length_and_granularity(waitlist, sender):
+    waitlist.join('long@example.com', 'Long', {0}, *MORNING, duration_minutes=60, now=NOW)
+    waitlist.join('late@example.com', 'Late', {0}, 11 * 60, 12 * 60, now=NOW)
+    waitlist.join('hourly@example.com', 'Hourly', {0}, *MORNING, granularity=60, now=NOW)
+    waitlist.join('fits@example.com', 'Fits', {0}, *MORNING, now=NOW)
+
+    waitlist.slot_opened(at(10, 30), 30, NOW)
+
+    assert offered(sender) == [('fits@example.com', at(10, 30), 30)]
+
+
+def test_longer_slot_is_split_between_patients(waitlist, sender):
+    waitlist.join('a@example.com', 'A', {0}, *MORNING, now=NOW)
+    waitlist.join('b@example.com', 'B', {0}, *MORNING, now=NOW)
+
+    waitlist.slot_opened(at(10), 60, NOW)
+
+    assert offered(sender) == [('a@example.com', at(10), 30), ('b@example.com', at(10, 30), 30)]
+
+
+def test_past_slot_is_not_offered(waitlist, sender):
+    waitlist.join('a@example.com', 'A', {6}, *MORNING, now=NOW)
+    waitlist.slot_opened(NOW - timedelta(minutes=30), 30, NOW)
+    assert sender.sent == []
+
+
+def test_expired_offer_passes_to_next_patient(waitlist, sender):
+    waitlist.join('a@example.com', 'A', {0}, *MORNING, now=NOW)
+    waitlist.join('b@example.com', 'B', {0}, *MORNING, now=NOW)
+    waitlist.slot_opened(at(10), 30, NOW)
+
+    later = NOW + timedelta(minutes=31)
+    waitlist.expire_offers(later)
+
+    assert offered(sender) == [('a@example.com', at(10), 30), ('b@example.com', at(10), 30)]
+    assert waitlist.offer_for('a@example.com', later) is None
+    # A stays on the waitlist for the next slot, but is not offered this one again
+    waitlist.expire_offers(later + timedelta(minutes=31))
+    assert len(sender.sent) == 2
+    waitlist.slot_opened(at(11), 30, later)
+    assert offered(sender)[-1] == ('a@example.com', at(11), 30)
+
+
+def test_declined_offer_passes_to_next_patient(waitlist, sender):
+    waitlist.join('a@example.com', 'A', {0}, *MORNING, now=NOW)
+    waitlist.join('b@example.com', 'B', {0}, *MORNING, now=NOW)
+    waitlist.slot_opened(at(10), 30, NOW)
+
+    assert waitlist.decline('a@example.com', NOW)['start'] == at(10)
+
+    assert offered(sender)[-1] == ('b@example.com', at(10), 30)
+    assert waitlist.decline('a@example.com', NOW) is None
+
+
+def test_taken_offer_is_closed(waitlist, sender):
+    waitlist.join('a@example.com', 'A', {0}, *MORNING, now=NOW)
+    waitlist.slot_opened(at(10), 30, NOW)
+
+    assert waitlist.take_offer('a@example.com', NOW)['start'] == at(10)
+    assert waitlist.offer_for('a@example.com', NOW) is None
+    assert waitlist.take_offer('a@example.com', NOW) is None
+
+
+def test_leaving_drops_entry_and_offer(waitlist, sender):
+    waitlist.join('a@example.com', 'A', {0}, *MORNING, now=NOW)
+    waitlist.slot_opened(at(10), 30, NOW)
+
+    assert waitlist.leave('a@example.com')
+    assert waitlist.offer_for('a@example.com', NOW) is None
+    assert not waitlist.leave('a@example.com')
+    waitlist.slot_opened(at(11), 30, NOW)
+    assert len(sender.sent) == 1
+
+
+def test_joining_again_replaces_entry(waitlist, sender):
+    waitlist.join('a@example.com', 'A', {0}, *MORNING, now=NOW)
+    waitlist.join('a@example.com', 'A', {0}, 14 * 60, 17 * 60, now=NOW)
+
+    waitlist.slot_opened(at(10), 30, NOW)
+    assert sender.sent == []
+    waitlist.slot_opened(at(15), 30, NOW)
+    assert offered(sender) == [('a@example.com', at(15), 30)]
+
+
+def test_slot_of_an_event_is_offered_once(waitlist, sender):
+    waitlist.join('a@example.com', 'A', {0}, *MORNING, now=NOW)
+    waitlist.join('b@example.com', 'B', {0}, *MORNING, now=NOW)
+
+    waitlist.slot_opened(at(10), 30, NOW, 'event-1')
+    # The index sync sees the same cancellation later
+    waitlist.slot_opened(at(10), 30, NOW + timedelta(minutes=5), 'event-1')
+
+    assert offered(sender) == [('a@example.com', at(10), 30)]
+
+
+def test_offer_is_announced_once(waitlist):
+    waitlist.join('a@example.com', 'A', {0}, *MORNING, now=NOW)
+    waitlist.slot_opened(at(10), 30, NOW)
+
+    assert waitlist.mark_announced('a@example.com')
+    assert not waitlist.mark_announced('a@example.com')
+    assert waitlist.offer_for('a@example.com', NOW)['announced']
+
+
+def test_workers_share_waitlist_through_redis():
+    store = redis_client()
+    first_sender, second_sender = LoggingOfferSender(), LoggingOfferSender()
+    first = Waitlist(first_sender, offer_minutes=30, redis_client=store)
+    second = Waitlist(second_sender, offer_minutes=30, redis_client=store)
+
+    first.join('a@example.com', 'A', {0}, *MORNING, now=NOW)
+    second.join('b@example.com', 'B', {0}, *MORNING, now=NOW)
+    second.slot_opened(at(10), 30, NOW, 'event-1')
+    first.slot_opened(at(10), 30, NOW, 'event-1')
+
+    assert offered(second_sender) == [('a@example.com', at(10), 30)]
+    assert first_sender.sent == []
+    assert first.offer_for('a@example.com', NOW)['start'] == at(10)
+
+    # An offer that expires is passed on by whichever worker notices first
+    later = NOW + timedelta(minutes=31)
+    assert first.offer_for('a@example.com', later) is None
+    assert offered(first_sender) == [('b@example.com', at(10), 30)]
+    assert second.take_offer('b@example.com', later)['start'] == at(10)
+    assert first.leave('b@example.com')
+    assert not second.leave('b@example.com')
+
+
+def test_entry_only_takes_slots_between_its_days(waitlist, sender):
+    waitlist.join('a@example.com', 'A', {0}, *MORNING, first_day=MONDAY, last_day=MONDAY, now=NOW)
+
+    waitlist.slot_opened(at(10, day=MONDAY + timedelta(weeks=1)), 30, NOW)
+    assert sender.sent == []
+    waitlist.slot_opened(at(10), 30, NOW)
+    assert offered(sender) == [('a@example.com', at(10), 30)]
+
+
+def test_weekday_entry_ends_after_entry_days(waitlist, sender):
+    entry = waitlist.join('a@example.com', 'A', {0}, *MORNING, now=NOW)
+    assert entry['last_day'] == (NOW.date() + timedelta(days=WAITLIST_ENTRY_DAYS)).isoformat()
+
+    far = MONDAY + timedelta(weeks=8)
+    waitlist.slot_opened(at(10, day=far), 30, NOW)
+    assert sender.sent == []